@@ -1,5 +1,117 @@
-from django.contrib import admin
-from .models import Location, Route, Bus, RouteBus, Seat, Booking, BookingSeat
+from datetime import date, timedelta
+
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.http import FileResponse, Http404, HttpResponseRedirect, StreamingHttpResponse
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from django.utils.html import format_html
+from .models import (
+    Location, Route, Bus, RouteBus, Seat, Booking, BookingSeat, TripInventory, FareRule, ArchivedBooking,
+    ArchivedBookingSeat,
+)
+from .analytics import csv_lines, report_totals, trip_report
+from .exports import export_path, export_status, start_booking_export
+from .inventory import ACTIVE_BOOKING_STATUSES, rebuild_trip_inventory
+from .pagination import EstimatedCountPaginator
+from .reservations import cancel_booking, refresh_seat_counts
+
+# Trips shown on the report page; the CSV download has all of them
+REPORT_PREVIEW_ROWS = 100
+
+# What a booking's __str__ reads
+BOOKING_LABEL_RELATED = ['user', 'route_bus__route__origin', 'route_bus__route__destination', 'route_bus__bus']
+
+
+class AutocompleteFilter(admin.SimpleListFilter):
+    """List filter that picks a related object through the admin's autocomplete search
+
+    The stock related-field filter links every row of the related table;
+    this renders one select box that fetches matches as the user types.
+    Build one with autocomplete_filter().
+    """
+
+    template = 'admin/booking/autocomplete_filter.html'
+    field_name = None
+
+    def __init__(self, request, params, model, model_admin):
+        super().__init__(request, params, model, model_admin)
+        field = model._meta.get_field(self.field_name)
+        # The related admin's queryset joins whatever the chosen object's label needs
+        related_admin = model_admin.admin_site.get_model_admin(field.remote_field.model)
+        choices = forms.ModelChoiceField(
+            related_admin.get_queryset(request), required=False,
+            widget=AutocompleteSelect(field, model_admin.admin_site, attrs={'id': f'filter-{self.field_name}'}),
+        )
+        self.widget = choices.widget
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def has_output(self):
+        return True
+
+    def queryset(self, request, queryset):
+        if self.value():
+            try:
+                return queryset.filter(**{self.parameter_name: self.value()})
+            except (ValueError, ValidationError) as e:
+                raise IncorrectLookupParameters(e)
+
+    def choices(self, changelist):
+        self.select_url = changelist.get_query_string({self.parameter_name: '__pk__'})
+        self.clear_url = changelist.get_query_string(remove=[self.parameter_name])
+        yield {'selected': not self.value(), 'query_string': self.clear_url, 'display': 'All'}
+
+    def render_widget(self):
+        return self.widget.render(self.parameter_name, self.value())
+
+
+def autocomplete_filter(field_name, title=None):
+    """An AutocompleteFilter on a foreign key; the related admin needs search_fields"""
+    return type(f'{field_name.title().replace("_", "")}AutocompleteFilter', (AutocompleteFilter,), {
+        'field_name': field_name,
+        'parameter_name': f'{field_name}__id__exact',
+        'title': title or field_name.replace('_', ' '),
+    })
+
+
+class ScalableModelAdmin(admin.ModelAdmin):
+    """ModelAdmin for tables that grow to millions of rows
+
+    list_select_related is joined into every query the admin makes, so
+    autocomplete results and change forms don't run a query per related
+    __str__ either. Counts stop at the paginator's limit instead of scanning
+    the table, and the "N total" count is never run.
+    """
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if self.list_select_related:
+            queryset = queryset.select_related(*self.list_select_related)
+        return queryset
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name in self.autocomplete_fields and 'queryset' not in kwargs:
+            # The chosen object's label comes from the related admin's joined queryset
+            related_admin = self.admin_site.get_model_admin(db_field.remote_field.model)
+            kwargs['queryset'] = related_admin.get_queryset(request)
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+    @property
+    def media(self):
+        media = super().media
+        for list_filter in self.list_filter:
+            if isinstance(list_filter, type) and issubclass(list_filter, AutocompleteFilter):
+                field = self.model._meta.get_field(list_filter.field_name)
+                return media + AutocompleteSelect(field, self.admin_site).media
+        return media
 
 
 @admin.register(Location)
@@ -11,9 +123,10 @@ class LocationAdmin(admin.ModelAdmin):
 
 
 @admin.register(Route)
-class RouteAdmin(admin.ModelAdmin):
+class RouteAdmin(ScalableModelAdmin):
     list_display = ['origin', 'destination', 'distance', 'base_price', 'created_at']
-    list_filter = ['created_at', 'origin', 'destination']
+    list_filter = ['created_at', autocomplete_filter('origin'), autocomplete_filter('destination')]
+    list_select_related = ['origin', 'destination']
     search_fields = ['origin__name', 'destination__name']
     ordering = ['origin', 'destination']
     autocomplete_fields = ['origin', 'destination']
@@ -28,15 +141,15 @@ class SeatInline(admin.TabularInline):
 
 @admin.register(Bus)
 class BusAdmin(admin.ModelAdmin):
-    list_display = ['name', 'bus_type', 'total_seats', 'created_at']
+    list_display = ['name', 'code', 'bus_type', 'total_seats', 'created_at']
     list_filter = ['bus_type', 'created_at']
-    search_fields = ['name']
+    search_fields = ['name', 'code']
     ordering = ['name']
     inlines = [SeatInline]
     
     fieldsets = (
         ('Basic Information', {
-            'fields': ('name', 'bus_type', 'total_seats')
+            'fields': ('name', 'code', 'bus_type', 'total_seats')
         }),
         ('Seat Layout Configuration', {
             'fields': ('seat_layout',),
@@ -46,9 +159,10 @@ class BusAdmin(admin.ModelAdmin):
 
 
 @admin.register(RouteBus)
-class RouteBusAdmin(admin.ModelAdmin):
+class RouteBusAdmin(ScalableModelAdmin):
     list_display = ['route', 'bus', 'departure_time', 'arrival_time', 'created_at']
-    list_filter = ['created_at', 'bus__bus_type', 'route']
+    list_filter = ['created_at', 'bus__bus_type', autocomplete_filter('route')]
+    list_select_related = ['route__origin', 'route__destination', 'bus']
     search_fields = ['route__origin__name', 'route__destination__name', 'bus__name']
     ordering = ['route', 'departure_time']
     autocomplete_fields = ['route', 'bus']
@@ -64,36 +178,96 @@ class RouteBusAdmin(admin.ModelAdmin):
 
 
 @admin.register(Seat)
-class SeatAdmin(admin.ModelAdmin):
+class SeatAdmin(ScalableModelAdmin):
     list_display = ['bus', 'seat_number', 'row', 'column', 'seat_type', 'is_active']
-    list_filter = ['bus', 'seat_type', 'is_active']
+    list_filter = [autocomplete_filter('bus'), 'seat_type', 'is_active']
+    list_select_related = ['bus']
     search_fields = ['bus__name', 'seat_number']
     ordering = ['bus', 'row', 'column']
     autocomplete_fields = ['bus']
 
 
+class TripReportForm(forms.Form):
+    start = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    end = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    route = forms.ModelChoiceField(Route.objects.select_related('origin', 'destination'), required=False)
+
+
+def check_seats_free(claims, route_bus, travel_date, seat_ids):
+    """Raise ValidationError if other active booking seats hold any of the seats on a trip"""
+    taken = list(
+        claims.filter(route_bus=route_bus, travel_date=travel_date, seat_id__in=seat_ids, is_active=True)
+        .order_by('seat__seat_number').values_list('seat__seat_number', flat=True)
+    )
+    if taken:
+        raise ValidationError(f'Seats already booked on this trip by another booking: {", ".join(taken)}.')
+
+
+class BookingAdminForm(forms.ModelForm):
+    class Meta:
+        model = Booking
+        fields = '__all__'
+
+    def clean(self):
+        cleaned_data = super().clean()
+        route_bus, travel_date = cleaned_data.get('route_bus'), cleaned_data.get('travel_date')
+        # Reactivating or moving a booking must not take seats that were sold again meanwhile
+        if self.instance.pk and route_bus and travel_date and cleaned_data.get('status') in ACTIVE_BOOKING_STATUSES:
+            check_seats_free(
+                BookingSeat.objects.exclude(booking=self.instance), route_bus, travel_date,
+                self.instance.booking_seats.values_list('seat_id', flat=True),
+            )
+        return cleaned_data
+
+
+class BookingSeatAdminForm(forms.ModelForm):
+    class Meta:
+        model = BookingSeat
+        fields = '__all__'
+
+    def clean(self):
+        cleaned_data = super().clean()
+        booking, seat = cleaned_data.get('booking'), cleaned_data.get('seat')
+        if booking and seat and booking.status in ACTIVE_BOOKING_STATUSES:
+            claims = BookingSeat.objects.exclude(pk=self.instance.pk) if self.instance.pk else BookingSeat.objects.all()
+            check_seats_free(claims, booking.route_bus_id, booking.travel_date, [seat.id])
+        return cleaned_data
+
+
 class BookingSeatInline(admin.TabularInline):
     model = BookingSeat
     extra = 0
-    readonly_fields = ['seat', 'price']
+    fields = ['seat', 'price', 'is_active']
+    readonly_fields = ['seat', 'price', 'is_active']
     can_delete = False
 
+    def get_queryset(self, request):
+        # Each row is labelled with its booking and seat
+        related = [f'booking__{name}' for name in BOOKING_LABEL_RELATED]
+        return super().get_queryset(request).select_related('seat__bus', *related)
+
 
 @admin.register(Booking)
-class BookingAdmin(admin.ModelAdmin):
-    list_display = ['id', 'user', 'route_bus', 'booking_date', 'travel_date', 'total_price', 'status', 'created_at']
-    list_filter = ['status', 'created_at', 'booking_date', 'travel_date']
+class BookingAdmin(ScalableModelAdmin):
+    form = BookingAdminForm
+    list_display = ['id', 'user', 'route_bus', 'booking_date', 'travel_date', 'seat_count', 'total_price', 'status', 'created_at']
+    list_filter = ['status', autocomplete_filter('route_bus', 'departure'), autocomplete_filter('user'), 'created_at']
+    list_select_related = BOOKING_LABEL_RELATED
     search_fields = ['user__username', 'route_bus__route__origin__name', 'route_bus__route__destination__name']
-    ordering = ['-created_at']
-    readonly_fields = ['created_at', 'updated_at']
+    date_hierarchy = 'travel_date'
+    # Read straight off booking_travel_date_idx, whether or not a date is picked
+    ordering = ['-travel_date', '-id']
+    autocomplete_fields = ['user', 'route_bus']
+    readonly_fields = ['seat_count', 'created_at', 'updated_at']
     inlines = [BookingSeatInline]
+    actions = ['cancel_bookings', 'export_csv']
     
     fieldsets = (
         ('User and Route', {
             'fields': ('user', 'route_bus')
         }),
         ('Booking Details', {
-            'fields': ('booking_date', 'travel_date', 'total_price', 'status')
+            'fields': ('booking_date', 'travel_date', 'seat_count', 'total_price', 'status', 'hold_expires_at')
         }),
         ('Timestamps', {
             'fields': ('created_at', 'updated_at'),
@@ -101,11 +275,189 @@ class BookingAdmin(admin.ModelAdmin):
         }),
     )
 
+    def get_urls(self):
+        return [
+            path('report/', self.admin_site.admin_view(self.report_view), name='booking_booking_report'),
+            path('exports/<str:name>/', self.admin_site.admin_view(self.export_view), name='booking_booking_export'),
+        ] + super().get_urls()
+
+    def export_view(self, request, name):
+        """Download a finished CSV export, or say it is still being written"""
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        status = export_status(name)
+        if status is None:
+            raise Http404('No such export.')
+        if status == 'running':
+            self.message_user(request, self.export_message(name, 'is still being written'), messages.WARNING)
+            return HttpResponseRedirect(reverse('admin:booking_booking_changelist'))
+        if status == 'failed':
+            self.message_user(request, f'Export {name} failed; start a new one.', messages.ERROR)
+            return HttpResponseRedirect(reverse('admin:booking_booking_changelist'))
+        return FileResponse(open(export_path(name), 'rb'), as_attachment=True, filename=name)
+
+    def export_message(self, name, state):
+        link = reverse('admin:booking_booking_export', args=[name])
+        return format_html('Export <a href="{}">{}</a> {}.', link, name, state)
+
+    def report_view(self, request):
+        """Seats sold, load factor, revenue and cancellations per trip, with a streamed CSV download"""
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        today = date.today()
+        form = TripReportForm(request.GET or {'start': today - timedelta(days=30), 'end': today})
+        totals, rows = None, []
+        if form.is_valid():
+            start, end, route = form.cleaned_data['start'], form.cleaned_data['end'], form.cleaned_data['route']
+            route_id = route.id if route else None
+            if request.GET.get('export') == 'csv':
+                response = StreamingHttpResponse(
+                    csv_lines(trip_report(start, end, route_id)), content_type='text/csv',
+                )
+                response['Content-Disposition'] = f'attachment; filename="trips-{start or "all"}-{end or "all"}.csv"'
+                return response
+            totals = report_totals(start, end, route_id)
+            rows = list(trip_report(start, end, route_id, limit=REPORT_PREVIEW_ROWS))
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Trip report',
+            'form': form,
+            'totals': totals,
+            'rows': rows,
+            'preview_rows': REPORT_PREVIEW_ROWS,
+        }
+        return TemplateResponse(request, 'admin/booking/booking/report.html', context)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        booking = form.instance
+        booking.booking_seats.update(
+            route_bus=booking.route_bus,
+            travel_date=booking.travel_date,
+            is_active=booking.status in ACTIVE_BOOKING_STATUSES,
+        )
+        refresh_seat_counts([booking.id])
+        rebuild_trip_inventory(booking.route_bus, booking.travel_date)
+        if change and {'route_bus', 'travel_date'} & set(form.changed_data):
+            # The booking moved, so the trip it left needs recounting as well
+            rebuild_trip_inventory(RouteBus(id=form.initial['route_bus']), form.initial['travel_date'])
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        rebuild_trip_inventory(obj.route_bus, obj.travel_date)
+
+    def delete_queryset(self, request, queryset):
+        trips = set(queryset.values_list('route_bus', 'travel_date'))
+        super().delete_queryset(request, queryset)
+        for route_bus_id, travel_date in trips:
+            rebuild_trip_inventory(RouteBus(id=route_bus_id), travel_date)
+
+    @admin.action(description='Cancel selected bookings and release their seats')
+    def cancel_bookings(self, request, queryset):
+        cancelled = 0
+        for booking in queryset.filter(status__in=ACTIVE_BOOKING_STATUSES).select_related('route_bus'):
+            cancelled += cancel_booking(booking)
+        self.message_user(request, f'Cancelled {cancelled} bookings.')
+
+    @admin.action(description='Export selected bookings to CSV in the background')
+    def export_csv(self, request, queryset):
+        name = start_booking_export(queryset)
+        self.message_user(request, self.export_message(name, 'started; follow the link to download it when done'))
+
 
 @admin.register(BookingSeat)
-class BookingSeatAdmin(admin.ModelAdmin):
-    list_display = ['booking', 'seat', 'price']
-    list_filter = ['booking__status', 'booking__created_at']
+class BookingSeatAdmin(ScalableModelAdmin):
+    form = BookingSeatAdminForm
+    list_display = ['booking', 'seat', 'price', 'travel_date', 'is_active']
+    list_filter = ['is_active', 'booking__status', 'booking__created_at']
+    list_select_related = [f'booking__{name}' for name in BOOKING_LABEL_RELATED] + ['seat__bus']
     search_fields = ['booking__user__username', 'seat__seat_number']
-    ordering = ['booking', 'seat']
+    ordering = ['-id']
     autocomplete_fields = ['booking', 'seat']
+    readonly_fields = ['route_bus', 'travel_date', 'is_active']
+
+    def save_model(self, request, obj, form, change):
+        obj.is_active = obj.booking.status in ACTIVE_BOOKING_STATUSES
+        super().save_model(request, obj, form, change)
+        booking_ids = [obj.booking_id]
+        if change and 'booking' in form.changed_data:
+            # The seat moved to another booking, so the one it left needs recounting as well
+            booking_ids.append(form.initial['booking'])
+        refresh_seat_counts(booking_ids)
+        rebuild_trip_inventory(obj.booking.route_bus, obj.booking.travel_date)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        refresh_seat_counts([obj.booking_id])
+        rebuild_trip_inventory(obj.route_bus, obj.travel_date)
+
+    def delete_queryset(self, request, queryset):
+        trips = set(queryset.values_list('route_bus', 'travel_date'))
+        booking_ids = set(queryset.values_list('booking', flat=True))
+        super().delete_queryset(request, queryset)
+        refresh_seat_counts(booking_ids)
+        for route_bus_id, travel_date in trips:
+            rebuild_trip_inventory(RouteBus(id=route_bus_id), travel_date)
+
+
+class ArchivedBookingSeatInline(admin.TabularInline):
+    model = ArchivedBookingSeat
+    extra = 0
+    fields = ['seat', 'price', 'is_active']
+    readonly_fields = ['seat', 'price', 'is_active']
+    can_delete = False
+
+    def get_queryset(self, request):
+        # Each row is labelled with its booking and seat
+        related = [f'booking__{name}' for name in BOOKING_LABEL_RELATED]
+        return super().get_queryset(request).select_related('seat__bus', *related)
+
+
+@admin.register(ArchivedBooking)
+class ArchivedBookingAdmin(ScalableModelAdmin):
+    """Past trips moved out of the live tables by archive_bookings; read only"""
+    list_display = ['id', 'user', 'route_bus', 'booking_date', 'travel_date', 'seat_count', 'total_price', 'status', 'archived_at']
+    list_filter = ['status', autocomplete_filter('route_bus', 'departure'), autocomplete_filter('user')]
+    list_select_related = BOOKING_LABEL_RELATED
+    search_fields = ['user__username', 'route_bus__route__origin__name', 'route_bus__route__destination__name']
+    date_hierarchy = 'travel_date'
+    ordering = ['-travel_date', '-id']
+    inlines = [ArchivedBookingSeatInline]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(TripInventory)
+class TripInventoryAdmin(ScalableModelAdmin):
+    list_display = ['route_bus', 'travel_date', 'booked_count', 'updated_at']
+    list_filter = ['travel_date']
+    list_select_related = ['route_bus__route__origin', 'route_bus__route__destination', 'route_bus__bus']
+    date_hierarchy = 'travel_date'
+    ordering = ['-travel_date']
+    readonly_fields = ['route_bus', 'travel_date', 'booked_count', 'version', 'updated_at']
+    exclude = ['booked_seats']
+    actions = ['rebuild_inventories']
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.action(description='Rebuild selected inventories from bookings')
+    def rebuild_inventories(self, request, queryset):
+        for inventory in queryset.select_related('route_bus'):
+            rebuild_trip_inventory(inventory.route_bus, inventory.travel_date)
+        self.message_user(request, f'Rebuilt {queryset.count()} trip inventories.')
+
+
+@admin.register(FareRule)
+class FareRuleAdmin(admin.ModelAdmin):
+    list_display = ['name', 'kind', 'route', 'bus_type', 'min_value', 'max_value', 'multiplier', 'is_active']
+    list_filter = ['kind', 'bus_type', 'is_active']
+    search_fields = ['name', 'route__origin__name', 'route__destination__name']
+    ordering = ['kind', 'min_value']
+    autocomplete_fields = ['route']
+    list_select_related = ['route__origin', 'route__destination']
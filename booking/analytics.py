@@ -0,0 +1,186 @@
+import csv
+import heapq
+from collections import namedtuple
+from decimal import Decimal
+from itertools import groupby, islice
+
+from django.db.models import Count, Q, Sum
+
+from .models import ArchivedBooking, Booking, RouteBus
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Bookings that count towards sales; holds that never completed are left out
+REPORTED_STATUSES = ['Confirmed', 'Cancelled']
+
+TripReportRow = namedtuple('TripReportRow', [
+    'travel_date', 'route_bus_id', 'origin', 'destination', 'bus', 'bus_type', 'departure_time',
+    'capacity', 'bookings', 'seats_sold', 'load_factor', 'revenue', 'cancelled', 'cancellation_rate',
+])
+
+
+def reported_bookings(start=None, end=None, route_id=None, model=Booking):
+    """Confirmed and cancelled bookings travelling between start and end, optionally on one route
+
+    Pass model=ArchivedBooking for the same bookings among archived trips.
+    """
+    bookings = model.objects.filter(status__in=REPORTED_STATUSES)
+    if start:
+        bookings = bookings.filter(travel_date__gte=start)
+    if end:
+        bookings = bookings.filter(travel_date__lte=end)
+    if route_id:
+        bookings = bookings.filter(route_bus__route_id=route_id)
+    return bookings
+
+
+def booking_sums():
+    """The per-trip and overall sums, as aggregates"""
+    return {
+        'bookings': Count('id'),
+        'seats_sold': Sum('seat_count', filter=Q(status='Confirmed')),
+        'revenue': Sum('total_price', filter=Q(status='Confirmed')),
+        'cancelled': Count('id', filter=Q(status='Cancelled')),
+    }
+
+
+def trip_groups(start=None, end=None, route_id=None, chunk_size=2000):
+    """Sums per travel date and departure over live and archived bookings, in that order
+
+    Each table is grouped by the database and streamed; a trip whose
+    bookings are midway through being archived appears in both, and its
+    two halves are added together here.
+    """
+    streams = [
+        reported_bookings(start, end, route_id, model).values('travel_date', 'route_bus_id')
+        .annotate(**booking_sums()).order_by('travel_date', 'route_bus_id')
+        .iterator(chunk_size=chunk_size)
+        for model in (Booking, ArchivedBooking)
+    ]
+
+    def trip(group):
+        return group['travel_date'], group['route_bus_id']
+
+    for _, parts in groupby(heapq.merge(*streams, key=trip), key=trip):
+        group, *rest = parts
+        for part in rest:
+            for name in ('bookings', 'seats_sold', 'revenue', 'cancelled'):
+                group[name] = (group[name] or 0) + (part[name] or 0)
+        yield group
+
+
+def trip_report(start=None, end=None, route_id=None, chunk_size=2000, limit=None):
+    """Yield a TripReportRow per departure and travel date that had bookings
+
+    Seats, revenue and cancellations are summed by the database from each
+    booking's seat_count and total_price, so booking seats are never read
+    row by row. Groups arrive through a server-side cursor where the backend
+    has one, and departures are looked up once, so memory stays flat however
+    many bookings are in range. Archived trips are included.
+    """
+    groups = trip_groups(start, end, route_id, chunk_size)
+    if limit is not None:
+        groups = islice(groups, limit)
+
+    departures = RouteBus.objects.select_related('route__origin', 'route__destination', 'bus').in_bulk()
+    for group in groups:
+        route_bus = departures[group['route_bus_id']]
+        capacity = route_bus.bus.total_seats
+        seats_sold = group['seats_sold'] or 0
+        yield TripReportRow(
+            travel_date=group['travel_date'],
+            route_bus_id=route_bus.id,
+            origin=route_bus.route.origin.name,
+            destination=route_bus.route.destination.name,
+            bus=route_bus.bus.name,
+            bus_type=route_bus.bus.bus_type,
+            departure_time=route_bus.departure_time,
+            capacity=capacity,
+            bookings=group['bookings'],
+            seats_sold=seats_sold,
+            load_factor=round(seats_sold / capacity, 4) if capacity else None,
+            revenue=Decimal(group['revenue'] or 0).quantize(Decimal('0.01')),
+            cancelled=group['cancelled'],
+            cancellation_rate=round(group['cancelled'] / group['bookings'], 4),
+        )
+
+
+def report_totals(start=None, end=None, route_id=None):
+    """Overall bookings, seats sold, revenue and cancellations for a report range, archived trips included"""
+    totals = {'bookings': 0, 'seats_sold': 0, 'revenue': 0, 'cancelled': 0}
+    for model in (Booking, ArchivedBooking):
+        sums = reported_bookings(start, end, route_id, model).aggregate(**booking_sums())
+        for name in totals:
+            totals[name] += sums[name] or 0
+    totals['revenue'] = Decimal(totals['revenue']).quantize(Decimal('0.01'))
+    totals['cancellation_rate'] = round(totals['cancelled'] / totals['bookings'], 4) if totals['bookings'] else None
+    return totals
+
+
+def write_csv(rows, stream):
+    """Write report rows as CSV one at a time; return the number written"""
+    writer = csv.writer(stream)
+    writer.writerow(TripReportRow._fields)
+    written = 0
+    for row in rows:
+        writer.writerow(row)
+        written += 1
+    return written
+
+
+class Echo:
+    """File-like object handing each written line back, for streaming responses"""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    """Yield the CSV header and then one line per report row"""
+    writer = csv.writer(Echo())
+    yield writer.writerow(TripReportRow._fields)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def parquet_schema():
+    return pyarrow.schema([
+        ('travel_date', pyarrow.date32()),
+        ('route_bus_id', pyarrow.int64()),
+        ('origin', pyarrow.string()),
+        ('destination', pyarrow.string()),
+        ('bus', pyarrow.string()),
+        ('bus_type', pyarrow.string()),
+        ('departure_time', pyarrow.time64('us')),
+        ('capacity', pyarrow.int32()),
+        ('bookings', pyarrow.int64()),
+        ('seats_sold', pyarrow.int64()),
+        ('load_factor', pyarrow.float64()),
+        ('revenue', pyarrow.decimal128(14, 2)),
+        ('cancelled', pyarrow.int64()),
+        ('cancellation_rate', pyarrow.float64()),
+    ])
+
+
+def write_parquet(rows, path, batch_size=50000):
+    """Write report rows to a Parquet file one row group at a time; return the number written"""
+    if pyarrow is None:
+        raise ImportError('Parquet export needs the pyarrow package.')
+    schema = parquet_schema()
+    written = 0
+    with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+        batch = []
+        for row in rows:
+            batch.append(row._asdict())
+            if len(batch) == batch_size:
+                writer.write_table(pyarrow.Table.from_pylist(batch, schema=schema))
+                written += len(batch)
+                batch = []
+        if batch:
+            writer.write_table(pyarrow.Table.from_pylist(batch, schema=schema))
+            written += len(batch)
+    return written
@@ -0,0 +1,205 @@
+import hashlib
+import json
+from datetime import date
+from functools import wraps
+
+from django.http import JsonResponse
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+from .inventory import ACTIVE_BOOKING_STATUSES
+from .models import Booking, Route, RouteBus
+from .queries import list_trips, search_routes, trip_seat_map
+from .quotes import InvalidQuote, issue_quote, read_quote
+from .refcache import get_route, get_route_bus
+from .reservations import (
+    HoldExpired, InvalidSeatSelection, SeatContention, SeatUnavailable, cancel_booking, checkout_seats,
+    confirm_quote,
+)
+
+SEAT_FIELDS = ['id', 'number', 'row', 'column', 'booked']
+
+
+class ApiError(Exception):
+    """An error returned to API clients as JSON with an HTTP status"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def api_view(method='GET', login_required=False):
+    """Wrap a view returning a dict, handling method, auth and errors as JSON"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != method:
+                return JsonResponse({'error': f'Use {method}.'}, status=405, headers={'Allow': method})
+            if login_required and not request.user.is_authenticated:
+                return JsonResponse({'error': 'Authentication required.'}, status=401)
+            try:
+                result = view(request, *args, **kwargs)
+            except (Route.DoesNotExist, RouteBus.DoesNotExist, Booking.DoesNotExist):
+                return JsonResponse({'error': 'Not found.'}, status=404)
+            except ApiError as e:
+                return JsonResponse({'error': str(e)}, status=e.status)
+            if isinstance(result, dict):
+                return JsonResponse(result)
+            return result
+        return wrapper
+    return decorator
+
+
+def parse_date(value):
+    try:
+        return date.fromisoformat(value or '')
+    except ValueError:
+        raise ApiError('A travel date in YYYY-MM-DD format is required.')
+
+
+def json_body(request):
+    try:
+        body = json.loads(request.body or b'{}')
+    except ValueError:
+        raise ApiError('The request body must be JSON.')
+    if not isinstance(body, dict):
+        raise ApiError('The request body must be a JSON object.')
+    return body
+
+
+def location_json(location):
+    return {'id': location.id, 'code': location.code, 'name': location.name}
+
+
+@api_view()
+def csrf_view(request):
+    """CSRF token for clients that POST with session authentication"""
+    return {'csrf_token': get_token(request)}
+
+
+@api_view()
+def routes_view(request):
+    """Routes matching ?q= and optional ?origin= and ?destination= location ids"""
+    origin_id = request.GET.get('origin', '')
+    destination_id = request.GET.get('destination', '')
+    for location_id in (origin_id, destination_id):
+        if location_id and not location_id.isdigit():
+            raise ApiError('Location ids must be numbers.')
+    routes = search_routes(request.GET.get('q', ''), origin_id, destination_id)
+    return {'routes': [{
+        'id': route.id,
+        'origin': location_json(route.origin),
+        'destination': location_json(route.destination),
+        'distance': str(route.distance),
+        'base_price': str(route.base_price),
+    } for route in routes]}
+
+
+@api_view()
+def trips_view(request, route_id):
+    """Departures on a route; with ?date= only those running that day, with seats left"""
+    route = get_route(route_id)
+    travel_date = parse_date(request.GET['date']) if request.GET.get('date') else None
+    return {
+        'route': route_id,
+        'date': travel_date.isoformat() if travel_date else None,
+        'trips': [{
+            'id': trip['route_bus'].id,
+            'bus': trip['route_bus'].bus.name,
+            'bus_type': trip['route_bus'].bus.bus_type,
+            'departs': trip['route_bus'].departure_time.strftime('%H:%M'),
+            'arrives': trip['route_bus'].arrival_time.strftime('%H:%M'),
+            'price': str(trip['price']),
+            'seats_left': trip['seats_left'],
+        } for trip in list_trips(route, travel_date)],
+    }
+
+
+@api_view()
+def seat_map_view(request, route_bus_id):
+    """Seat map of a trip on ?date= with availability, revalidated with ETags
+
+    Seats are rows of SEAT_FIELDS to keep the payload small. The ETag covers
+    the layout, the booked seats and the fare, so an unchanged map costs a
+    304 without serializing anything.
+    """
+    route_bus = get_route_bus(route_bus_id)
+    travel_date = parse_date(request.GET.get('date'))
+    seat_map, inventory, price_per_seat = trip_seat_map(route_bus, travel_date)
+
+    validator = f"{seat_map['digest']}:{bytes(inventory.booked_seats).hex()}:{price_per_seat}"
+    etag = '"%s"' % hashlib.sha1(validator.encode()).hexdigest()[:20]
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = JsonResponse({
+            'trip': route_bus.id,
+            'date': travel_date.isoformat(),
+            'rows': seat_map['rows'],
+            'cols_per_side': seat_map['cols_per_side'],
+            'price': str(price_per_seat),
+            'seat_fields': SEAT_FIELDS,
+            'seats': [
+                [cell.id, cell.seat_number, cell.row, cell.column, int(inventory.is_booked(cell.position))]
+                for cell in seat_map['cells']
+            ],
+        })
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@api_view(method='POST', login_required=True)
+def hold_view(request, route_bus_id):
+    """Hold seats on a trip and return a signed quote to confirm them with"""
+    route_bus = get_route_bus(route_bus_id)
+    body = json_body(request)
+    travel_date = parse_date(body.get('date'))
+    seat_ids = body.get('seats')
+    if not isinstance(seat_ids, list) or not all(isinstance(seat_id, int) for seat_id in seat_ids):
+        raise ApiError('seats must be a list of seat ids.')
+    try:
+        hold, seats, price_per_seat = checkout_seats(request.user, route_bus, travel_date, seat_ids)
+    except InvalidSeatSelection as e:
+        raise ApiError(str(e))
+    except SeatUnavailable as e:
+        return JsonResponse({'error': str(e), 'seats': [seat.id for seat in e.seats]}, status=409)
+    except SeatContention as e:
+        response = JsonResponse({'error': str(e)}, status=503)
+        response['Retry-After'] = '1'
+        return response
+    return JsonResponse({
+        'hold': hold.id,
+        'expires_at': hold.hold_expires_at.isoformat(),
+        'seats': [seat.seat_number for seat in seats],
+        'price_per_seat': str(price_per_seat),
+        'total_price': str(hold.total_price),
+        'quote': issue_quote(hold, seats, price_per_seat),
+    }, status=201)
+
+
+@api_view(method='POST', login_required=True)
+def confirm_view(request):
+    """Confirm a held booking from its quote"""
+    try:
+        quote = read_quote(json_body(request).get('quote', ''), request.user)
+    except InvalidQuote as e:
+        raise ApiError(str(e))
+    try:
+        booking_id = confirm_quote(quote)
+    except HoldExpired as e:
+        # A retried request finds the booking already confirmed
+        if not Booking.objects.filter(id=quote.booking_id, user=request.user, status='Confirmed').exists():
+            raise ApiError(str(e), status=410)
+        booking_id = quote.booking_id
+    return {'booking': booking_id, 'status': 'Confirmed', 'total_price': str(quote.total_price)}
+
+
+@api_view(method='POST', login_required=True)
+def cancel_view(request, booking_id):
+    """Cancel a pending or confirmed booking"""
+    booking = Booking.objects.select_related('route_bus').get(id=booking_id, user=request.user)
+    if booking.status not in ACTIVE_BOOKING_STATUSES:
+        raise ApiError(f'Booking #{booking.id} is already {booking.status.lower()}.', status=409)
+    if not cancel_booking(booking):
+        raise ApiError(f'Booking #{booking.id} is no longer active.', status=409)
+    return {'booking': booking.id, 'status': booking.status}
@@ -0,0 +1,14 @@
+from django.urls import path
+from . import api
+
+app_name = 'api'
+
+urlpatterns = [
+    path('csrf/', api.csrf_view, name='csrf'),
+    path('routes/', api.routes_view, name='routes'),
+    path('routes/<int:route_id>/trips/', api.trips_view, name='trips'),
+    path('trips/<int:route_bus_id>/seats/', api.seat_map_view, name='seat_map'),
+    path('trips/<int:route_bus_id>/hold/', api.hold_view, name='hold'),
+    path('bookings/confirm/', api.confirm_view, name='confirm'),
+    path('bookings/<int:booking_id>/cancel/', api.cancel_view, name='cancel'),
+]
@@ -0,0 +1,87 @@
+"""
+Moving finished trips out of the live booking tables.
+
+Bookings whose travel date is more than BOOKING_ARCHIVE_AFTER_DAYS in the
+past are copied to ArchivedBooking and ArchivedBookingSeat, keeping their
+ids, and deleted from Booking and BookingSeat in the same transaction. The
+live tables, their indexes and the trip inventories then only cover trips
+that can still be sold, held or cancelled. Past trips stay readable through
+get_booking_or_404, prefetch_booking_seats and the merged keyset pagination
+in booking.pagination.
+"""
+from datetime import date, timedelta
+from itertools import groupby
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.http import Http404
+
+from .models import ArchivedBooking, ArchivedBookingSeat, Booking, BookingSeat, TripInventory
+
+BOOKING_FIELDS = [field.attname for field in Booking._meta.concrete_fields]
+BOOKING_SEAT_FIELDS = [field.attname for field in BookingSeat._meta.concrete_fields]
+
+
+def archive_cutoff(today=None):
+    """Trips before this date are archived"""
+    return (today or date.today()) - timedelta(days=settings.BOOKING_ARCHIVE_AFTER_DAYS)
+
+
+def archive_batch(before, batch_size=1000):
+    """Move up to batch_size bookings travelling before a date to the archive; return how many moved"""
+    with transaction.atomic():
+        # Concurrent archivers each take different bookings rather than waiting for one another
+        booking_ids = list(
+            Booking.objects.filter(travel_date__lt=before).order_by('travel_date', 'id')
+            .select_for_update(skip_locked=True).values_list('id', flat=True)[:batch_size]
+        )
+        if not booking_ids:
+            return 0
+        ArchivedBooking.objects.bulk_create(
+            ArchivedBooking(**row) for row in Booking.objects.filter(id__in=booking_ids).values(*BOOKING_FIELDS)
+        )
+        booking_seats = BookingSeat.objects.filter(booking_id__in=booking_ids)
+        ArchivedBookingSeat.objects.bulk_create(
+            ArchivedBookingSeat(**row) for row in booking_seats.values(*BOOKING_SEAT_FIELDS)
+        )
+        booking_seats.delete()
+        Booking.objects.filter(id__in=booking_ids).delete()
+    return len(booking_ids)
+
+
+def archive_bookings(before=None, batch_size=1000):
+    """Archive every booking travelling before a date (archive_cutoff() by default); return how many moved
+
+    Each batch is its own transaction, so the live tables are never locked
+    for long and an interrupted run loses nothing. Trip inventories for the
+    archived dates are dropped at the end; no seat on them can be sold.
+    Trips from today on are never archived.
+    """
+    before = before or archive_cutoff()
+    if before > date.today():
+        raise ValueError(f'Trips from {date.today()} on can still be booked; archive before a past date.')
+    archived = 0
+    while moved := archive_batch(before, batch_size):
+        archived += moved
+    TripInventory.objects.filter(travel_date__lt=before).delete()
+    return archived
+
+
+def get_booking_or_404(select_related=(), **lookups):
+    """The live booking matching lookups, or its archived copy"""
+    for model in (Booking, ArchivedBooking):
+        booking = model.objects.select_related(*select_related).filter(**lookups).first()
+        if booking is not None:
+            return booking
+    raise Http404('No booking matches the given query.')
+
+
+def prefetch_booking_seats(bookings):
+    """Prefetch booking_seats with their seats in layout order, one query per table the bookings come from"""
+    bookings = sorted(bookings, key=lambda booking: booking.is_archived)
+    for is_archived, group in groupby(bookings, key=lambda booking: booking.is_archived):
+        seat_model = ArchivedBookingSeat if is_archived else BookingSeat
+        prefetch_related_objects(list(group), Prefetch(
+            'booking_seats', queryset=seat_model.objects.select_related('seat').order_by('seat__row', 'seat__column'),
+        ))
@@ -0,0 +1,111 @@
+"""
+Booking CSV exports written in a background thread.
+
+The admin starts an export and returns straight away; the thread streams
+rows through a server-side cursor into a .part file and renames it into
+ADMIN_EXPORT_DIR when complete, so a half-written file is never served.
+An export that fails leaves a .failed marker instead. A daemon thread dies
+silently with its process, so a .part file left untouched for
+STALE_EXPORT_SECONDS is treated as failed too.
+"""
+import csv
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+EXPORT_COLUMNS = [
+    ('id', 'id'),
+    ('user', 'user__username'),
+    ('origin', 'route_bus__route__origin__name'),
+    ('destination', 'route_bus__route__destination__name'),
+    ('bus', 'route_bus__bus__name'),
+    ('departure_time', 'route_bus__departure_time'),
+    ('booking_date', 'booking_date'),
+    ('travel_date', 'travel_date'),
+    ('seat_count', 'seat_count'),
+    ('total_price', 'total_price'),
+    ('status', 'status'),
+    ('created_at', 'created_at'),
+]
+
+EXPORT_NAME = re.compile(r'bookings-\d{8}-\d{6}-[0-9a-f]{8}\.csv')
+
+# A .part file not written to for this long belongs to an export whose process exited
+STALE_EXPORT_SECONDS = 15 * 60
+
+
+def export_path(name):
+    return os.path.join(settings.ADMIN_EXPORT_DIR, name)
+
+
+def export_status(name):
+    """'ready', 'running', 'failed', or None for an unknown export"""
+    if not EXPORT_NAME.fullmatch(name):
+        return None
+    path = export_path(name)
+    if os.path.exists(path):
+        return 'ready'
+    if os.path.exists(path + '.failed'):
+        return 'failed'
+    try:
+        if time.time() - os.path.getmtime(path + '.part') < STALE_EXPORT_SECONDS:
+            return 'running'
+    except FileNotFoundError:
+        return None
+    mark_export_failed(name)
+    return 'failed'
+
+
+def mark_export_failed(name):
+    """Replace an export's .part file with a .failed marker"""
+    path = export_path(name)
+    open(path + '.failed', 'w').close()
+    if os.path.exists(path + '.part'):
+        os.remove(path + '.part')
+
+
+def clean_stale_exports():
+    """Mark exports whose process exited mid-write as failed"""
+    for entry in os.scandir(settings.ADMIN_EXPORT_DIR):
+        name = entry.name.removesuffix('.part')
+        if name != entry.name and EXPORT_NAME.fullmatch(name):
+            export_status(name)
+
+
+def start_booking_export(queryset, chunk_size=2000):
+    """Export a booking queryset to CSV from a background thread; return the file name"""
+    os.makedirs(settings.ADMIN_EXPORT_DIR, exist_ok=True)
+    clean_stale_exports()
+    name = f'bookings-{timezone.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}.csv'
+    rows = queryset.order_by('id').values_list(*(lookup for _, lookup in EXPORT_COLUMNS))
+    # Create the .part file now so the download link reports 'running' at once
+    open(export_path(name) + '.part', 'w').close()
+    threading.Thread(target=write_booking_export, args=(rows, name, chunk_size), daemon=True).start()
+    return name
+
+
+def write_booking_export(rows, name, chunk_size=2000):
+    """Write rows to the export file, one chunk from the database at a time"""
+    path = export_path(name)
+    try:
+        with open(path + '.part', 'w', newline='') as stream:
+            writer = csv.writer(stream)
+            writer.writerow([column for column, _ in EXPORT_COLUMNS])
+            writer.writerows(rows.iterator(chunk_size=chunk_size))
+        os.replace(path + '.part', path)
+    except Exception:
+        logger.exception('Booking export %s failed', name)
+    finally:
+        if not os.path.exists(path):
+            mark_export_failed(name)
+        # The thread's connection is not closed by the request cycle
+        connection.close()
@@ -0,0 +1,71 @@
+from collections import defaultdict, namedtuple
+
+from django.db import transaction
+
+from .layout import SeatLayout
+from .models import Seat, TripInventory
+from .seatmap import invalidate_seat_map
+
+SeatSyncResult = namedtuple('SeatSyncResult', ['bus', 'created', 'updated', 'deactivated', 'valid'])
+
+
+def plan_seat_sync(bus, existing_seats):
+    """Diff a bus's seats against its layout; return (to_create, to_update, to_deactivate, moved)
+
+    moved is True when an existing seat changes row or column, which moves
+    its Seat.position in every trip inventory bitmap.
+    """
+    existing = {seat.seat_number: seat for seat in existing_seats}
+    to_create, to_update = [], []
+    moved = False
+    for spec in SeatLayout.for_bus(bus).seat_specs():
+        seat = existing.pop(spec.seat_number, None)
+        if seat is None:
+            to_create.append(Seat(
+                bus=bus,
+                seat_number=spec.seat_number,
+                row=spec.row,
+                column=spec.column,
+                seat_type=spec.seat_type,
+            ))
+        elif (seat.row, seat.column, seat.seat_type, seat.is_active) != (spec.row, spec.column, spec.seat_type, True):
+            moved = moved or (seat.row, seat.column) != (spec.row, spec.column)
+            # A seat back in the layout after a shrink is put back on sale
+            seat.row, seat.column, seat.seat_type, seat.is_active = spec.row, spec.column, spec.seat_type, True
+            to_update.append(seat)
+    # Seats outside the layout are retired rather than deleted so their bookings survive
+    to_deactivate = [seat for seat in existing.values() if seat.is_active]
+    return to_create, to_update, to_deactivate, moved
+
+
+def sync_bus_seats(buses, dry_run=False):
+    """Bring the seats of several buses in line with their layouts in one transaction"""
+    buses = list(buses)
+    existing = defaultdict(list)
+    for seat in Seat.objects.filter(bus__in=buses).order_by():
+        existing[seat.bus_id].append(seat)
+
+    results, to_create, to_update, to_deactivate, moved_bus_ids = [], [], [], [], []
+    for bus in buses:
+        if not SeatLayout.for_bus(bus).is_valid():
+            results.append(SeatSyncResult(bus, 0, 0, 0, False))
+            continue
+        created, updated, deactivated, moved = plan_seat_sync(bus, existing[bus.id])
+        if moved:
+            moved_bus_ids.append(bus.id)
+        to_create.extend(created)
+        to_update.extend(updated)
+        to_deactivate.extend(deactivated)
+        results.append(SeatSyncResult(bus, len(created), len(updated), len(deactivated), True))
+
+    if not dry_run:
+        with transaction.atomic():
+            Seat.objects.bulk_create(to_create, batch_size=500)
+            Seat.objects.bulk_update(to_update, ['row', 'column', 'seat_type', 'is_active'], batch_size=500)
+            Seat.objects.filter(id__in=[seat.id for seat in to_deactivate]).update(is_active=False)
+            # Bitmaps of re-laid-out buses index seats by their old positions; they are rebuilt on next use
+            TripInventory.objects.filter(route_bus__bus_id__in=moved_bus_ids).delete()
+        # Bulk writes skip model signals, so drop the cached seat maps here
+        for bus in buses:
+            invalidate_seat_map(bus.id)
+    return results
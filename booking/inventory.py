@@ -0,0 +1,84 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from .live import publish_seat_changes
+from .models import BookingSeat, Seat, TripInventory
+
+# Booking statuses that keep their seats off the market
+ACTIVE_BOOKING_STATUSES = ['Pending', 'Confirmed']
+
+# Compare-and-swap retries before a contended write gives up
+MAX_CAS_ATTEMPTS = 8
+
+# Longest random pause before the first retry of a booking; it doubles on each later retry
+CAS_BACKOFF_SECONDS = 0.01
+
+
+def get_trip_inventory(route_bus, travel_date):
+    """Return the inventory for a trip, building it from bookings on first use"""
+    try:
+        return TripInventory.objects.get(route_bus=route_bus, travel_date=travel_date)
+    except TripInventory.DoesNotExist:
+        return rebuild_trip_inventory(route_bus, travel_date)
+
+
+def booked_seat_counts(route_bus_ids, travel_date):
+    """Map each departure to its number of taken seats on a date, in at most two queries"""
+    # order_by() drops the default ordering, which would join routes and locations for nothing
+    counts = dict(
+        TripInventory.objects.filter(route_bus_id__in=route_bus_ids, travel_date=travel_date)
+        .order_by().values_list('route_bus_id', 'booked_count')
+    )
+    missing = [route_bus_id for route_bus_id in route_bus_ids if route_bus_id not in counts]
+    if missing:
+        # Trips nobody has looked at yet have no inventory row; count their seats directly
+        counts.update(
+            BookingSeat.objects.filter(route_bus_id__in=missing, travel_date=travel_date, is_active=True)
+            .order_by().values('route_bus_id').annotate(taken=Count('id'))
+            .values_list('route_bus_id', 'taken')
+        )
+    return {route_bus_id: counts.get(route_bus_id, 0) for route_bus_id in route_bus_ids}
+
+
+def rebuild_trip_inventory(route_bus, travel_date):
+    """Recompute a trip inventory from its active booking seats"""
+    booked = Seat.objects.filter(
+        bookings__route_bus=route_bus,
+        bookings__travel_date=travel_date,
+        bookings__is_active=True,
+    ).only('row', 'column')
+
+    inventory = TripInventory(route_bus=route_bus, travel_date=travel_date)
+    inventory.mark_booked(seat.position for seat in booked)
+
+    updated = TripInventory.objects.filter(route_bus=route_bus, travel_date=travel_date).update(
+        booked_seats=inventory.booked_seats,
+        booked_count=inventory.booked_count,
+        version=F('version') + 1,
+        updated_at=timezone.now(),
+    )
+    if not updated:
+        try:
+            with transaction.atomic():
+                inventory.save()
+            publish_seat_changes(inventory, reset=True)
+            return inventory
+        except IntegrityError:
+            # Another request created the row first; its contents are equally fresh
+            pass
+    inventory = TripInventory.objects.get(route_bus=route_bus, travel_date=travel_date)
+    publish_seat_changes(inventory, reset=True)
+    return inventory
+
+
+def release_seats(route_bus, travel_date, seats):
+    """Return seats to the trip inventory"""
+    positions = [seat.position for seat in seats]
+    for _ in range(MAX_CAS_ATTEMPTS):
+        inventory = get_trip_inventory(route_bus, travel_date)
+        inventory.release(positions)
+        if inventory.save_if_unchanged():
+            publish_seat_changes(inventory, released=positions)
+            return inventory
+    return rebuild_trip_inventory(route_bus, travel_date)
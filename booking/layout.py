@@ -0,0 +1,67 @@
+from collections import namedtuple
+
+SeatSpec = namedtuple('SeatSpec', ['row', 'column', 'seat_number', 'seat_type', 'side'])
+
+
+class SeatLayout:
+    """Seat arrangement described by a bus seat_layout configuration"""
+
+    def __init__(self, rows, cols_per_side):
+        self.rows = rows
+        self.cols_per_side = list(cols_per_side)
+
+    @classmethod
+    def for_bus(cls, bus):
+        config = bus.get_seat_layout_config()
+        return cls(config.get('rows', 0), config.get('cols_per_side', [0, 0]))
+
+    @property
+    def width(self):
+        return sum(self.cols_per_side)
+
+    def is_valid(self):
+        return self.rows > 0 and self.width > 0
+
+    def seat_specs(self):
+        """Yield the seat that belongs at every position, row by row"""
+        left, right = self.cols_per_side
+        for row in range(1, self.rows + 1):
+            # Left side: window seat first, aisle seat last
+            for col in range(1, left + 1):
+                seat_type = 'Window' if col == 1 else ('Aisle' if col == left else 'Middle')
+                yield SeatSpec(row, col, f'{row}{chr(64 + col)}', seat_type, 'left')
+            # Right side: aisle seat first, window seat last
+            for col_index in range(1, right + 1):
+                col = left + col_index
+                seat_type = 'Window' if col_index == right else ('Aisle' if col_index == 1 else 'Middle')
+                yield SeatSpec(row, col, f'{row}{chr(64 + col)}', seat_type, 'right')
+
+    def build_rows(self, seats, is_booked=None):
+        """Arrange seats into the row structure used by the seat selection grid
+
+        Seats are indexed by (row, column) once, so building the grid is linear
+        in the number of positions rather than positions times seats. Without
+        is_booked every seat is shown as available.
+        """
+        by_position = {(seat.row, seat.column): seat for seat in seats}
+        left, right = self.cols_per_side
+        seat_rows = []
+        for row_num in range(1, self.rows + 1):
+            row_seats = []
+            for col in range(1, self.width + 1):
+                seat = by_position.get((row_num, col))
+                if seat:
+                    row_seats.append({
+                        'seat': seat,
+                        'is_booked': bool(is_booked and is_booked(seat)),
+                        'side': 'left' if col <= left else 'right',
+                    })
+                else:
+                    row_seats.append(None)
+            seat_rows.append({
+                'row_num': row_num,
+                'seats': row_seats,
+                'left_count': left,
+                'right_count': right,
+            })
+        return seat_rows
@@ -0,0 +1,157 @@
+import asyncio
+import json
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+try:
+    import redis
+    import redis.asyncio
+except ImportError:
+    redis = None
+
+
+def seat_channel(route_bus_id, travel_date):
+    return f'seats:{route_bus_id}:{travel_date.isoformat()}'
+
+
+class LocalBroker:
+    """In-process pub/sub; every subscriber of a channel gets its own queue"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.channels = {}
+
+    def publish(self, channel, message):
+        with self.lock:
+            subscribers = list(self.channels.get(channel, ()))
+        for subscriber in subscribers:
+            subscriber.put(message)
+
+    async def subscribe(self, channel):
+        return LocalSubscription(self, channel)
+
+
+class LocalSubscription:
+    """Messages for a channel, handed to the event loop the subscription was opened on"""
+
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        with broker.lock:
+            broker.channels.setdefault(channel, set()).add(self)
+
+    def put(self, message):
+        # Publishers run in worker threads, off the subscriber's loop
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, message)
+
+    async def get(self, timeout):
+        """Return the next message, or None if nothing arrives within timeout seconds"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def close(self):
+        with self.broker.lock:
+            subscribers = self.broker.channels.get(self.channel)
+            if subscribers is not None:
+                subscribers.discard(self)
+                if not subscribers:
+                    del self.broker.channels[self.channel]
+
+
+class RedisBroker:
+    """Pub/sub through Redis, so every web process sees every other process's bookings"""
+
+    def __init__(self, url):
+        self.url = url
+        self.client = redis.Redis.from_url(url)
+
+    def publish(self, channel, message):
+        self.client.publish(channel, json.dumps(message))
+
+    async def subscribe(self, channel):
+        # Connections belong to the event loop they were opened on
+        client = redis.asyncio.Redis.from_url(self.url)
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(channel)
+        return RedisSubscription(client, pubsub)
+
+
+class RedisSubscription:
+    def __init__(self, client, pubsub):
+        self.client = client
+        self.pubsub = pubsub
+
+    async def get(self, timeout):
+        message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+        if message is None:
+            return None
+        return json.loads(message['data'])
+
+    async def close(self):
+        await self.pubsub.aclose()
+        await self.client.aclose()
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """Return the process-wide broker; Redis when SEAT_EVENTS_REDIS_URL is set"""
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            url = getattr(settings, 'SEAT_EVENTS_REDIS_URL', '')
+            if url and redis is None:
+                raise ImportError('SEAT_EVENTS_REDIS_URL is set but the redis package is not installed.')
+            _broker = RedisBroker(url) if url else LocalBroker()
+        return _broker
+
+
+def publish_seat_changes(inventory, booked=(), released=(), reset=False):
+    """Announce seat changes on a trip once the surrounding transaction commits
+
+    Deltas carry seat positions and the inventory version they produced. A
+    reset carries every booked position, for changes that were not deltas.
+    """
+    message = {'version': inventory.version, 'booked': list(booked), 'released': list(released)}
+    if reset:
+        message['reset'] = True
+        message['booked'] = inventory.booked_positions()
+    channel = seat_channel(inventory.route_bus_id, inventory.travel_date)
+    # A broker outage is logged rather than failing a booking that already committed
+    transaction.on_commit(lambda: get_broker().publish(channel, message), robust=True)
+
+
+def format_event(event, data):
+    return f'event: {event}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'
+
+
+async def aevent_stream(channel, load_snapshot):
+    """Yield server-sent events for a channel, starting with a snapshot
+
+    Messages are awaited on the event loop, so this needs an ASGI server, and
+    an open page costs a queue rather than a thread. Comment lines keep idle
+    connections open through proxies. The stream ends after
+    SEAT_EVENTS_STREAM_SECONDS; EventSource reconnects by itself and gets a
+    fresh snapshot.
+    """
+    # Subscribe before reading the snapshot so no change can fall in between
+    subscription = await get_broker().subscribe(channel)
+    try:
+        snapshot = await sync_to_async(load_snapshot)()
+        yield 'retry: 3000\n' + format_event('snapshot', snapshot)
+        deadline = time.monotonic() + settings.SEAT_EVENTS_STREAM_SECONDS
+        while time.monotonic() < deadline:
+            message = await subscription.get(settings.SEAT_EVENTS_KEEPALIVE_SECONDS)
+            yield ': keepalive\n\n' if message is None else format_event('seats', message)
+    finally:
+        await subscription.close()
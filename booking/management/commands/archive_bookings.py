@@ -0,0 +1,36 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from booking.archive import archive_bookings, archive_cutoff
+
+
+class Command(BaseCommand):
+    help = 'Move bookings for past trips out of the live tables into the archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--before', type=date.fromisoformat,
+            help='Archive trips before this date (YYYY-MM-DD); defaults to BOOKING_ARCHIVE_AFTER_DAYS ago',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000, help='Bookings moved per transaction')
+        parser.add_argument(
+            '--loop', type=int, metavar='SECONDS', default=0,
+            help='Keep running, archiving every SECONDS seconds',
+        )
+
+    def handle(self, *args, **options):
+        if options['before'] and options['before'] > date.today():
+            raise CommandError(f"--before {options['before']} is in the future; only past trips can be archived.")
+        while True:
+            before = options['before'] or archive_cutoff()
+            started = time.perf_counter()
+            archived = archive_bookings(before, batch_size=options['batch_size'])
+            elapsed = time.perf_counter() - started
+            self.stdout.write(self.style.SUCCESS(
+                f'Archived {archived} bookings travelling before {before} in {elapsed:.2f}s'
+            ))
+            if not options['loop']:
+                return
+            time.sleep(options['loop'])
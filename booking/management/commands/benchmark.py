@@ -0,0 +1,581 @@
+import random
+import io
+import os
+import threading
+import time
+import tracemalloc
+import urllib.request
+import uuid
+from datetime import date, time as clock_time, timedelta
+from decimal import Decimal
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, reset_queries, transaction
+from django.db.models import Count, Q, Sum
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+
+from booking.admin import BookingAdmin
+from booking.analytics import trip_report, write_csv
+from booking.inventory import get_trip_inventory
+from booking.layout import SeatLayout
+from booking.models import Booking, Bus, BookingSeat, FareRule, Location, Route, RouteBus, Seat, days_to_mask
+from booking.planner import JourneyIndex, Schedule
+from booking.pricing import PricingEngine, base_fare
+from booking.reservations import SeatContention, SeatUnavailable, reserve_seats
+
+
+class Command(BaseCommand):
+    help = 'Run performance and concurrency benchmarks against the configured database'
+
+    targets = ['reservations', 'bookings', 'layout', 'trip_search', 'pricing', 'planner', 'http', 'analytics', 'admin']
+
+    def add_arguments(self, parser):
+        parser.add_argument('target', choices=self.targets, help='Benchmark to run')
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent workers')
+        parser.add_argument('--iterations', type=int, default=50, help='Operations per worker')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for reproducible runs')
+        parser.add_argument(
+            '--size', type=int, nargs='+', default=[100, 500, 1000],
+            help='Data sizes to benchmark, where the target supports it',
+        )
+        parser.add_argument(
+            '--base-url', default='http://127.0.0.1:8000',
+            help='Running server to load test with the http target',
+        )
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        getattr(self, f"bench_{options['target']}")(options)
+
+    def make_trip(self, rows, cols_per_side):
+        """Create a throwaway route, bus and seats to benchmark against"""
+        tag = uuid.uuid4().hex[:6].upper()
+        origin = Location.objects.create(name=f'Bench origin {tag}', code=f'BO{tag}')
+        destination = Location.objects.create(name=f'Bench destination {tag}', code=f'BD{tag}')
+        route = Route.objects.create(origin=origin, destination=destination, distance=100, base_price=100)
+        bus = Bus.objects.create(
+            name=f'Bench bus {tag}',
+            bus_type='AC',
+            total_seats=rows * sum(cols_per_side),
+            seat_layout={'rows': rows, 'cols_per_side': cols_per_side},
+        )
+        Seat.objects.bulk_create(
+            Seat(bus=bus, seat_number=f'{row}{chr(64 + col)}', row=row, column=col)
+            for row in range(1, rows + 1)
+            for col in range(1, sum(cols_per_side) + 1)
+        )
+        route_bus = RouteBus.objects.create(
+            route=route, bus=bus, departure_time='08:00', arrival_time='12:00',
+            available_days=list(range(7)),
+        )
+        return route_bus, [origin, destination, bus]
+
+    def bench_reservations(self, options):
+        """Hammer one trip with concurrent bookings and prove no seat is sold twice"""
+        route_bus, cleanup = self.make_trip(rows=10, cols_per_side=[2, 2])
+        travel_date = date.today() + timedelta(days=1)
+        seats = list(Seat.objects.filter(bus=route_bus.bus))
+        users = [
+            User.objects.create_user(f'bench-{uuid.uuid4().hex[:12]}')
+            for _ in range(options['threads'])
+        ]
+        counts = {'booked': 0, 'conflicts': 0, 'contended': 0, 'locked': 0}
+        lock = threading.Lock()
+        start_gate = threading.Barrier(options['threads'])
+
+        def worker(user):
+            rng = random.Random(user.id)
+            start_gate.wait()
+            try:
+                for _ in range(options['iterations']):
+                    picked = rng.sample(seats, rng.randint(1, 3))
+                    try:
+                        reserve_seats(user, route_bus, travel_date, picked, route_bus.route.base_price)
+                        outcome = 'booked'
+                    except SeatUnavailable:
+                        outcome = 'conflicts'
+                    except SeatContention:
+                        outcome = 'contended'
+                    except OperationalError:
+                        outcome = 'locked'
+                    with lock:
+                        counts[outcome] += 1
+            finally:
+                connection.close()
+
+        try:
+            started = time.perf_counter()
+            workers = [threading.Thread(target=worker, args=(user,)) for user in users]
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+            elapsed = time.perf_counter() - started
+
+            double_booked = (
+                BookingSeat.objects.filter(route_bus=route_bus, travel_date=travel_date, is_active=True)
+                .values('seat').annotate(claims=Count('id')).filter(claims__gt=1).count()
+            )
+            active_seats = BookingSeat.objects.filter(
+                route_bus=route_bus, travel_date=travel_date, is_active=True,
+            ).count()
+            inventory = get_trip_inventory(route_bus, travel_date)
+            attempts = sum(counts.values())
+
+            self.stdout.write(
+                f"{connection.vendor}: {attempts} attempts in {elapsed:.2f}s "
+                f"({attempts / elapsed:.0f}/s) - {counts['booked']} booked, "
+                f"{counts['conflicts']} seat conflicts, {counts['contended']} gave up retrying, "
+                f"{counts['locked']} lock timeouts"
+            )
+            self.stdout.write(
+                f'{active_seats} seats sold, inventory says {inventory.booked_count}, '
+                f'{double_booked} double-booked'
+            )
+            if double_booked or inventory.booked_count != active_seats:
+                raise CommandError('Seat inventory is inconsistent with bookings.')
+            self.stdout.write(self.style.SUCCESS('No double bookings.'))
+        finally:
+            for obj in cleanup:
+                obj.delete()
+            User.objects.filter(id__in=[user.id for user in users]).delete()
+
+    def bench_bookings(self, options):
+        """Measure sequential bookings per second through the booking write path"""
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                # WAL is a property of the database file and stays on once set
+                cursor.execute('PRAGMA journal_mode=WAL')
+                journal_mode = cursor.fetchone()[0]
+            self.stdout.write(f'sqlite journal mode: {journal_mode}')
+        route_bus, cleanup = self.make_trip(rows=10, cols_per_side=[2, 2])
+        seats = list(Seat.objects.filter(bus=route_bus.bus).order_by('row', 'column'))
+        user = User.objects.create_user(f'bench-{uuid.uuid4().hex[:12]}')
+        price = route_bus.route.base_price
+
+        def insert_booking(travel_date, picked, bulk):
+            with transaction.atomic():
+                booking = Booking.objects.create(
+                    user=user, route_bus=route_bus, booking_date=date.today(), travel_date=travel_date,
+                    total_price=price * len(picked), seat_count=len(picked), status='Confirmed',
+                )
+                booking_seats = [
+                    BookingSeat(booking=booking, seat=seat, price=price, route_bus=route_bus, travel_date=travel_date)
+                    for seat in picked
+                ]
+                if bulk:
+                    BookingSeat.objects.bulk_create(booking_seats)
+                else:
+                    # The old write path: one INSERT per seat
+                    for booking_seat in booking_seats:
+                        booking_seat.save()
+
+        paths = [
+            ('write path', lambda travel_date, picked: reserve_seats(user, route_bus, travel_date, picked, price)),
+            ('bulk inserts', lambda travel_date, picked: insert_booking(travel_date, picked, bulk=True)),
+            ('per-seat inserts', lambda travel_date, picked: insert_booking(travel_date, picked, bulk=False)),
+        ]
+        try:
+            # Every booking goes to its own date so none of them conflict
+            next_date = date.today() + timedelta(days=1)
+            for group_size in (1, 2, 6):
+                picked = seats[:group_size]
+                rates = {}
+                for name, book in paths:
+                    travel_dates = [next_date + timedelta(days=day) for day in range(options['iterations'])]
+                    next_date += timedelta(days=options['iterations'])
+                    # Build the trip inventories up front so only the booking itself is timed
+                    for travel_date in travel_dates:
+                        get_trip_inventory(route_bus, travel_date)
+                    started = time.perf_counter()
+                    for travel_date in travel_dates:
+                        book(travel_date, picked)
+                    rates[name] = options['iterations'] / (time.perf_counter() - started)
+                self.stdout.write(
+                    f"{connection.vendor}, {group_size} seats per booking: "
+                    f"write path {rates['write path']:.0f} bookings/s; without the seat claim, "
+                    f"bulk inserts {rates['bulk inserts']:.0f}/s, per-seat inserts {rates['per-seat inserts']:.0f}/s"
+                )
+        finally:
+            for obj in cleanup:
+                obj.delete()
+            user.delete()
+
+    def bench_layout(self, options):
+        """Compare the indexed seat grid build with the old per-cell linear scan"""
+        def linear_scan_rows(layout, seats):
+            seat_rows = []
+            for row_num in range(1, layout.rows + 1):
+                row_seats = []
+                for col_num in range(1, layout.width + 1):
+                    seat = next((s for s in seats if s.row == row_num and s.column == col_num), None)
+                    row_seats.append({'seat': seat, 'is_booked': False} if seat else None)
+                seat_rows.append(row_seats)
+            return seat_rows
+
+        # 200 rows stands in for a double-decker with 100 rows per deck
+        for rows, cols_per_side in [(15, [2, 3]), (50, [2, 2]), (100, [2, 2]), (200, [2, 2])]:
+            layout = SeatLayout(rows, cols_per_side)
+            seats = [
+                Seat(id=index, seat_number=spec.seat_number, row=spec.row, column=spec.column)
+                for index, spec in enumerate(layout.seat_specs(), start=1)
+            ]
+            timings = {}
+            for name, build in [
+                ('indexed', lambda: layout.build_rows(seats, lambda seat: False)),
+                ('linear scan', lambda: linear_scan_rows(layout, seats)),
+            ]:
+                started = time.perf_counter()
+                for _ in range(options['iterations']):
+                    build()
+                timings[name] = (time.perf_counter() - started) / options['iterations'] * 1000
+            self.stdout.write(
+                f"{rows:>4} rows x {layout.width} cols ({len(seats)} seats): "
+                f"indexed {timings['indexed']:.3f} ms, linear scan {timings['linear scan']:.3f} ms "
+                f"({timings['linear scan'] / timings['indexed']:.0f}x)"
+            )
+
+    def bench_trip_search(self, options):
+        """Compare the weekday bitmask query with filtering available_days in Python"""
+        route_bus, cleanup = self.make_trip(rows=1, cols_per_side=[1, 0])
+        route, bus = route_bus.route, route_bus.bus
+        travel_date = date.today() + timedelta(days=1)
+        try:
+            for size in options['size']:
+                RouteBus.objects.filter(route=route).delete()
+                departures = []
+                for minute in range(min(size, 24 * 60)):
+                    days = sorted(random.sample(range(7), random.randint(1, 7)))
+                    departures.append(RouteBus(
+                        route=route, bus=bus,
+                        departure_time=clock_time(minute // 60, minute % 60),
+                        arrival_time=clock_time((minute // 60 + 4) % 24, minute % 60),
+                        available_days=days, days_mask=days_to_mask(days),
+                    ))
+                RouteBus.objects.bulk_create(departures)
+
+                def python_filter():
+                    day_of_week = travel_date.weekday()
+                    return [
+                        rb for rb in RouteBus.objects.filter(route=route)
+                        if day_of_week in (rb.available_days if isinstance(rb.available_days, list) else [])
+                    ]
+
+                def indexed_query():
+                    return list(RouteBus.objects.filter(route=route).running_on(travel_date))
+
+                if len(python_filter()) != len(indexed_query()):
+                    raise CommandError('Bitmask search disagrees with available_days.')
+                timings = {}
+                for name, search in [('bitmask', indexed_query), ('python', python_filter)]:
+                    started = time.perf_counter()
+                    for _ in range(options['iterations']):
+                        search()
+                    timings[name] = (time.perf_counter() - started) / options['iterations'] * 1000
+                self.stdout.write(
+                    f"{len(departures):>5} departures, {len(indexed_query())} running: "
+                    f"bitmask {timings['bitmask']:.2f} ms, python filter {timings['python']:.2f} ms"
+                )
+        finally:
+            for obj in cleanup:
+                obj.delete()
+
+    def bench_pricing(self, options):
+        """Quote listings of --size departures one call at a time and in one batched pass"""
+        rules = [
+            FareRule(kind='occupancy', min_value=50, max_value=79, multiplier=Decimal('1.10')),
+            FareRule(kind='occupancy', min_value=80, max_value=100, multiplier=Decimal('1.25')),
+            FareRule(kind='weekday', min_value=4, max_value=6, multiplier=Decimal('1.15')),
+            FareRule(kind='lead_time', min_value=0, max_value=2, multiplier=Decimal('1.20')),
+            FareRule(kind='lead_time', min_value=30, max_value=365, bus_type='AC', multiplier=Decimal('0.90')),
+        ]
+        bus_types = [choice for choice, _ in Bus.BUS_TYPE_CHOICES]
+        travel_date = date.today() + timedelta(days=1)
+        for size in options['size']:
+            routes = [Route(id=index + 1, base_price=Decimal(random.randint(200, 2000))) for index in range(10)]
+            route_buses, booked_counts = [], {}
+            for index in range(size):
+                bus = Bus(id=index + 1, bus_type=random.choice(bus_types), total_seats=40)
+                route_buses.append(RouteBus(id=index + 1, route=random.choice(routes), bus=bus))
+                booked_counts[index + 1] = random.randint(0, 40)
+
+            engine = PricingEngine(rules)
+            batched = engine.quote_many(route_buses, travel_date, booked_counts)
+            single = {rb.id: engine.quote(rb, travel_date, booked_counts[rb.id]) for rb in route_buses}
+            if batched != single:
+                raise CommandError('Batched quotes disagree with single quotes.')
+
+            timings = {}
+            for name, run in [
+                ('base', lambda: [base_fare(rb.route, rb.bus) for rb in route_buses]),
+                ('single', lambda: [engine.quote(rb, travel_date, booked_counts[rb.id]) for rb in route_buses]),
+                ('batched', lambda: engine.quote_many(route_buses, travel_date, booked_counts)),
+            ]:
+                started = time.perf_counter()
+                for _ in range(options['iterations']):
+                    run()
+                timings[name] = (time.perf_counter() - started) / options['iterations'] / size * 1e6
+            self.stdout.write(
+                f"{size:>5} departures: batched {timings['batched']:.2f} us, "
+                f"single {timings['single']:.2f} us, base fare only {timings['base']:.2f} us per departure"
+            )
+
+    def bench_planner(self, options):
+        """Plan journeys on synthetic networks of --size stops, without touching the database"""
+        for stops in options['size']:
+            schedules = []
+            route_bus_id = 0
+            # Towns link to their neighbours and to a regional hub; hubs link to each other
+            hubs = max(stops // 100, 5)
+            for origin in range(stops):
+                destinations = {(origin - 1) % stops, (origin + 1) % stops, origin % hubs}
+                if origin < hubs:
+                    destinations.update(range(hubs))
+                    destinations.update(range(origin, stops, hubs))
+                destinations.discard(origin)
+                for destination in destinations:
+                    for _ in range(random.randint(2, 6)):
+                        route_bus_id += 1
+                        departure = random.randrange(24 * 60)
+                        schedules.append(Schedule(
+                            route_bus_id, origin, destination, departure,
+                            (departure + random.randint(45, 360)) % (24 * 60),
+                            random.randint(1, 127), random.randint(100, 900),
+                        ))
+
+            started = time.perf_counter()
+            index = JourneyIndex(schedules)
+            build_ms = (time.perf_counter() - started) * 1000
+
+            travel_date = date.today() + timedelta(days=1)
+            pairs = [random.sample(range(stops), 2) for _ in range(options['iterations'])]
+            found = 0
+            started = time.perf_counter()
+            for origin, destination in pairs:
+                found += bool(index.plan(travel_date, origin, destination, limit=5))
+            query_ms = (time.perf_counter() - started) / len(pairs) * 1000
+
+            self.stdout.write(
+                f"{stops:>5} stops, {len(schedules)} departures: index built in {build_ms:.0f} ms, "
+                f"{query_ms:.2f} ms per query, {found}/{len(pairs)} pairs connected"
+            )
+
+    def bench_http(self, options):
+        """Load test the read-heavy pages of a running server with concurrent clients
+
+        Start the server on the same database first, once under WSGI (runserver
+        or gunicorn) and once under ASGI (for example uvicorn), and compare.
+        """
+        route_bus = RouteBus.objects.select_related('route').order_by('id').first()
+        if route_bus is None:
+            raise CommandError('Add at least one route with a bus before load testing.')
+        travel_date = date.today() + timedelta(days=1)
+        while not route_bus.days_mask & (1 << travel_date.weekday()):
+            travel_date += timedelta(days=1)
+
+        # A real session lets the clients through login_required on seat selection
+        user = User.objects.create_user(f'bench-{uuid.uuid4().hex[:12]}')
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.save()
+        cookie = f'{settings.SESSION_COOKIE_NAME}={session.session_key}'
+
+        base_url = options['base_url'].rstrip('/')
+        pages = {
+            'home': '/',
+            'buses': f'/routes/{route_bus.route_id}/buses/?travel_date={travel_date}',
+            'seats': f'/route-bus/{route_bus.id}/seats/?travel_date={travel_date}',
+        }
+        latencies = {name: [] for name in pages}
+        errors = []
+        lock = threading.Lock()
+
+        def client():
+            for _ in range(options['iterations']):
+                for name, path in pages.items():
+                    request = urllib.request.Request(base_url + path, headers={'Cookie': cookie})
+                    started = time.perf_counter()
+                    try:
+                        with urllib.request.urlopen(request, timeout=30) as response:
+                            response.read()
+                    except OSError as e:
+                        with lock:
+                            errors.append(f'{name}: {e}')
+                        continue
+                    with lock:
+                        latencies[name].append(time.perf_counter() - started)
+
+        try:
+            started = time.perf_counter()
+            clients = [threading.Thread(target=client) for _ in range(options['threads'])]
+            for thread in clients:
+                thread.start()
+            for thread in clients:
+                thread.join()
+            elapsed = time.perf_counter() - started
+        finally:
+            session.delete()
+            user.delete()
+
+        completed = sum(len(samples) for samples in latencies.values())
+        self.stdout.write(
+            f"{base_url} with {options['threads']} clients: {completed} requests in {elapsed:.2f}s "
+            f"({completed / elapsed:.0f} req/s), {len(errors)} errors"
+        )
+        for name, samples in latencies.items():
+            if not samples:
+                continue
+            samples.sort()
+            self.stdout.write(
+                f"  {name:<6} p50 {samples[len(samples) // 2] * 1000:.1f} ms, "
+                f"p95 {samples[int(len(samples) * 0.95)] * 1000:.1f} ms"
+            )
+        if errors:
+            raise CommandError(f'First error: {errors[0]}')
+
+    def bench_analytics(self, options):
+        """Export the trip report over --size bookings, from seat counts and from booking seats"""
+        route_bus, cleanup = self.make_trip(rows=10, cols_per_side=[2, 2])
+        seats = list(Seat.objects.filter(bus=route_bus.bus).order_by('row', 'column'))
+        user = User.objects.create_user(f'bench-{uuid.uuid4().hex[:12]}')
+        price = route_bus.route.base_price
+        # Far in the future so the throwaway trip is the only one in the report range
+        first_day = date(2999, 1, 1)
+        try:
+            created = 0
+            for size in sorted(options['size']):
+                # Ten bookings of up to three seats per travel date never run out of seats
+                while created < size:
+                    batch = []
+                    for index in range(created, min(size, created + 5000)):
+                        day, slot = divmod(index, 10)
+                        picked = seats[slot * 3:slot * 3 + random.randint(1, 3)]
+                        status = 'Cancelled' if random.random() < 0.1 else 'Confirmed'
+                        batch.append((Booking(
+                            user=user, route_bus=route_bus, booking_date=date.today(),
+                            travel_date=first_day + timedelta(days=day), total_price=price * len(picked),
+                            seat_count=len(picked), status=status,
+                        ), picked))
+                    Booking.objects.bulk_create([booking for booking, _ in batch])
+                    BookingSeat.objects.bulk_create([
+                        BookingSeat(
+                            booking=booking, seat=seat, price=price, route_bus=route_bus,
+                            travel_date=booking.travel_date, is_active=booking.status == 'Confirmed',
+                        )
+                        for booking, picked in batch
+                        for seat in picked
+                    ])
+                    created += len(batch)
+                booking_seats = BookingSeat.objects.filter(route_bus=route_bus).count()
+
+                def from_booking_seats():
+                    # The alternative: join and sum every booking seat
+                    groups = (
+                        BookingSeat.objects.filter(route_bus=route_bus, travel_date__gte=first_day)
+                        .values('travel_date', 'route_bus_id').order_by('travel_date', 'route_bus_id')
+                        .annotate(
+                            seats_sold=Count('id', filter=Q(booking__status='Confirmed')),
+                            revenue=Sum('price', filter=Q(booking__status='Confirmed')),
+                        )
+                    )
+                    return sum(1 for _ in groups.iterator(chunk_size=2000))
+
+                def from_seat_counts():
+                    return write_csv(trip_report(start=first_day), io.StringIO())
+
+                timings = {}
+                for name, export in [('seat counts', from_seat_counts), ('booking seats', from_booking_seats)]:
+                    started = time.perf_counter()
+                    trips = export()
+                    timings[name] = time.perf_counter() - started
+                tracemalloc.start()
+                # Discard the CSV as it is written so only the export itself is traced
+                with open(os.devnull, 'w') as discard:
+                    write_csv(trip_report(start=first_day), discard)
+                peak_kb = tracemalloc.get_traced_memory()[1] / 1024
+                tracemalloc.stop()
+                self.stdout.write(
+                    f"{connection.vendor}, {size} bookings ({booking_seats} seats) in {trips} trips: "
+                    f"report from seat counts {timings['seat counts']:.2f}s "
+                    f"({size / timings['seat counts']:.0f} bookings/s, peak {peak_kb:.0f} KiB traced), "
+                    f"summing booking seats {timings['booking seats']:.2f}s"
+                )
+        finally:
+            for obj in cleanup:
+                obj.delete()
+            user.delete()
+
+    def bench_admin(self, options):
+        """Time the booking admin's list, filter, date and change pages over --size bookings"""
+        route_bus, cleanup = self.make_trip(rows=10, cols_per_side=[2, 2])
+        # Twenty departures and a thousand travellers share the bookings
+        departures = [route_bus] + [
+            RouteBus.objects.create(
+                route=route_bus.route, bus=route_bus.bus, departure_time=clock_time(hour, 15), arrival_time=clock_time(hour, 45),
+                available_days=list(range(7)),
+            )
+            for hour in range(1, 20)
+        ]
+        users = User.objects.bulk_create(User(username=f'bench-{uuid.uuid4().hex[:12]}') for _ in range(1000))
+        admin_user = User.objects.create_superuser(f'bench-admin-{uuid.uuid4().hex[:8]}')
+        statuses = ['Confirmed'] * 7 + ['Cancelled', 'Expired', 'Pending']
+        first_day = date(2999, 1, 1)
+        setup_test_environment()
+        try:
+            client = Client()
+            client.force_login(admin_user)
+            created = 0
+            for size in sorted(options['size']):
+                while created < size:
+                    Booking.objects.bulk_create(
+                        Booking(
+                            user=random.choice(users), route_bus=random.choice(departures), booking_date=date.today(),
+                            travel_date=first_day + timedelta(days=random.randrange(1000)),
+                            total_price=route_bus.route.base_price, seat_count=1, status=random.choice(statuses),
+                        )
+                        for _ in range(min(size - created, 10000))
+                    )
+                    created = min(size, created + 10000)
+                newest = Booking.objects.order_by('-id').values_list('id', flat=True).first()
+                # The deepest page there is; the admin redirects a page past the end back to the first
+                last_page = max(1, -(-Booking.objects.count() // BookingAdmin.list_per_page))
+                pages = [
+                    ('list', '/admin/booking/booking/'),
+                    (f'page {last_page}', f'/admin/booking/booking/?p={last_page}'),
+                    ('status', '/admin/booking/booking/?status__exact=Cancelled'),
+                    ('year', '/admin/booking/booking/?travel_date__year=2999'),
+                    ('month', '/admin/booking/booking/?travel_date__year=2999&travel_date__month=6'),
+                    ('departure', f'/admin/booking/booking/?route_bus__id__exact={route_bus.id}'),
+                    ('user', f'/admin/booking/booking/?user__id__exact={users[0].id}'),
+                    ('change', f'/admin/booking/booking/{newest}/change/'),
+                ]
+                self.stdout.write(f'{connection.vendor}, {Booking.objects.count()} bookings:')
+                for name, url in pages:
+                    samples = []
+                    for _ in range(5):
+                        # The bulk inserts above filled the query log
+                        reset_queries()
+                        with CaptureQueriesContext(connection) as queries:
+                            started = time.perf_counter()
+                            response = client.get(url)
+                            samples.append(time.perf_counter() - started)
+                        if response.status_code != 200:
+                            raise CommandError(f'{url} returned {response.status_code}')
+                    samples.sort()
+                    self.stdout.write(
+                        f"  {name:<10} best {samples[0] * 1000:.0f} ms, median {samples[2] * 1000:.0f} ms, "
+                        f"{len(queries.captured_queries)} queries taking "
+                        f"{sum(float(query['time']) for query in queries.captured_queries) * 1000:.0f} ms"
+                    )
+        finally:
+            teardown_test_environment()
+            for obj in cleanup:
+                obj.delete()
+            User.objects.filter(id__in=[user.id for user in users] + [admin_user.id]).delete()
@@ -0,0 +1,375 @@
+import json
+import random
+import time
+from collections import namedtuple
+from datetime import date, time as clock_time, timedelta
+from decimal import Decimal
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+
+from booking import urls as booking_urls
+from booking.archive import archive_bookings, archive_cutoff
+from booking.fleet import sync_bus_seats
+from booking.inventory import ACTIVE_BOOKING_STATUSES
+from booking.models import (
+    ArchivedBooking, Booking, BookingSeat, Bus, Location, Route, RouteBus, Seat, days_to_mask,
+)
+from booking.pagination import paginate_merged_by_cursor
+from booking.planner import invalidate_journey_index
+from booking.pricing import invalidate_pricing_engine
+from booking.quotes import issue_quote
+from booking.refcache import bump_generation
+from booking.reservations import checkout_seats, reserve_seats
+from booking.search import invalidate_location_index
+
+# One request against a view; prepare does any unmeasured setup and returns the request to time
+Scenario = namedtuple('Scenario', ['view', 'label', 'prepare', 'status'])
+
+Fixture = namedtuple('Fixture', [
+    'traveller', 'route_bus', 'travel_date', 'origin', 'destination',
+    'booking', 'archived_booking', 'dashboard_cursor', 'spare_seats',
+])
+
+
+class Command(BaseCommand):
+    help = 'Check every booking view against its query budget on growing data, and its latency against a baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scales', type=int, nargs='+', default=[1, 10],
+            help='Data sizes to seed; query counts must not change between them',
+        )
+        parser.add_argument('--repeat', type=int, default=15, help='Timed requests per scenario')
+        parser.add_argument(
+            '--baseline', default=str(settings.BASE_DIR / 'query_budget_baseline.json'),
+            help='JSON file of the best latency per scenario at the largest scale',
+        )
+        parser.add_argument('--record', action='store_true', help='Write the measured latencies as the new baseline')
+        parser.add_argument(
+            '--tolerance', type=float, default=2.0,
+            help='Fail when a best latency exceeds the baseline by this factor',
+        )
+        parser.add_argument(
+            '--min-regression-ms', type=float, default=2.0,
+            help='Ignore latency growth smaller than this, which is timer noise',
+        )
+
+    def handle(self, *args, **options):
+        if not 1 <= options['repeat'] <= 30:
+            raise CommandError('--repeat must be between 1 and 30.')
+        scenarios = self.scenarios()
+        covered = {scenario.view for scenario in scenarios}
+        missing = [
+            pattern.name for pattern in booking_urls.urlpatterns
+            if f'{booking_urls.app_name}:{pattern.name}' not in covered
+        ]
+        if missing:
+            raise CommandError(f"No query budget scenario for: {', '.join(missing)}.")
+
+        # Everything runs against a throwaway test database
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            results = {}
+            for scale in sorted(set(options['scales'])):
+                results[scale] = self.measure(scale, scenarios, options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        failures = self.check_budgets(results)
+        failures += self.check_baseline(results[max(results)], options)
+        if failures:
+            for failure in failures:
+                self.stdout.write(self.style.ERROR(failure))
+            raise CommandError(f'{len(failures)} query budget or latency regressions.')
+        self.stdout.write(self.style.SUCCESS(f'All {len(scenarios)} scenarios are within budget.'))
+
+    def measure(self, scale, scenarios, repeat):
+        """Seed data at a scale and return {label: (view, queries, best_ms)}"""
+        call_command('flush', interactive=False, verbosity=0)
+        for cache in caches.all():
+            cache.clear()
+        started = time.perf_counter()
+        fixture, counts = self.seed(scale)
+        # Bulk inserts skip the signals that normally retire cached reference data
+        bump_generation()
+        invalidate_location_index()
+        invalidate_journey_index()
+        invalidate_pricing_engine()
+        self.stdout.write(
+            f"Scale {scale}: {counts['routes']} routes, {counts['departures']} departures, "
+            f"{counts['seats']} seats, {counts['bookings']} bookings, {counts['archived']} archived "
+            f"(seeded in {time.perf_counter() - started:.1f}s)"
+        )
+
+        client = Client()
+        client.force_login(fixture.traveller)
+        results = {}
+        for scenario in scenarios:
+            # The first request fills caches and inventories; budgets apply to warm requests
+            self.run_scenario(client, scenario, fixture)
+            queries, timings = 0, []
+            for _ in range(repeat):
+                request = scenario.prepare(client, fixture)
+                with CaptureQueriesContext(connection) as captured:
+                    request_started = time.perf_counter()
+                    response = request()
+                    timings.append((time.perf_counter() - request_started) * 1000)
+                self.check_status(scenario, response)
+                # Django also logs COMMIT and ROLLBACK; count statements as the instrumentation does
+                statements = [query for query in captured if query['sql'] not in ('COMMIT', 'ROLLBACK')]
+                queries = max(queries, len(statements))
+            # The fastest run is the one least disturbed by whatever else the machine is doing
+            best_ms = min(timings)
+            results[scenario.label] = (scenario.view, queries, best_ms)
+            self.stdout.write(f'  {scenario.label:<44} {queries:>3} queries {best_ms:>8.2f} ms')
+        return results
+
+    def run_scenario(self, client, scenario, fixture):
+        response = scenario.prepare(client, fixture)()
+        self.check_status(scenario, response)
+
+    def check_status(self, scenario, response):
+        if response.streaming:
+            # Reading the snapshot and closing the stream ends the event subscription
+            next(iter(response.streaming_content))
+            response.close()
+        if response.status_code != scenario.status:
+            raise CommandError(
+                f'{scenario.label} returned {response.status_code}, expected {scenario.status}.'
+            )
+
+    def check_budgets(self, results):
+        failures = []
+        budgets = getattr(settings, 'QUERY_BUDGETS', {})
+        scales = sorted(results)
+        for label, (view, _, _) in results[scales[0]].items():
+            counts = [results[scale][label][1] for scale in scales]
+            budget = budgets.get(view)
+            if budget is None:
+                failures.append(f'{label}: {view} has no entry in QUERY_BUDGETS.')
+            elif max(counts) > budget:
+                failures.append(f'{label}: {max(counts)} queries, over the {view} budget of {budget}.')
+            if len(set(counts)) > 1:
+                growth = ', '.join(f'{count} at scale {scale}' for scale, count in zip(scales, counts))
+                failures.append(f'{label}: query count changes with data size ({growth}).')
+        return failures
+
+    def check_baseline(self, results, options):
+        baseline_path = Path(options['baseline'])
+        timings = {label: round(best_ms, 3) for label, (_, _, best_ms) in results.items()}
+        if options['record']:
+            baseline_path.write_text(json.dumps(timings, indent=2, sort_keys=True) + '\n')
+            self.stdout.write(f'Recorded latency baseline in {baseline_path}.')
+            return []
+        if not baseline_path.exists():
+            self.stdout.write(f'No latency baseline at {baseline_path}; run with --record to create one.')
+            return []
+
+        baseline = json.loads(baseline_path.read_text())
+        failures = []
+        for label, best_ms in timings.items():
+            expected = baseline.get(label)
+            if expected is None:
+                continue
+            if best_ms > expected * options['tolerance'] and best_ms - expected > options['min_regression_ms']:
+                failures.append(f'{label}: best of runs {best_ms:.2f} ms, baseline {expected:.2f} ms.')
+        return failures
+
+    def seed(self, scale):
+        """Seed a network of scale * 20 towns with thousands of bookings at the larger scales
+
+        The measured traveller and trip look the same at every scale, so only
+        the amount of surrounding data changes.
+        """
+        rng = random.Random(scale)
+        today = date.today()
+        locations = Location.objects.bulk_create(
+            Location(name=f'Town {index:04d}', code=f'T{index:04d}') for index in range(scale * 20)
+        )
+        routes = Route.objects.bulk_create(
+            Route(
+                origin=origin, destination=destination,
+                distance=Decimal(rng.randint(50, 500)), base_price=Decimal(rng.randint(100, 900)),
+            )
+            for origin, destination in zip(locations, locations[1:])
+        )
+        buses = Bus.objects.bulk_create(
+            Bus(
+                name=f'Coach {index:04d}', bus_type=rng.choice(Bus.BUS_TYPE_CHOICES)[0], total_seats=40,
+                seat_layout={'rows': 10, 'cols_per_side': [2, 2]},
+            )
+            for index in range(scale * 5)
+        )
+        sync_bus_seats(buses)
+        every_day = list(range(7))
+        route_buses = RouteBus.objects.bulk_create(
+            RouteBus(
+                route=route, bus=buses[(index * 3 + departure) % len(buses)],
+                departure_time=clock_time(6 + departure * 5), arrival_time=clock_time(10 + departure * 5),
+                available_days=every_day, days_mask=days_to_mask(every_day),
+            )
+            for index, route in enumerate(routes)
+            for departure in range(3)
+        )
+        seats_by_bus = {}
+        for seat in Seat.objects.order_by('row', 'column'):
+            seats_by_bus.setdefault(seat.bus_id, []).append(seat)
+
+        traveller = User.objects.create_user('traveller')
+        others = User.objects.bulk_create(User(username=f'passenger-{index}') for index in range(scale * 20))
+
+        # The measured trip is a week out; the write scenarios use the days after it
+        route_bus = route_buses[0]
+        travel_date = today + timedelta(days=7)
+        next_seat = {}
+
+        def claim(route_bus, travel_date, count):
+            seats = seats_by_bus[route_bus.bus_id]
+            start = next_seat.get((route_bus.id, travel_date), 0)
+            next_seat[route_bus.id, travel_date] = start + count
+            return seats[start:start + count]
+
+        bookings = []
+        plan = [(traveller, rng.choice(route_buses[1:])) for _ in range(scale * 30)]
+        plan += [(rng.choice(others), rng.choice(route_buses[1:])) for _ in range(scale * 200)]
+        plan += [(rng.choice(others), route_bus)] * 5
+        for user, trip in plan:
+            day = travel_date if trip is route_bus else today + timedelta(days=rng.randint(-30, 30))
+            seats = claim(trip, day, rng.randint(1, 2) if trip is route_bus else rng.randint(1, 3))
+            if not seats:
+                continue
+            status = 'Confirmed' if trip is route_bus else rng.choice(['Confirmed', 'Confirmed', 'Cancelled'])
+            bookings.append((
+                Booking(
+                    user=user, route_bus=trip, booking_date=today, travel_date=day,
+                    total_price=trip.route.base_price * len(seats), seat_count=len(seats), status=status,
+                ),
+                seats,
+            ))
+        Booking.objects.bulk_create([booking for booking, _ in bookings], batch_size=500)
+        BookingSeat.objects.bulk_create([
+            BookingSeat(
+                booking=booking, seat=seat, price=booking.route_bus.route.base_price,
+                route_bus=booking.route_bus, travel_date=booking.travel_date,
+                is_active=booking.status in ACTIVE_BOOKING_STATUSES,
+            )
+            for booking, seats in bookings
+            for seat in seats
+        ], batch_size=500)
+
+        # Past trips move to the archive, as the nightly archive_bookings job would
+        archived = archive_bookings(archive_cutoff())
+
+        confirmed = Booking.objects.filter(user=traveller, status='Confirmed', travel_date__gte=today).first()
+        page = paginate_merged_by_cursor(
+            [model.objects.filter(user=traveller).exclude(status='Expired') for model in (Booking, ArchivedBooking)],
+            None, settings.DASHBOARD_PAGE_SIZE,
+        )
+        fixture = Fixture(
+            traveller=traveller, route_bus=route_bus, travel_date=travel_date,
+            origin=locations[0], destination=locations[3], booking=confirmed,
+            archived_booking=ArchivedBooking.objects.filter(user=traveller, status='Confirmed').first(),
+            dashboard_cursor=page.next_cursor, spare_seats=list(reversed(seats_by_bus[route_bus.bus_id])),
+        )
+        counts = {
+            'routes': len(routes),
+            'departures': len(route_buses),
+            'seats': sum(len(seats) for seats in seats_by_bus.values()),
+            'bookings': len(bookings),
+            'archived': archived,
+        }
+        return fixture, counts
+
+    def scenarios(self):
+        def get(path):
+            def prepare(client, fixture):
+                url = path(fixture)
+                return lambda: client.get(url)
+            return prepare
+
+        def checkout(client, fixture):
+            # Each checkout replaces the previous hold, so the same seats can be picked every time
+            data = {
+                'route_bus_id': fixture.route_bus.id,
+                'selected_seats': [seat.id for seat in fixture.spare_seats[:2]],
+                'travel_date': (fixture.travel_date + timedelta(days=1)).isoformat(),
+            }
+            return lambda: client.post('/checkout/', data)
+
+        def confirm(client, fixture):
+            # Confirmed seats stay sold, so every confirmation holds a fresh seat first
+            seat = fixture.spare_seats.pop()
+            hold, seats, price_per_seat = checkout_seats(
+                fixture.traveller, fixture.route_bus, fixture.travel_date + timedelta(days=2), [seat.id],
+            )
+            data = {'quote_token': issue_quote(hold, seats, price_per_seat)}
+            return lambda: client.post('/confirm-booking/', data)
+
+        def cancel(client, fixture):
+            booking = reserve_seats(
+                fixture.traveller, fixture.route_bus, fixture.travel_date + timedelta(days=3),
+                fixture.spare_seats[:1], fixture.route_bus.route.base_price,
+            )
+            return lambda: client.post(f'/booking/{booking.id}/cancel/')
+
+        date_query = lambda fixture: f'travel_date={fixture.travel_date.isoformat()}'
+        return [
+            Scenario('booking:home', 'home', get(lambda fixture: '/'), 200),
+            Scenario('booking:home', 'home search', get(lambda fixture: '/?search=town%2000'), 200),
+            Scenario(
+                'booking:location_suggestions', 'location suggestions',
+                get(lambda fixture: '/locations/suggest/?q=town'), 200,
+            ),
+            Scenario(
+                'booking:buses', 'bus list',
+                get(lambda fixture: f'/routes/{fixture.route_bus.route_id}/buses/?{date_query(fixture)}'), 200,
+            ),
+            Scenario(
+                'booking:journeys', 'journey planner',
+                get(lambda fixture: (
+                    f'/journeys/?origin={fixture.origin.id}&destination={fixture.destination.id}'
+                    f'&{date_query(fixture)}'
+                )), 200,
+            ),
+            Scenario(
+                'booking:seat_selection', 'seat selection',
+                get(lambda fixture: f'/route-bus/{fixture.route_bus.id}/seats/?{date_query(fixture)}'), 200,
+            ),
+            Scenario(
+                'booking:seat_events', 'seat events snapshot',
+                get(lambda fixture: f'/route-bus/{fixture.route_bus.id}/seats/events/?{date_query(fixture)}'), 200,
+            ),
+            Scenario('booking:checkout', 'checkout', checkout, 200),
+            Scenario('booking:confirm_booking', 'confirm booking', confirm, 302),
+            Scenario(
+                'booking:booking_confirmation', 'booking confirmation',
+                get(lambda fixture: f'/booking/{fixture.booking.id}/confirmation/'), 200,
+            ),
+            Scenario(
+                'booking:booking_confirmation', 'archived booking confirmation',
+                get(lambda fixture: f'/booking/{fixture.archived_booking.id}/confirmation/'), 200,
+            ),
+            Scenario('booking:dashboard', 'dashboard', get(lambda fixture: '/dashboard/'), 200),
+            Scenario(
+                'booking:dashboard', 'dashboard upcoming', get(lambda fixture: '/dashboard/?show=upcoming'), 200,
+            ),
+            Scenario(
+                'booking:dashboard', 'dashboard second page',
+                get(lambda fixture: f'/dashboard/?cursor={fixture.dashboard_cursor}'), 200,
+            ),
+            Scenario(
+                'booking:cancel_booking', 'cancel booking page',
+                get(lambda fixture: f'/booking/{fixture.booking.id}/cancel/'), 200,
+            ),
+            Scenario('booking:cancel_booking', 'cancel booking', cancel, 302),
+        ]
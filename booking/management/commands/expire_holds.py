@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from booking.reservations import expire_holds
+
+
+class Command(BaseCommand):
+    help = 'Expire lapsed seat holds and return their seats to sale'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Holds expired per transaction')
+        parser.add_argument(
+            '--loop', type=int, metavar='SECONDS', default=0,
+            help='Keep running, sweeping every SECONDS seconds',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            expired = expire_holds(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Expired {expired} seat holds'))
+            if not options['loop']:
+                return
+            time.sleep(options['loop'])
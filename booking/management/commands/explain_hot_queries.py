@@ -0,0 +1,141 @@
+import re
+from collections import namedtuple
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from booking.inventory import ACTIVE_BOOKING_STATUSES
+from booking.analytics import booking_sums, reported_bookings
+from booking.models import ArchivedBooking, ArchivedBookingSeat, Booking, BookingSeat, RouteBus, Seat, TripInventory
+
+HotQuery = namedtuple('HotQuery', ['label', 'source', 'queryset'])
+
+# Plan steps that read a whole table (or a whole index, which is no better)
+FULL_SCAN_PATTERNS = {
+    'sqlite': re.compile(r'\bSCAN (?!CONSTANT ROW)(\S+)'),
+    'postgresql': re.compile(r'\bSeq Scan on (\S+)'),
+}
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN the hot booking queries on a fresh test database and fail if any scans a whole table'
+
+    def handle(self, *args, **options):
+        if connection.vendor not in FULL_SCAN_PATTERNS:
+            raise CommandError(f'EXPLAIN checks support SQLite and PostgreSQL, not {connection.vendor}.')
+        full_scan = FULL_SCAN_PATTERNS[connection.vendor]
+
+        # The schema under test is exactly what the migrations build
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            if connection.vendor == 'postgresql':
+                # Empty tables make a sequential scan the cheapest plan; disabling it
+                # leaves one in the plan only when no index can serve the query
+                with connection.cursor() as cursor:
+                    cursor.execute('SET enable_seqscan = off')
+            failures = []
+            for query in self.hot_queries():
+                plan = query.queryset.explain()
+                scanned = full_scan.findall(plan)
+                if scanned:
+                    failures.append(query)
+                    self.stdout.write(self.style.ERROR(
+                        f"  FAIL {query.label} ({query.source}): full scan of {', '.join(scanned)}"
+                    ))
+                else:
+                    self.stdout.write(f'  ok   {query.label} ({query.source})')
+                if scanned or options['verbosity'] > 1:
+                    for line in plan.splitlines():
+                        self.stdout.write(f'         {line}')
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if failures:
+            raise CommandError(f'{len(failures)} hot queries scan a whole table on {connection.vendor}.')
+        self.stdout.write(self.style.SUCCESS(f'No full scans on {connection.vendor}.'))
+
+    def hot_queries(self):
+        """The queries behind every booking, hold sweep, seat map and dashboard page"""
+        today = date.today()
+        now = timezone.now()
+        cursor = Q(created_at__lt=now) | Q(created_at=now, id__lt=100)
+        lapsed = Booking.objects.filter(status='Pending', hold_expires_at__lte=now)
+        return [
+            HotQuery(
+                'active bookings on a trip', 'Booking by trip and status',
+                Booking.objects.filter(route_bus_id=1, travel_date=today, status__in=ACTIVE_BOOKING_STATUSES),
+            ),
+            HotQuery(
+                'holds being replaced', 'reservations.hold_seats',
+                BookingSeat.objects.filter(
+                    booking__in=Booking.objects.filter(user_id=1, route_bus_id=1, travel_date=today, status='Pending'),
+                    is_active=True,
+                ).select_related('seat'),
+            ),
+            HotQuery(
+                'lapsed holds', 'reservations.expire_holds',
+                lapsed.values_list('id', flat=True)[:500],
+            ),
+            HotQuery(
+                'lapsed holds on a trip', 'reservations.expire_holds',
+                lapsed.filter(route_bus_id=1, travel_date=today).values_list('id', flat=True)[:500],
+            ),
+            HotQuery(
+                'dashboard first page', 'views.dashboard_view',
+                Booking.objects.filter(user_id=1).exclude(status='Expired').order_by('-created_at', '-id')[:21],
+            ),
+            HotQuery(
+                'dashboard later page', 'pagination.paginate_by_cursor',
+                Booking.objects.filter(user_id=1).exclude(status='Expired').filter(cursor)
+                .order_by('-created_at', '-id')[:21],
+            ),
+            HotQuery(
+                'seats of listed bookings', 'views.dashboard_view',
+                BookingSeat.objects.filter(booking_id__in=[1, 2, 3]).select_related('seat'),
+            ),
+            HotQuery(
+                'seats taken on a trip', 'inventory.rebuild_trip_inventory',
+                Seat.objects.filter(
+                    bookings__route_bus_id=1, bookings__travel_date=today, bookings__is_active=True,
+                ).only('row', 'column'),
+            ),
+            HotQuery(
+                'seats taken per trip', 'inventory.booked_seat_counts',
+                BookingSeat.objects.filter(route_bus_id__in=[1, 2], travel_date=today, is_active=True)
+                .order_by().values('route_bus_id').annotate(taken=Count('id')),
+            ),
+            HotQuery(
+                'trip inventories', 'inventory.booked_seat_counts',
+                TripInventory.objects.filter(route_bus_id__in=[1, 2], travel_date=today)
+                .order_by().values_list('route_bus_id', 'booked_count'),
+            ),
+            HotQuery(
+                'departures on a date', 'refcache.get_route_departures',
+                RouteBus.objects.filter(route_id=1).running_on(today),
+            ),
+            HotQuery(
+                'bookings of a seat', 'Seat deletion cascade',
+                BookingSeat.objects.filter(seat_id=1),
+            ),
+            HotQuery(
+                'bookings to archive', 'archive.archive_batch',
+                Booking.objects.filter(travel_date__lt=today).order_by('travel_date', 'id').values_list('id', flat=True)[:1000],
+            ),
+            HotQuery(
+                'archived dashboard page', 'views.dashboard_view',
+                ArchivedBooking.objects.filter(user_id=1).exclude(status='Expired').filter(cursor)
+                .order_by('-created_at', '-id')[:21],
+            ),
+            HotQuery(
+                'seats of listed archived bookings', 'archive.prefetch_booking_seats',
+                ArchivedBookingSeat.objects.filter(booking_id__in=[1, 2, 3]).select_related('seat'),
+            ),
+            HotQuery(
+                'archived trips in a report', 'analytics.trip_groups',
+                reported_bookings(today, today, model=ArchivedBooking).values('travel_date', 'route_bus_id')
+                .annotate(**booking_sums()).order_by('travel_date', 'route_bus_id'),
+            ),
+        ]
@@ -1,66 +1,62 @@
-from django.core.management.base import BaseCommand
-from booking.models import Bus, Seat
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from booking.fleet import sync_bus_seats
+from booking.models import Bus
 
 
 class Command(BaseCommand):
-    help = 'Generate seats for a bus based on its seat layout configuration'
+    help = 'Generate seats for buses based on their seat layout configuration'
 
     def add_arguments(self, parser):
-        parser.add_argument('bus_id', type=int, help='Bus ID to generate seats for')
+        parser.add_argument('bus_ids', nargs='*', type=int, help='Bus IDs to generate seats for')
+        parser.add_argument('--all', action='store_true', help='Generate seats for every bus')
+        parser.add_argument(
+            '--bus-type', choices=[choice for choice, _ in Bus.BUS_TYPE_CHOICES],
+            help='Generate seats for every bus of this type',
+        )
+        parser.add_argument('--batch-size', type=int, default=100, help='Buses written per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='Report the changes without saving them')
 
     def handle(self, *args, **options):
-        bus_id = options['bus_id']
-        try:
-            bus = Bus.objects.get(id=bus_id)
-        except Bus.DoesNotExist:
-            self.stdout.write(self.style.ERROR(f'Bus with ID {bus_id} does not exist.'))
-            return
-
-        # Get seat layout configuration
-        seat_layout = bus.get_seat_layout_config()
-        rows = seat_layout.get('rows', 0)
-        cols_per_side = seat_layout.get('cols_per_side', [0, 0])
-        
-        if rows == 0 or sum(cols_per_side) == 0:
-            self.stdout.write(self.style.ERROR('Invalid seat layout configuration.'))
-            return
-
-        # Delete existing seats
-        Seat.objects.filter(bus=bus).delete()
-        self.stdout.write(f'Deleted existing seats for bus {bus.name}')
-
-        # Generate seats
-        seat_count = 0
-        
-        for row in range(1, rows + 1):
-            # Left side seats
-            for col in range(1, cols_per_side[0] + 1):
-                seat_letter = chr(64 + col)  # A, B, C, etc.
-                seat_type = 'Window' if col == 1 else ('Aisle' if col == cols_per_side[0] else 'Middle')
-                Seat.objects.create(
-                    bus=bus,
-                    seat_number=f'{row}{seat_letter}',  # 1A, 1B, etc.
-                    row=row,
-                    column=col,
-                    seat_type=seat_type
-                )
-                seat_count += 1
-            
-            # Right side seats
-            for col in range(cols_per_side[0] + 1, cols_per_side[0] + cols_per_side[1] + 1):
-                col_index = col - cols_per_side[0]
-                seat_letter = chr(64 + cols_per_side[0] + col_index)  # Continue from left side
-                seat_type = 'Window' if col_index == cols_per_side[1] else ('Aisle' if col_index == 1 else 'Middle')
-                Seat.objects.create(
-                    bus=bus,
-                    seat_number=f'{row}{seat_letter}',
-                    row=row,
-                    column=col,
-                    seat_type=seat_type
-                )
-                seat_count += 1
-
+        bus_ids = options['bus_ids']
+        if not (bus_ids or options['all'] or options['bus_type']):
+            raise CommandError('Give one or more bus IDs, --all or --bus-type.')
+
+        buses = Bus.objects.order_by('id')
+        if bus_ids:
+            buses = buses.filter(id__in=bus_ids)
+            missing = set(bus_ids) - set(buses.values_list('id', flat=True))
+            for bus_id in sorted(missing):
+                self.stdout.write(self.style.ERROR(f'Bus with ID {bus_id} does not exist.'))
+        if options['bus_type']:
+            buses = buses.filter(bus_type=options['bus_type'])
+        buses = list(buses)
+
+        started = time.perf_counter()
+        totals = {'created': 0, 'updated': 0, 'deactivated': 0}
+        for start in range(0, len(buses), options['batch_size']):
+            batch = buses[start:start + options['batch_size']]
+            for result in sync_bus_seats(batch, dry_run=options['dry_run']):
+                if not result.valid:
+                    self.stdout.write(self.style.ERROR(
+                        f'Invalid seat layout configuration for bus {result.bus.name}.'
+                    ))
+                    continue
+                totals['created'] += result.created
+                totals['updated'] += result.updated
+                totals['deactivated'] += result.deactivated
+                if options['verbosity'] > 1:
+                    self.stdout.write(
+                        f'{result.bus.name}: {result.created} created, {result.updated} updated, '
+                        f'{result.deactivated} deactivated'
+                    )
+        elapsed = time.perf_counter() - started
+
+        written = sum(totals.values())
+        prefix = 'Dry run: would have' if options['dry_run'] else 'Successfully'
         self.stdout.write(self.style.SUCCESS(
-            f'Successfully generated {seat_count} seats for bus {bus.name}'
+            f"{prefix} generated {totals['created']} seats, updated {totals['updated']} "
+            f"and deactivated {totals['deactivated']} across {len(buses)} buses "
+            f"in {elapsed:.2f}s ({written / elapsed if elapsed else 0:.0f} seats/s)"
         ))
-
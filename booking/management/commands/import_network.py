@@ -0,0 +1,55 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from booking.network import FEED_FILES, import_network
+
+# Row errors printed before the rest are summarised
+MAX_ERRORS_SHOWN = 20
+
+
+class Command(BaseCommand):
+    help = 'Import stops, routes, vehicles and timetables from a directory of CSV feeds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help=f'Directory holding any of {", ".join(FEED_FILES)}')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Rows written per transaction')
+        parser.add_argument(
+            '--retire-missing', action='store_true',
+            help='Stop running departures that timetables.csv no longer lists',
+        )
+
+    def handle(self, *args, **options):
+        directory = options['directory']
+        if not any(os.path.exists(os.path.join(directory, name)) for name in FEED_FILES):
+            raise CommandError(f'{directory} has none of {", ".join(FEED_FILES)}.')
+
+        started = time.perf_counter()
+        results = import_network(directory, options['batch_size'], options['retire_missing'])
+        elapsed = time.perf_counter() - started
+
+        for result in results:
+            extras = ''
+            if result.seats:
+                extras += f', {result.seats} seats generated'
+            if result.retired:
+                extras += f', {result.retired} retired'
+            self.stdout.write(
+                f'{result.feed}: {result.rows} rows in {result.elapsed:.2f}s '
+                f'({result.rows / result.elapsed if result.elapsed else 0:.0f} rows/s), '
+                f'{result.created} created, {result.updated} updated, {result.unchanged} unchanged{extras}'
+            )
+        errors = [error for result in results for error in result.errors]
+        for error in errors[:MAX_ERRORS_SHOWN]:
+            self.stdout.write(self.style.ERROR(error))
+        if len(errors) > MAX_ERRORS_SHOWN:
+            self.stdout.write(self.style.ERROR(f'... and {len(errors) - MAX_ERRORS_SHOWN} more rows skipped'))
+        if options['retire_missing'] and any(result.feed == 'timetables.csv' and result.errors for result in results):
+            self.stdout.write(self.style.WARNING('No departures were retired because timetables.csv had bad rows.'))
+
+        rows = sum(result.rows for result in results)
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {rows} rows from {len(results)} feeds in {elapsed:.2f}s '
+            f'({rows / elapsed if elapsed else 0:.0f} rows/s), {len(errors)} skipped'
+        ))
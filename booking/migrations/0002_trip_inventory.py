@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TripInventory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('travel_date', models.DateField()),
+                ('booked_seats', models.BinaryField(default=bytes, help_text='Bitmap of booked seats indexed by Seat.position')),
+                ('booked_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('route_bus', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inventories', to='booking.routebus')),
+            ],
+            options={
+                'verbose_name_plural': 'trip inventories',
+                'ordering': ['route_bus', 'travel_date'],
+                'unique_together': {('route_bus', 'travel_date')},
+            },
+        ),
+    ]
@@ -0,0 +1,88 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def copy_trip_to_booking_seats(apps, schema_editor):
+    Booking = apps.get_model('booking', 'Booking')
+    BookingSeat = apps.get_model('booking', 'BookingSeat')
+    for booking in Booking.objects.only('route_bus_id', 'travel_date', 'status').iterator():
+        BookingSeat.objects.filter(booking=booking).update(
+            route_bus_id=booking.route_bus_id,
+            travel_date=booking.travel_date,
+            is_active=booking.status != 'Cancelled',
+        )
+    if schema_editor.connection.vendor == 'postgresql':
+        # Check the new foreign keys now; pending deferred checks would block the ALTER TABLEs that follow
+        schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+def release_double_booked_seats(apps, schema_editor):
+    """Keep the earliest booking's claim on each double-booked seat and deactivate the rest"""
+    BookingSeat = apps.get_model('booking', 'BookingSeat')
+    clashes = list(
+        BookingSeat.objects.filter(is_active=True).order_by()
+        .values('route_bus_id', 'travel_date', 'seat_id').annotate(claims=models.Count('id'))
+        .filter(claims__gt=1)
+    )
+    released, released_booking_ids = 0, set()
+    for clash in clashes:
+        later_claims = list(
+            BookingSeat.objects.filter(
+                is_active=True, route_bus_id=clash['route_bus_id'],
+                travel_date=clash['travel_date'], seat_id=clash['seat_id'],
+            ).order_by('booking__created_at', 'id').values_list('id', 'booking_id')[1:]
+        )
+        BookingSeat.objects.filter(id__in=[claim_id for claim_id, _ in later_claims]).update(is_active=False)
+        released += len(later_claims)
+        released_booking_ids.update(booking_id for _, booking_id in later_claims)
+    if clashes:
+        print(
+            f'\n  Deactivated {released} later claims on {len(clashes)} double-booked seats; bookings to follow up: '
+            f'{", ".join(str(booking_id) for booking_id in sorted(released_booking_ids))}'
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0002_trip_inventory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tripinventory',
+            name='version',
+            field=models.PositiveIntegerField(default=0, help_text='Bumped on every write for compare-and-swap updates'),
+        ),
+        migrations.AddField(
+            model_name='bookingseat',
+            name='is_active',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='bookingseat',
+            name='route_bus',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='booking_seats', to='booking.routebus'),
+        ),
+        migrations.AddField(
+            model_name='bookingseat',
+            name='travel_date',
+            field=models.DateField(null=True),
+        ),
+        migrations.RunPython(copy_trip_to_booking_seats, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='bookingseat',
+            name='route_bus',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='booking_seats', to='booking.routebus'),
+        ),
+        migrations.AlterField(
+            model_name='bookingseat',
+            name='travel_date',
+            field=models.DateField(),
+        ),
+        migrations.RunPython(release_double_booked_seats, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='bookingseat',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_active', True)), fields=('route_bus', 'travel_date', 'seat'), name='unique_active_seat_per_trip'),
+        ),
+    ]
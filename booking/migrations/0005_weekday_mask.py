@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:36
+
+from django.db import migrations, models
+
+
+def fill_days_mask(apps, schema_editor):
+    RouteBus = apps.get_model('booking', 'RouteBus')
+    for route_bus in RouteBus.objects.only('available_days').iterator():
+        days = route_bus.available_days if isinstance(route_bus.available_days, list) else []
+        mask = 0
+        for day in days:
+            if isinstance(day, int) and 0 <= day <= 6:
+                mask |= 1 << day
+        RouteBus.objects.filter(id=route_bus.id).update(days_mask=mask)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0004_seat_holds'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='routebus',
+            name='days_mask',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, help_text='available_days as a bitmask (bit 0=Monday), kept in sync on save'),
+        ),
+        migrations.RunPython(fill_days_mask, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='routebus',
+            index=models.Index(fields=['route', 'days_mask'], name='routebus_route_days_idx'),
+        ),
+    ]
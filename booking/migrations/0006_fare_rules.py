@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:43
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0005_weekday_mask'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FareRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('kind', models.CharField(choices=[('occupancy', 'Occupancy (% of seats taken)'), ('weekday', 'Weekday (0=Monday, 6=Sunday)'), ('lead_time', 'Lead time (days before travel)')], max_length=20)),
+                ('bus_type', models.CharField(blank=True, choices=[('AC', 'AC'), ('Non-AC', 'Non-AC'), ('Sleeper', 'Sleeper'), ('Semi-sleeper', 'Semi-sleeper')], help_text='Leave empty to apply to every bus type', max_length=20)),
+                ('min_value', models.PositiveIntegerField(help_text='Lowest matching value, inclusive')),
+                ('max_value', models.PositiveIntegerField(help_text='Highest matching value, inclusive')),
+                ('multiplier', models.DecimalField(decimal_places=3, max_digits=6, validators=[django.core.validators.MinValueValidator(0)])),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('route', models.ForeignKey(blank=True, help_text='Leave empty to apply to every route', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='fare_rules', to='booking.route')),
+            ],
+            options={
+                'ordering': ['kind', 'min_value'],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:45
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_seat_count(apps, schema_editor):
+    Booking = apps.get_model('booking', 'Booking')
+    BookingSeat = apps.get_model('booking', 'BookingSeat')
+    seat_counts = (
+        BookingSeat.objects.filter(booking=OuterRef('pk'))
+        .order_by().values('booking').annotate(seats=Count('id')).values('seats')
+    )
+    Booking.objects.update(seat_count=Coalesce(Subquery(seat_counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0006_fare_rules'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='seat_count',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Number of seats, kept in step with booking_seats'),
+        ),
+        migrations.RunPython(fill_seat_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 05:13
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0009_booking_hot_path_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['travel_date', 'id'], name='booking_travel_date_idx'),
+        ),
+    ]
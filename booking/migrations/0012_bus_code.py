@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 05:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0011_booking_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bus',
+            name='code',
+            field=models.CharField(blank=True, help_text='Fleet number the schedule importer matches vehicles on', max_length=20, null=True, unique=True),
+        ),
+    ]
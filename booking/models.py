@@ -1,6 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator
+from django.utils import timezone
 import json
 
 
@@ -45,6 +46,10 @@ class Bus(models.Model):
     ]
 
     name = models.CharField(max_length=100)
+    code = models.CharField(
+        max_length=20, unique=True, null=True, blank=True,
+        help_text="Fleet number the schedule importer matches vehicles on"
+    )
     bus_type = models.CharField(max_length=20, choices=BUS_TYPE_CHOICES)
     total_seats = models.PositiveIntegerField()
     seat_layout = models.JSONField(default=dict, help_text="JSON format: {'rows': number, 'cols_per_side': [left, right]}")
@@ -64,6 +69,23 @@ class Bus(models.Model):
         return self.seat_layout or {'rows': 0, 'cols_per_side': [0, 0]}
 
 
+def days_to_mask(days):
+    """Pack a list of weekdays (0=Monday, 6=Sunday) into a bitmask"""
+    mask = 0
+    for day in days if isinstance(days, list) else []:
+        if isinstance(day, int) and 0 <= day <= 6:
+            mask |= 1 << day
+    return mask
+
+
+class RouteBusQuerySet(models.QuerySet):
+    def running_on(self, travel_date):
+        """Departures scheduled on the weekday of travel_date"""
+        bit = 1 << travel_date.weekday()
+        # An IN list over the masks containing the bit keeps the lookup indexable
+        return self.filter(days_mask__in=[mask for mask in range(1 << 7) if mask & bit])
+
+
 class RouteBus(models.Model):
     """Link buses to routes (many-to-many relationship)"""
     route = models.ForeignKey(Route, on_delete=models.CASCADE, related_name='route_buses')
@@ -74,16 +96,31 @@ class RouteBus(models.Model):
         default=list,
         help_text="List of days (0=Monday, 6=Sunday) when bus is available"
     )
+    days_mask = models.PositiveSmallIntegerField(
+        default=0, editable=False,
+        help_text="available_days as a bitmask (bit 0=Monday), kept in sync on save"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = RouteBusQuerySet.as_manager()
+
     class Meta:
         unique_together = ['route', 'bus', 'departure_time']
         ordering = ['route', 'departure_time']
+        indexes = [
+            models.Index(fields=['route', 'days_mask'], name='routebus_route_days_idx'),
+        ]
 
     def __str__(self):
         return f"{self.route} - {self.bus.name} ({self.departure_time})"
 
+    def save(self, *args, **kwargs):
+        self.days_mask = days_to_mask(self.available_days)
+        if kwargs.get('update_fields') is not None and 'available_days' in kwargs['update_fields']:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'days_mask'}
+        super().save(*args, **kwargs)
+
 
 class Seat(models.Model):
     """Individual seat information"""
@@ -93,6 +130,9 @@ class Seat(models.Model):
         ('Middle', 'Middle'),
     ]
 
+    # Bits reserved per row in trip inventory bitmaps (see TripInventory)
+    ROW_STRIDE = 32
+
     bus = models.ForeignKey(Bus, on_delete=models.CASCADE, related_name='seats')
     seat_number = models.CharField(max_length=10)
     row = models.PositiveIntegerField()
@@ -107,6 +147,11 @@ class Seat(models.Model):
     def __str__(self):
         return f"{self.bus.name} - Seat {self.seat_number}"
 
+    @property
+    def position(self):
+        """Index of this seat in a trip inventory bitmap"""
+        return (self.row - 1) * self.ROW_STRIDE + (self.column - 1)
+
 
 class Booking(models.Model):
     """Store booking information"""
@@ -114,19 +159,39 @@ class Booking(models.Model):
         ('Pending', 'Pending'),
         ('Confirmed', 'Confirmed'),
         ('Cancelled', 'Cancelled'),
+        ('Expired', 'Expired'),
     ]
 
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='bookings')
-    route_bus = models.ForeignKey(RouteBus, on_delete=models.CASCADE, related_name='bookings')
+    # The composite indexes in Meta lead with user and route_bus, so plain foreign key indexes would be dead weight
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='bookings', db_index=False)
+    route_bus = models.ForeignKey(RouteBus, on_delete=models.CASCADE, related_name='bookings', db_index=False)
     booking_date = models.DateField()
     travel_date = models.DateField()
     total_price = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)])
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='Pending')
+    hold_expires_at = models.DateTimeField(null=True, blank=True, help_text="When a pending seat hold lapses")
+    seat_count = models.PositiveSmallIntegerField(default=0, help_text="Number of seats, kept in step with booking_seats")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Serves the dashboard's newest-first keyset pagination per user
+            models.Index(fields=['user', '-created_at', '-id'], name='booking_user_created_idx'),
+            # Bookings on one trip by status: active bookings, and a user's holds being replaced
+            models.Index(fields=['route_bus', 'travel_date', 'status'], name='booking_trip_status_idx'),
+            # Travel date order and ranges: the admin list and date hierarchy, and the trip report
+            models.Index(fields=['travel_date', 'id'], name='booking_travel_date_idx'),
+            # Only pending holds can lapse, so the sweeper reads a small partial index
+            # (skipped on backends without partial indexes)
+            models.Index(
+                fields=['hold_expires_at'], condition=models.Q(status='Pending'), name='booking_pending_expiry_idx',
+            ),
+        ]
+
+    # Live bookings can still be changed; see ArchivedBooking
+    is_archived = False
 
     def __str__(self):
         return f"Booking #{self.id} - {self.user.username} - {self.route_bus}"
@@ -141,11 +206,177 @@ class BookingSeat(models.Model):
     booking = models.ForeignKey(Booking, on_delete=models.CASCADE, related_name='booking_seats')
     seat = models.ForeignKey(Seat, on_delete=models.CASCADE, related_name='bookings')
     price = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)])
+    # Copied from the booking so the database can enforce one active claim per seat per trip
+    route_bus = models.ForeignKey(RouteBus, on_delete=models.CASCADE, related_name='booking_seats')
+    travel_date = models.DateField()
+    is_active = models.BooleanField(default=True)
 
     class Meta:
         unique_together = ['booking', 'seat']
         ordering = ['booking', 'seat']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['route_bus', 'travel_date', 'seat'],
+                condition=models.Q(is_active=True),
+                name='unique_active_seat_per_trip',
+            ),
+        ]
 
     def __str__(self):
         return f"{self.booking} - {self.seat}"
 
+    def save(self, *args, **kwargs):
+        if self.route_bus_id is None:
+            self.route_bus_id = self.booking.route_bus_id
+        if self.travel_date is None:
+            self.travel_date = self.booking.travel_date
+        super().save(*args, **kwargs)
+
+
+class TripInventory(models.Model):
+    """Materialized seat availability for one bus departure on one travel date"""
+    route_bus = models.ForeignKey(RouteBus, on_delete=models.CASCADE, related_name='inventories')
+    travel_date = models.DateField()
+    booked_seats = models.BinaryField(default=bytes, help_text="Bitmap of booked seats indexed by Seat.position")
+    booked_count = models.PositiveIntegerField(default=0)
+    version = models.PositiveIntegerField(default=0, help_text="Bumped on every write for compare-and-swap updates")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['route_bus', 'travel_date']
+        ordering = ['route_bus', 'travel_date']
+        verbose_name_plural = 'trip inventories'
+
+    def __str__(self):
+        return f"{self.route_bus} on {self.travel_date}"
+
+    def is_booked(self, position):
+        """Return True if the seat at the given position is taken"""
+        byte_index, bit = divmod(position, 8)
+        bitmap = self.booked_seats
+        return byte_index < len(bitmap) and bool(bitmap[byte_index] & (1 << bit))
+
+    def booked_positions(self):
+        """Return the positions of every booked seat"""
+        return [position for position in range(len(self.booked_seats) * 8) if self.is_booked(position)]
+
+    def mark_booked(self, positions):
+        """Set the bits for the given seat positions"""
+        bitmap = bytearray(self.booked_seats)
+        for position in positions:
+            byte_index, bit = divmod(position, 8)
+            if byte_index >= len(bitmap):
+                bitmap.extend(bytes(byte_index + 1 - len(bitmap)))
+            if not bitmap[byte_index] & (1 << bit):
+                bitmap[byte_index] |= 1 << bit
+                self.booked_count += 1
+        self.booked_seats = bytes(bitmap)
+
+    def release(self, positions):
+        """Clear the bits for the given seat positions"""
+        bitmap = bytearray(self.booked_seats)
+        for position in positions:
+            byte_index, bit = divmod(position, 8)
+            if byte_index < len(bitmap) and bitmap[byte_index] & (1 << bit):
+                bitmap[byte_index] &= ~(1 << bit) & 0xFF
+                self.booked_count -= 1
+        self.booked_seats = bytes(bitmap.rstrip(b'\x00'))
+
+    def save_if_unchanged(self):
+        """Write the bitmap only if nobody else has since it was read (compare-and-swap)"""
+        updated = TripInventory.objects.filter(pk=self.pk, version=self.version).update(
+            booked_seats=self.booked_seats,
+            booked_count=self.booked_count,
+            version=models.F('version') + 1,
+            updated_at=timezone.now(),
+        )
+        if updated:
+            self.version += 1
+        return bool(updated)
+
+
+class FareRule(models.Model):
+    """Multiply fares when a trip falls inside a range of occupancy, weekday or lead time"""
+    KIND_CHOICES = [
+        ('occupancy', 'Occupancy (% of seats taken)'),
+        ('weekday', 'Weekday (0=Monday, 6=Sunday)'),
+        ('lead_time', 'Lead time (days before travel)'),
+    ]
+
+    name = models.CharField(max_length=100)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    route = models.ForeignKey(
+        Route, on_delete=models.CASCADE, null=True, blank=True, related_name='fare_rules',
+        help_text="Leave empty to apply to every route",
+    )
+    bus_type = models.CharField(
+        max_length=20, choices=Bus.BUS_TYPE_CHOICES, blank=True,
+        help_text="Leave empty to apply to every bus type",
+    )
+    min_value = models.PositiveIntegerField(help_text="Lowest matching value, inclusive")
+    max_value = models.PositiveIntegerField(help_text="Highest matching value, inclusive")
+    multiplier = models.DecimalField(max_digits=6, decimal_places=3, validators=[MinValueValidator(0)])
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['kind', 'min_value']
+
+    def __str__(self):
+        return f"{self.name} ({self.get_kind_display()} {self.min_value}-{self.max_value}: ×{self.multiplier})"
+
+
+class ArchivedBooking(models.Model):
+    """A booking whose trip is over, moved out of the live tables by booking.archive
+
+    Keeps the live booking's id and fields, so it reads like a Booking
+    wherever past trips are shown.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    # archived_user_created_idx leads with user, so a plain foreign key index would be dead weight
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_bookings', db_index=False)
+    route_bus = models.ForeignKey(RouteBus, on_delete=models.CASCADE, related_name='archived_bookings')
+    booking_date = models.DateField()
+    travel_date = models.DateField()
+    total_price = models.DecimalField(max_digits=10, decimal_places=2)
+    status = models.CharField(max_length=20, choices=Booking.STATUS_CHOICES)
+    hold_expires_at = models.DateTimeField(null=True, blank=True)
+    seat_count = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    is_archived = True
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # The dashboard's keyset pagination, as on Booking
+            models.Index(fields=['user', '-created_at', '-id'], name='archived_user_created_idx'),
+            # Travel date order and ranges, as on Booking
+            models.Index(fields=['travel_date', 'id'], name='archived_travel_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"Booking #{self.id} - {self.user.username} - {self.route_bus} (archived)"
+
+    def get_seats(self):
+        return self.booking_seats.all()
+
+
+class ArchivedBookingSeat(models.Model):
+    """A seat of an archived booking"""
+    id = models.BigIntegerField(primary_key=True)
+    booking = models.ForeignKey(ArchivedBooking, on_delete=models.CASCADE, related_name='booking_seats')
+    seat = models.ForeignKey(Seat, on_delete=models.CASCADE, related_name='archived_bookings')
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    route_bus = models.ForeignKey(RouteBus, on_delete=models.CASCADE, related_name='archived_booking_seats')
+    travel_date = models.DateField()
+    is_active = models.BooleanField(default=True)
+
+    class Meta:
+        ordering = ['booking', 'seat']
+
+    def __str__(self):
+        return f"{self.booking} - {self.seat}"
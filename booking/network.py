@@ -0,0 +1,290 @@
+"""
+Bulk import of stops, routes, vehicles and timetables from CSV feeds.
+
+A feed directory holds up to four GTFS-style files with a header row:
+
+    stops.csv       code, name
+    routes.csv      origin, destination, distance, base_price
+    vehicles.csv    code, name, bus_type, rows, left, right
+    timetables.csv  origin, destination, bus, departure_time, arrival_time,
+                    monday, tuesday, wednesday, thursday, friday, saturday, sunday
+
+Routes and timetables refer to stops and vehicles by code, and the weekday
+columns are 1 when the departure runs that day. Files are streamed in that
+order. Foreign keys are resolved through maps loaded once per file, rows
+that already match the database are skipped, and the rest are upserted in
+batches with bulk_create(update_conflicts=True), one transaction per batch.
+Importing the same feed twice writes nothing the second time.
+"""
+import csv
+import os
+import time
+from collections import Counter, namedtuple
+from datetime import time as clock_time
+from decimal import Decimal
+from functools import partial
+
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .fleet import sync_bus_seats
+from .models import Bus, Location, Route, RouteBus, days_to_mask
+from .planner import invalidate_journey_index
+from .refcache import bump_generation
+from .search import invalidate_location_index
+
+FEED_FILES = ['stops.csv', 'routes.csv', 'vehicles.csv', 'timetables.csv']
+
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+FeedResult = namedtuple(
+    'FeedResult', ['feed', 'rows', 'created', 'updated', 'unchanged', 'retired', 'seats', 'errors', 'elapsed'],
+)
+
+
+class FeedError(ValueError):
+    """A feed row that can't be imported"""
+
+
+def read_feed(path):
+    """Yield (line number, row) for each record of a CSV file, with surrounding spaces stripped"""
+    with open(path, newline='', encoding='utf-8-sig') as stream:
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, {key.strip(): (value or '').strip() for key, value in row.items() if key}
+
+
+def _amount(value):
+    amount = Decimal(value)
+    if not amount.is_finite() or amount < 0:
+        raise ValueError(value)
+    return amount
+
+
+def _count(value):
+    count = int(value)
+    if count < 0:
+        raise ValueError(value)
+    return count
+
+
+def _flag(value):
+    if value not in ('0', '1'):
+        raise ValueError(value)
+    return value == '1'
+
+
+def _field(row, name, parse=str):
+    value = row.get(name, '')
+    if not value:
+        raise FeedError(f'{name} is missing')
+    try:
+        return parse(value)
+    except (ValueError, ArithmeticError):
+        raise FeedError(f'{name} {value!r} is not valid') from None
+
+
+def upsert_feed(path, model, build, existing, unique_fields, update_fields, batch_size=2000):
+    """Stream a feed into model, writing only the rows that are new or changed
+
+    build(row) returns (key, values, instance) or raises FeedError, and
+    existing maps every key already in the database to its values. Returns
+    the counts, the row errors, and each key the feed listed mapped to
+    whether it was written.
+    """
+    feed = os.path.basename(path)
+    counts = Counter()
+    errors, seen, batch = [], {}, []
+
+    def flush():
+        with transaction.atomic():
+            model.objects.bulk_create(
+                batch, update_conflicts=True, unique_fields=unique_fields, update_fields=update_fields,
+            )
+        batch.clear()
+
+    for line, row in read_feed(path):
+        counts['rows'] += 1
+        try:
+            key, values, instance = build(row)
+            if key in seen:
+                raise FeedError('repeats an earlier row')
+        except FeedError as error:
+            errors.append(f'{feed} line {line}: {error}')
+            continue
+        seen[key] = key not in existing or existing[key] != values
+        if key not in existing:
+            counts['created'] += 1
+        elif seen[key]:
+            counts['updated'] += 1
+        else:
+            counts['unchanged'] += 1
+            continue
+        batch.append(instance)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return counts, errors, seen
+
+
+def _result(path, counts, errors, started, retired=0, seats=0):
+    return FeedResult(
+        os.path.basename(path), counts['rows'], counts['created'], counts['updated'], counts['unchanged'],
+        retired, seats, errors, time.perf_counter() - started,
+    )
+
+
+def import_stops(path, batch_size=2000):
+    """Upsert locations by code"""
+    started = time.perf_counter()
+    existing = {code: (name,) for code, name in Location.objects.values_list('code', 'name')}
+
+    def build(row):
+        code, name = _field(row, 'code'), _field(row, 'name')
+        return code, (name,), Location(code=code, name=name)
+
+    counts, errors, _ = upsert_feed(path, Location, build, existing, ['code'], ['name', 'updated_at'], batch_size)
+    return _result(path, counts, errors, started)
+
+
+def import_routes(path, batch_size=2000):
+    """Upsert routes by origin and destination"""
+    started = time.perf_counter()
+    location_ids = dict(Location.objects.values_list('code', 'id'))
+    existing = {
+        (origin_id, destination_id): (distance, base_price)
+        for origin_id, destination_id, distance, base_price
+        in Route.objects.values_list('origin_id', 'destination_id', 'distance', 'base_price')
+    }
+
+    def build(row):
+        origin, destination = _field(row, 'origin'), _field(row, 'destination')
+        if origin not in location_ids:
+            raise FeedError(f'no stop {origin}')
+        if destination not in location_ids:
+            raise FeedError(f'no stop {destination}')
+        key = (location_ids[origin], location_ids[destination])
+        values = (_field(row, 'distance', _amount), _field(row, 'base_price', _amount))
+        return key, values, Route(origin_id=key[0], destination_id=key[1], distance=values[0], base_price=values[1])
+
+    counts, errors, _ = upsert_feed(
+        path, Route, build, existing, ['origin', 'destination'], ['distance', 'base_price', 'updated_at'], batch_size,
+    )
+    return _result(path, counts, errors, started)
+
+
+def import_vehicles(path, batch_size=2000):
+    """Upsert buses by code, then bring the seats of every listed bus in line with its layout"""
+    started = time.perf_counter()
+    existing = {
+        code: (name, bus_type, total_seats, seat_layout)
+        for code, name, bus_type, total_seats, seat_layout
+        in Bus.objects.exclude(code=None).values_list('code', 'name', 'bus_type', 'total_seats', 'seat_layout')
+    }
+    bus_types = {choice for choice, _ in Bus.BUS_TYPE_CHOICES}
+
+    def build(row):
+        code, name, bus_type = _field(row, 'code'), _field(row, 'name'), _field(row, 'bus_type')
+        if bus_type not in bus_types:
+            raise FeedError(f'bus_type {bus_type!r} is not one of {", ".join(sorted(bus_types))}')
+        rows, left, right = (_field(row, name, _count) for name in ('rows', 'left', 'right'))
+        # Seat numbers are lettered by column
+        if not rows or not 0 < left + right <= 26:
+            raise FeedError('seat layout needs at least one row and between 1 and 26 seats across')
+        layout = {'rows': rows, 'cols_per_side': [left, right]}
+        values = (name, bus_type, rows * (left + right), layout)
+        return code, values, Bus(
+            code=code, name=name, bus_type=bus_type, total_seats=values[2], seat_layout=layout,
+        )
+
+    counts, errors, seen = upsert_feed(
+        path, Bus, build, existing, ['code'],
+        ['name', 'bus_type', 'total_seats', 'seat_layout', 'updated_at'], batch_size,
+    )
+    # Unchanged buses are synced too when their active seats don't add up, so a failed earlier run is caught up
+    seat_counts = Bus.objects.exclude(code=None).annotate(
+        active_seats=Count('seats', filter=Q(seats__is_active=True)),
+    ).values_list('code', 'total_seats', 'active_seats')
+    codes = sorted(
+        code for code, total_seats, active_seats in seat_counts
+        if code in seen and (seen[code] or total_seats != active_seats)
+    )
+    seats = 0
+    for start in range(0, len(codes), 100):
+        buses = Bus.objects.filter(code__in=codes[start:start + 100])
+        seats += sum(result.created for result in sync_bus_seats(buses))
+    return _result(path, counts, errors, started, seats=seats)
+
+
+def import_timetables(path, batch_size=2000, retire_missing=False):
+    """Upsert departures by route, bus and departure time
+
+    With retire_missing, departures the feed no longer lists stop running
+    on any day. They are kept rather than deleted so their bookings survive.
+    Nothing is retired when any row fails, since a bad row may be a
+    departure the feed still means to run.
+    """
+    started = time.perf_counter()
+    route_ids = {
+        (origin, destination): route_id
+        for origin, destination, route_id
+        in Route.objects.values_list('origin__code', 'destination__code', 'id')
+    }
+    bus_ids = dict(Bus.objects.exclude(code=None).values_list('code', 'id'))
+    existing, existing_ids = {}, {}
+    departures = RouteBus.objects.values_list(
+        'id', 'route_id', 'bus_id', 'departure_time', 'arrival_time', 'available_days',
+    ).order_by()
+    for departure_id, route_id, bus_id, departure_time, arrival_time, available_days in departures.iterator():
+        key = (route_id, bus_id, departure_time)
+        existing[key] = (arrival_time, available_days)
+        existing_ids[key] = departure_id
+
+    def build(row):
+        origin, destination, bus = _field(row, 'origin'), _field(row, 'destination'), _field(row, 'bus')
+        if (origin, destination) not in route_ids:
+            raise FeedError(f'no route from {origin} to {destination}')
+        if bus not in bus_ids:
+            raise FeedError(f'no vehicle {bus}')
+        departure_time = _field(row, 'departure_time', clock_time.fromisoformat)
+        arrival_time = _field(row, 'arrival_time', clock_time.fromisoformat)
+        available_days = [day for day, name in enumerate(WEEKDAYS) if _field(row, name, _flag)]
+        key = (route_ids[origin, destination], bus_ids[bus], departure_time)
+        # bulk_create skips RouteBus.save(), which keeps days_mask in step
+        return key, (arrival_time, available_days), RouteBus(
+            route_id=key[0], bus_id=key[1], departure_time=departure_time, arrival_time=arrival_time,
+            available_days=available_days, days_mask=days_to_mask(available_days),
+        )
+
+    counts, errors, seen = upsert_feed(
+        path, RouteBus, build, existing, ['route', 'bus', 'departure_time'],
+        ['arrival_time', 'available_days', 'days_mask', 'updated_at'], batch_size,
+    )
+    retired = 0
+    if retire_missing and not errors:
+        missing = [existing_ids[key] for key, (_, days) in existing.items() if days and key not in seen]
+        for start in range(0, len(missing), batch_size):
+            retired += RouteBus.objects.filter(id__in=missing[start:start + batch_size]).update(
+                available_days=[], days_mask=0, updated_at=timezone.now(),
+            )
+    return _result(path, counts, errors, started, retired=retired)
+
+
+def import_network(directory, batch_size=2000, retire_missing=False):
+    """Import whichever feed files are in a directory; return a FeedResult for each one"""
+    paths = {name: os.path.join(directory, name) for name in FEED_FILES}
+    importers = {
+        'stops.csv': import_stops,
+        'routes.csv': import_routes,
+        'vehicles.csv': import_vehicles,
+        'timetables.csv': partial(import_timetables, retire_missing=retire_missing),
+    }
+    results = [importers[name](path, batch_size) for name, path in paths.items() if os.path.exists(path)]
+    # Bulk writes skip model signals, so drop the cached network here
+    if any(result.created or result.updated or result.retired for result in results):
+        invalidate_location_index()
+        invalidate_journey_index()
+        bump_generation()
+    return results
@@ -0,0 +1,98 @@
+import base64
+import json
+from collections import namedtuple
+from datetime import datetime
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+CursorPage = namedtuple('CursorPage', ['items', 'next_cursor'])
+
+
+def encode_cursor(created_at, pk):
+    """Opaque cursor pointing just past a row in (-created_at, -id) order"""
+    raw = f'{created_at.isoformat()}|{pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (created_at, pk) from a cursor, or None if it is missing or malformed"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, pk = raw.split('|')
+        return datetime.fromisoformat(created_at), int(pk)
+    except ValueError:
+        return None
+
+
+def paginate_by_cursor(queryset, cursor, page_size):
+    """Return one page of newest-first rows after cursor, using a keyset instead of OFFSET
+
+    Each page is a range scan that starts where the last one ended, so it
+    costs the same however far back the reader has paged.
+    """
+    return paginate_merged_by_cursor([queryset], cursor, page_size)
+
+
+def paginate_merged_by_cursor(querysets, cursor, page_size):
+    """paginate_by_cursor over several tables at once, such as live and archived bookings
+
+    Each queryset gives its own next page+1 rows after the cursor and they
+    are merged newest first, so a page costs one range scan per table. Rows
+    must not share an id across the querysets.
+    """
+    position = decode_cursor(cursor)
+    items = []
+    for queryset in querysets:
+        queryset = queryset.order_by('-created_at', '-id')
+        if position:
+            created_at, pk = position
+            queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+        # One extra row tells whether another page follows without a COUNT
+        items.extend(queryset[:page_size + 1])
+    items.sort(key=lambda item: (item.created_at, item.id), reverse=True)
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        next_cursor = encode_cursor(items[-1].created_at, items[-1].id)
+    return CursorPage(items, next_cursor)
+
+
+def estimated_row_count(queryset):
+    """The query planner's estimate of how many rows a queryset returns, or 0 where there is none"""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return 0
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountPaginator(Paginator):
+    """Admin paginator that never counts more than exact_count_limit rows
+
+    Up to the limit the count is exact, taken over a LIMITed subquery so the
+    database stops reading once it is reached. Past it, PostgreSQL's planner
+    estimate stands in for COUNT(*); other backends report the limit, so the
+    page links end there and narrower filters reach older rows.
+    """
+
+    exact_count_limit = 10000
+    is_estimated = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list.order_by()
+        counted = queryset[:self.exact_count_limit + 1].count()
+        if counted <= self.exact_count_limit:
+            return counted
+        self.is_estimated = True
+        return max(estimated_row_count(queryset), self.exact_count_limit)
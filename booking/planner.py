@@ -0,0 +1,180 @@
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from .models import RouteBus
+
+MINUTES_PER_DAY = 24 * 60
+
+# Seconds before an index is rebuilt even without a schedule change signal,
+# so processes that missed the signal catch up
+INDEX_MAX_AGE = 300
+
+# One weekly departure: times are minutes after midnight, arrival may pass midnight
+Schedule = namedtuple('Schedule', [
+    'route_bus_id', 'origin_id', 'destination_id', 'departure', 'arrival', 'days_mask', 'price',
+])
+
+Leg = namedtuple('Leg', ['route_bus_id', 'origin_id', 'destination_id', 'departure', 'arrival', 'price'])
+
+
+class Itinerary:
+    """A journey of one or more legs with transfers in between"""
+
+    def __init__(self, legs):
+        self.legs = legs
+        self.departure = legs[0].departure
+        self.arrival = legs[-1].arrival
+        self.price = sum(leg.price for leg in legs)
+
+    @property
+    def transfers(self):
+        return len(self.legs) - 1
+
+    @property
+    def duration(self):
+        return self.arrival - self.departure
+
+
+class JourneyIndex:
+    """Connection-scan index over every departure in the network
+
+    Connections are kept per weekday, sorted by departure and already joined
+    with the following day, so a query for a date scans one flat list and can
+    find itineraries that run overnight.
+    """
+
+    def __init__(self, schedules):
+        stops = set()
+        by_weekday = [[] for _ in range(7)]
+        for schedule in schedules:
+            stops.update((schedule.origin_id, schedule.destination_id))
+            arrival = schedule.arrival
+            if arrival <= schedule.departure:
+                arrival += MINUTES_PER_DAY
+            for weekday in range(7):
+                if schedule.days_mask & (1 << weekday):
+                    by_weekday[weekday].append((
+                        schedule.departure, arrival, schedule.origin_id, schedule.destination_id,
+                        schedule.route_bus_id, schedule.price,
+                    ))
+        for connections in by_weekday:
+            connections.sort()
+
+        self.stop_ids = stops
+        # Day d followed by day d+1 shifted by a day; departures stay sorted
+        self.connections = []
+        self.departures = []
+        for weekday in range(7):
+            next_day = [
+                (dep + MINUTES_PER_DAY, arr + MINUTES_PER_DAY, *rest)
+                for dep, arr, *rest in by_weekday[(weekday + 1) % 7]
+            ]
+            connections = by_weekday[weekday] + next_day
+            self.connections.append(connections)
+            self.departures.append([connection[0] for connection in connections])
+
+    @classmethod
+    def from_database(cls, price_for):
+        route_buses = RouteBus.objects.select_related('route', 'bus').order_by()
+        return cls(
+            Schedule(
+                route_bus.id,
+                route_bus.route.origin_id,
+                route_bus.route.destination_id,
+                route_bus.departure_time.hour * 60 + route_bus.departure_time.minute,
+                route_bus.arrival_time.hour * 60 + route_bus.arrival_time.minute,
+                route_bus.days_mask,
+                price_for(route_bus.route, route_bus.bus),
+            )
+            for route_bus in route_buses
+        )
+
+    def plan(self, travel_date, origin_id, destination_id, earliest_departure=0,
+             transfer_minutes=30, sort='arrival', limit=5):
+        """Return up to limit itineraries leaving origin on travel_date
+
+        A single profile scan runs backwards over the connections, recording
+        for every stop the earliest arrival at the destination reachable from
+        each departure. Every departure from the origin then yields its best
+        itinerary, so results cover the whole day rather than one journey.
+        """
+        if origin_id == destination_id or origin_id not in self.stop_ids:
+            return []
+        weekday = travel_date.weekday()
+        connections = self.connections[weekday]
+        first = bisect_left(self.departures[weekday], earliest_departure)
+
+        # stop -> (negated departures, entries); entries are (arrival, connection index,
+        # next entry) appended with falling departures and strictly falling arrivals
+        profiles = {}
+        seeds = []
+        for index in range(len(connections) - 1, first - 1, -1):
+            dep, arr, from_id, to_id = connections[index][:4]
+            if to_id == destination_id:
+                entry = (arr, index, None)
+            else:
+                onward = profiles.get(to_id)
+                if onward is None:
+                    continue
+                # Latest-added entry still catchable after the transfer arrives earliest
+                position = bisect_right(onward[0], -(arr + transfer_minutes)) - 1
+                if position < 0:
+                    continue
+                entry = (onward[1][position][0], index, onward[1][position])
+            if from_id == origin_id:
+                if dep < MINUTES_PER_DAY:
+                    seeds.append(entry)
+                continue
+            profile = profiles.get(from_id)
+            if profile is None:
+                profiles[from_id] = ([-dep], [entry])
+            elif entry[0] < profile[1][-1][0]:
+                if profile[0][-1] == -dep:
+                    profile[1][-1] = entry
+                else:
+                    profile[0].append(-dep)
+                    profile[1].append(entry)
+
+        itineraries = []
+        for entry in seeds:
+            legs = []
+            while entry is not None:
+                dep, arr, from_id, to_id, route_bus_id, price = connections[entry[1]]
+                legs.append(Leg(route_bus_id, from_id, to_id, dep, arr, price))
+                entry = entry[2]
+            itineraries.append(Itinerary(legs))
+
+        if sort == 'price':
+            itineraries.sort(key=lambda it: (it.price, it.arrival))
+        else:
+            itineraries.sort(key=lambda it: (it.arrival, it.price))
+        return itineraries[:limit]
+
+
+def minutes_to_datetime(travel_date, minutes):
+    """Turn minutes after midnight of travel_date into a datetime"""
+    return datetime.combine(travel_date, datetime.min.time()) + timedelta(minutes=minutes)
+
+
+_index = None
+_index_built_at = 0.0
+_index_lock = threading.Lock()
+
+
+def get_journey_index(price_for):
+    """Return the process-wide journey index, rebuilding it when schedules changed"""
+    global _index, _index_built_at
+    with _index_lock:
+        if _index is None or time.monotonic() - _index_built_at > INDEX_MAX_AGE:
+            _index = JourneyIndex.from_database(price_for)
+            _index_built_at = time.monotonic()
+        return _index
+
+
+def invalidate_journey_index():
+    global _index
+    with _index_lock:
+        _index = None
@@ -0,0 +1,134 @@
+import threading
+import time
+from collections import defaultdict
+from datetime import date
+from decimal import ROUND_HALF_UP, Decimal
+
+from .models import FareRule
+
+# Seconds before the engine is recompiled even without a fare rule change signal
+ENGINE_MAX_AGE = 300
+
+BUS_TYPE_MULTIPLIERS = {
+    'Non-AC': Decimal('1.0'),
+    'AC': Decimal('1.3'),
+    'Semi-sleeper': Decimal('1.5'),
+    'Sleeper': Decimal('1.8'),
+}
+
+ONE = Decimal('1')
+CENT = Decimal('0.01')
+
+
+def base_fare(route, bus):
+    """Price of a seat from the route base price and bus type alone"""
+    return route.base_price * BUS_TYPE_MULTIPLIERS.get(bus.bus_type, ONE)
+
+
+def occupancy_percent(booked_count, total_seats):
+    if not total_seats:
+        return 0
+    return min(booked_count * 100 // total_seats, 100)
+
+
+class CompiledRules:
+    """Fare rules that apply to one route and bus type, ready to evaluate"""
+
+    def __init__(self, rules):
+        self.date_rules = [
+            (rule.kind, rule.min_value, rule.max_value, rule.multiplier)
+            for rule in rules if rule.kind != 'occupancy'
+        ]
+        # Occupancy is a whole percentage, so every outcome fits in a lookup table
+        self.occupancy_factors = [ONE] * 101
+        for rule in rules:
+            if rule.kind == 'occupancy':
+                for percent in range(rule.min_value, min(rule.max_value, 100) + 1):
+                    self.occupancy_factors[percent] *= rule.multiplier
+
+    def date_factor(self, travel_date, today):
+        factor = ONE
+        weekday = travel_date.weekday()
+        lead_days = max((travel_date - today).days, 0)
+        for kind, low, high, multiplier in self.date_rules:
+            value = weekday if kind == 'weekday' else lead_days
+            if low <= value <= high:
+                factor *= multiplier
+        return factor
+
+
+class PricingEngine:
+    """Fare rules grouped by route and bus type, compiled on first use"""
+
+    def __init__(self, rules):
+        self.rules = defaultdict(list)
+        for rule in rules:
+            self.rules[rule.route_id, rule.bus_type].append(rule)
+        self._compiled = {}
+
+    @classmethod
+    def from_database(cls):
+        return cls(FareRule.objects.filter(is_active=True).order_by('id'))
+
+    def compiled(self, route_id, bus_type):
+        """Return the rules for a route and bus type, including the catch-all ones"""
+        key = (route_id, bus_type)
+        compiled = self._compiled.get(key)
+        if compiled is None:
+            compiled = CompiledRules(
+                self.rules[None, ''] + self.rules[None, bus_type]
+                + self.rules[route_id, ''] + self.rules[route_id, bus_type]
+            )
+            self._compiled[key] = compiled
+        return compiled
+
+    def quote_many(self, route_buses, travel_date=None, booked_counts=None, today=None):
+        """Price one seat on each departure in a single pass; return {route_bus_id: price}
+
+        Departures sharing a route and bus type share their base fare and date
+        factor, so only the occupancy lookup is done per departure. Without a
+        travel date only the base fare applies.
+        """
+        booked_counts = booked_counts or {}
+        today = today or date.today()
+        groups = {}
+        prices = {}
+        for route_bus in route_buses:
+            route, bus = route_bus.route, route_bus.bus
+            key = (route.id, bus.bus_type)
+            group = groups.get(key)
+            if group is None:
+                compiled = self.compiled(*key)
+                factor = compiled.date_factor(travel_date, today) if travel_date else ONE
+                group = groups[key] = (base_fare(route, bus) * factor, compiled.occupancy_factors)
+            fare, occupancy_factors = group
+            if travel_date:
+                percent = occupancy_percent(booked_counts.get(route_bus.id, 0), bus.total_seats)
+                fare *= occupancy_factors[percent]
+            prices[route_bus.id] = fare.quantize(CENT, rounding=ROUND_HALF_UP)
+        return prices
+
+    def quote(self, route_bus, travel_date=None, booked_count=0, today=None):
+        """Price one seat on a departure"""
+        return self.quote_many([route_bus], travel_date, {route_bus.id: booked_count}, today)[route_bus.id]
+
+
+_engine = None
+_engine_built_at = 0.0
+_engine_lock = threading.Lock()
+
+
+def get_pricing_engine():
+    """Return the process-wide pricing engine, recompiling it when fare rules changed"""
+    global _engine, _engine_built_at
+    with _engine_lock:
+        if _engine is None or time.monotonic() - _engine_built_at > ENGINE_MAX_AGE:
+            _engine = PricingEngine.from_database()
+            _engine_built_at = time.monotonic()
+        return _engine
+
+
+def invalidate_pricing_engine():
+    global _engine
+    with _engine_lock:
+        _engine = None
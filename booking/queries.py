@@ -0,0 +1,59 @@
+from .inventory import booked_seat_counts, get_trip_inventory
+from .pricing import get_pricing_engine
+from .refcache import get_route_departures, get_routes
+from .search import get_location_index
+from .seatmap import get_seat_map
+
+
+def search_routes(search_query='', origin_id='', destination_id=''):
+    """Routes matching a location search and optional origin and destination ids
+
+    Filters the cached route list in memory, so a search costs no queries
+    once the reference cache is warm.
+    """
+    routes = get_routes()
+    if search_query:
+        # Resolve matching locations in memory, then keep routes touching them
+        location_ids = get_location_index().matching_ids(search_query)
+        routes = [route for route in routes if route.origin_id in location_ids or route.destination_id in location_ids]
+    if origin_id:
+        routes = [route for route in routes if str(route.origin_id) == str(origin_id)]
+    if destination_id:
+        routes = [route for route in routes if str(route.destination_id) == str(destination_id)]
+    return routes
+
+
+def list_trips(route, travel_date=None):
+    """Departures on a route with their fare and, given a date, seats left
+
+    Without a date every departure is listed at its base fare.
+    """
+    # Given a date, only buses running on that day of week
+    route_buses = get_route_departures(route.id, travel_date)
+
+    # Seats taken on the travel date, for every listed bus at once
+    booked_counts = {}
+    if travel_date:
+        booked_counts = booked_seat_counts([route_bus.id for route_bus in route_buses], travel_date)
+
+    # Price every listed bus in one pass
+    prices = get_pricing_engine().quote_many(route_buses, travel_date, booked_counts)
+    trips = []
+    for route_bus in route_buses:
+        seats_left = None
+        if travel_date:
+            seats_left = max(route_bus.bus.total_seats - booked_counts[route_bus.id], 0)
+        trips.append({
+            'route_bus': route_bus,
+            'price': prices[route_bus.id],
+            'seats_left': seats_left,
+        })
+    return trips
+
+
+def trip_seat_map(route_bus, travel_date):
+    """Return (seat_map, inventory, price_per_seat) for one trip"""
+    seat_map = get_seat_map(route_bus.bus)
+    inventory = get_trip_inventory(route_bus, travel_date)
+    price_per_seat = get_pricing_engine().quote(route_bus, travel_date, inventory.booked_count)
+    return seat_map, inventory, price_per_seat
@@ -0,0 +1,46 @@
+from collections import namedtuple
+from datetime import date
+from decimal import Decimal
+
+from django.conf import settings
+from django.core import signing
+
+QUOTE_SALT = 'booking.quote'
+
+# What the user was shown at checkout, carried to confirmation in a signed token
+FareQuote = namedtuple('FareQuote', [
+    'booking_id', 'user_id', 'route_bus_id', 'travel_date', 'seat_ids', 'price_per_seat', 'total_price',
+])
+
+
+class InvalidQuote(Exception):
+    """Raised when a quote token is tampered with, expired or issued to someone else"""
+
+
+def issue_quote(hold, seats, price_per_seat):
+    """Sign a quote for a seat hold; the token lives as long as the hold"""
+    return signing.dumps({
+        'b': hold.id,
+        'u': hold.user_id,
+        'r': hold.route_bus_id,
+        'd': hold.travel_date.isoformat(),
+        's': sorted(seat.id for seat in seats),
+        'p': str(price_per_seat),
+        't': str(hold.total_price),
+    }, salt=QUOTE_SALT, compress=True)
+
+
+def read_quote(token, user):
+    """Return the FareQuote in a token issued to user"""
+    try:
+        data = signing.loads(token, salt=QUOTE_SALT, max_age=settings.SEAT_HOLD_MINUTES * 60)
+    except signing.SignatureExpired:
+        raise InvalidQuote('The fare quote has expired.')
+    except signing.BadSignature:
+        raise InvalidQuote('The fare quote is not valid.')
+    if data['u'] != user.id:
+        raise InvalidQuote('The fare quote was issued to another user.')
+    return FareQuote(
+        data['b'], data['u'], data['r'], date.fromisoformat(data['d']), data['s'],
+        Decimal(data['p']), Decimal(data['t']),
+    )
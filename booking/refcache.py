@@ -0,0 +1,117 @@
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import Location, Route, RouteBus
+
+GENERATION_KEY = 'ref:generation'
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def reference_cache():
+    return caches[settings.REFERENCE_CACHE_ALIAS]
+
+
+def current_generation(cache):
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        # add() keeps the first value if several processes race to start the counter
+        cache.add(GENERATION_KEY, 1, None)
+        generation = cache.get(GENERATION_KEY, 1)
+    return generation
+
+
+def bump_generation():
+    """Invalidate every cached reference entry in every process sharing the cache"""
+    cache = reference_cache()
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.add(GENERATION_KEY, 1, None)
+
+
+def record(name, outcome):
+    with _stats_lock:
+        _stats[name, outcome] += 1
+
+
+def reference_cache_stats():
+    """Return {name: {'hits': n, 'misses': n}} for lookups made by this process"""
+    with _stats_lock:
+        stats = {}
+        for (name, outcome), count in _stats.items():
+            stats.setdefault(name, {'hits': 0, 'misses': 0})[outcome] = count
+        return stats
+
+
+def read_through(name, loader, *key_parts):
+    """Return a cached reference value, loading and storing it on a miss
+
+    Keys embed the current generation, so bumping the generation retires
+    every entry at once without having to find and delete them.
+    """
+    cache = reference_cache()
+    key = ':'.join(['ref', str(current_generation(cache)), name, *map(str, key_parts)])
+    value = cache.get(key)
+    if value is not None:
+        record(name, 'hits')
+        return value
+    record(name, 'misses')
+    value = loader()
+    if value is not None:
+        cache.set(key, value, settings.REFERENCE_CACHE_TIMEOUT)
+    return value
+
+
+def get_locations():
+    """Every location, ordered by name"""
+    return read_through('locations', lambda: list(Location.objects.order_by('name')))
+
+
+def get_routes():
+    """Every route with its origin and destination"""
+    return read_through('routes', lambda: list(Route.objects.select_related('origin', 'destination')))
+
+
+def get_route(route_id):
+    """A route with its origin and destination; raises Route.DoesNotExist"""
+    route = read_through(
+        'route', lambda: Route.objects.select_related('origin', 'destination').filter(id=route_id).first(),
+        route_id,
+    )
+    if route is None:
+        raise Route.DoesNotExist(f'Route {route_id} does not exist.')
+    return route
+
+
+def get_route_departures(route_id, travel_date=None):
+    """Departures on a route with their bus, ordered by departure time
+
+    Given a date, only those running on its weekday, found through the
+    days_mask index and cached per weekday.
+    """
+    if travel_date is None:
+        return read_through(
+            'departures',
+            lambda: list(RouteBus.objects.filter(route_id=route_id).select_related('bus', 'route')),
+            route_id,
+        )
+    departures = RouteBus.objects.filter(route_id=route_id).running_on(travel_date).select_related('bus', 'route')
+    return read_through('departures', lambda: list(departures), route_id, f'weekday{travel_date.weekday()}')
+
+
+def get_route_bus(route_bus_id):
+    """A departure with its bus and route endpoints; raises RouteBus.DoesNotExist"""
+    route_bus = read_through(
+        'route_bus',
+        lambda: RouteBus.objects.select_related('bus', 'route__origin', 'route__destination')
+        .filter(id=route_bus_id).first(),
+        route_bus_id,
+    )
+    if route_bus is None:
+        raise RouteBus.DoesNotExist(f'Departure {route_bus_id} does not exist.')
+    return route_bus
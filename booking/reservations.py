@@ -0,0 +1,243 @@
+import random
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .inventory import (
+    ACTIVE_BOOKING_STATUSES, CAS_BACKOFF_SECONDS, MAX_CAS_ATTEMPTS, get_trip_inventory, rebuild_trip_inventory,
+    release_seats,
+)
+from .live import publish_seat_changes
+from .models import Booking, BookingSeat, Seat
+from .pricing import get_pricing_engine
+
+
+class SeatUnavailable(Exception):
+    """Raised when requested seats can no longer be claimed for a trip"""
+
+    def __init__(self, seats):
+        self.seats = list(seats)
+        seat_numbers = ', '.join(seat.seat_number for seat in self.seats)
+        super().__init__(f'Seats already booked: {seat_numbers}')
+
+
+class SeatContention(Exception):
+    """Raised when a trip is too busy to claim seats on right now; retrying may succeed"""
+
+
+class HoldExpired(Exception):
+    """Raised when a seat hold is confirmed after it has lapsed"""
+
+
+class InvalidSeatSelection(Exception):
+    """Raised when requested seats do not belong to the trip's bus"""
+
+
+def reserve_seats(
+    user, route_bus, travel_date, seats, price_per_seat, status='Confirmed', hold_expires_at=None, replacing=None,
+):
+    """Atomically claim seats on a trip and create the booking for them
+
+    The trip inventory is updated with a compare-and-swap on its version, so
+    bookings for the same trip only retry when they actually overlap in time
+    and only fail with SeatUnavailable when they overlap in seats. Retries
+    back off for a random, growing pause; a trip still contended after
+    MAX_CAS_ATTEMPTS raises SeatContention instead. The partial unique
+    constraint on BookingSeat backs this up at the database level.
+
+    The claim, the booking and all of its seats are written in one
+    transaction with three statements whatever the number of seats, so a
+    failure never leaves a partial booking behind. Views, the admin and
+    scripts should all book through here.
+
+    replacing is a queryset of pending holds on the same trip to give up in
+    favour of the new booking. Their seats count as free for the claim, and
+    they are expired and released in the same transaction, so they survive
+    if the claim fails.
+    """
+    seats = list(seats)
+    positions = [seat.position for seat in seats]
+    replaced_ids, replaced_positions = _held_seat_positions(replacing)
+
+    swept = False
+    for attempt in range(MAX_CAS_ATTEMPTS):
+        if attempt:
+            time.sleep(random.uniform(0, CAS_BACKOFF_SECONDS * 2 ** (attempt - 1)))
+        inventory = get_trip_inventory(route_bus, travel_date)
+        inventory.release(replaced_positions)
+        taken = [seat for seat in seats if inventory.is_booked(seat.position)]
+        if taken and not swept:
+            # Lapsed holds the sweeper has not reached yet should not block anyone
+            swept = True
+            if expire_holds(route_bus=route_bus, travel_date=travel_date):
+                continue
+        if taken:
+            raise SeatUnavailable(taken)
+        inventory.mark_booked(positions)
+
+        try:
+            with transaction.atomic():
+                # The claim is the first write so SQLite takes its write lock up front
+                if not inventory.save_if_unchanged():
+                    continue
+                if replaced_ids:
+                    expired = Booking.objects.filter(id__in=replaced_ids, status='Pending').update(
+                        status='Expired', updated_at=timezone.now(),
+                    )
+                    if expired != len(replaced_ids):
+                        # A replaced hold was confirmed or expired meanwhile; its seats are no longer ours to free
+                        transaction.set_rollback(True)
+                        replaced_ids, replaced_positions = _held_seat_positions(replacing)
+                        continue
+                    BookingSeat.objects.filter(booking_id__in=replaced_ids).update(is_active=False)
+                released = [position for position in replaced_positions if position not in positions]
+                publish_seat_changes(inventory, booked=positions, released=released)
+                booking = Booking.objects.create(
+                    user=user,
+                    route_bus=route_bus,
+                    booking_date=date.today(),
+                    travel_date=travel_date,
+                    total_price=price_per_seat * len(seats),
+                    seat_count=len(seats),
+                    status=status,
+                    hold_expires_at=hold_expires_at,
+                )
+                BookingSeat.objects.bulk_create([
+                    BookingSeat(
+                        booking=booking,
+                        seat=seat,
+                        price=price_per_seat,
+                        route_bus=route_bus,
+                        travel_date=travel_date,
+                    )
+                    for seat in seats
+                ])
+                return booking
+        except IntegrityError:
+            # The inventory disagreed with the booking rows; resync it and check the seats again
+            rebuild_trip_inventory(route_bus, travel_date)
+
+    raise SeatContention(f'Trip #{route_bus.id} on {travel_date} is busy; please try again.')
+
+
+def _held_seat_positions(holds):
+    """Return the ids of holds and the positions of the seats they claim"""
+    if holds is None:
+        return set(), []
+    held = BookingSeat.objects.filter(booking__in=holds, is_active=True).select_related('seat')
+    held_ids, positions = set(), []
+    for booking_seat in held:
+        held_ids.add(booking_seat.booking_id)
+        positions.append(booking_seat.seat.position)
+    return held_ids, positions
+
+
+def refresh_seat_counts(booking_ids):
+    """Recount the seats of bookings whose booking seats were edited directly"""
+    seat_counts = (
+        BookingSeat.objects.filter(booking=OuterRef('pk'))
+        .order_by().values('booking').annotate(seats=Count('id')).values('seats')
+    )
+    Booking.objects.filter(id__in=booking_ids).update(seat_count=Coalesce(Subquery(seat_counts), 0))
+
+
+def cancel_booking(booking):
+    """Cancel a booking and put its seats back on sale; return False if it was no longer active"""
+    with transaction.atomic():
+        # Only an active booking moves, so a repeated cancel can't release seats resold since
+        cancelled = Booking.objects.filter(id=booking.id, status__in=ACTIVE_BOOKING_STATUSES).update(
+            status='Cancelled', updated_at=timezone.now(),
+        )
+        if not cancelled:
+            return False
+        booking_seats = list(booking.booking_seats.filter(is_active=True).select_related('seat'))
+        BookingSeat.objects.filter(id__in=[booking_seat.id for booking_seat in booking_seats]).update(is_active=False)
+    booking.status = 'Cancelled'
+    release_seats(booking.route_bus, booking.travel_date, [booking_seat.seat for booking_seat in booking_seats])
+    return True
+
+
+def hold_seats(user, route_bus, travel_date, seats, price_per_seat):
+    """Place a time-boxed hold on seats, replacing the user's earlier holds on the trip
+
+    Replaced holds are expired rather than cancelled, and only once the new
+    hold is claimed; if it can't be, the user keeps the seats they held.
+    """
+    earlier_holds = Booking.objects.filter(user=user, route_bus=route_bus, travel_date=travel_date, status='Pending')
+    expires_at = timezone.now() + timedelta(minutes=settings.SEAT_HOLD_MINUTES)
+    return reserve_seats(
+        user, route_bus, travel_date, seats, price_per_seat,
+        status='Pending', hold_expires_at=expires_at, replacing=earlier_holds,
+    )
+
+
+def checkout_seats(user, route_bus, travel_date, seat_ids):
+    """Price and hold seats picked by id; return (hold, seats, price_per_seat)"""
+    # Seats retired from the bus layout can't be sold
+    seats = list(Seat.objects.filter(id__in=seat_ids, bus=route_bus.bus, is_active=True))
+    if not seats or len(seats) != len(set(seat_ids)):
+        raise InvalidSeatSelection(f'Invalid seat selection for trip #{route_bus.id}.')
+    inventory = get_trip_inventory(route_bus, travel_date)
+    price_per_seat = get_pricing_engine().quote(route_bus, travel_date, inventory.booked_count)
+    hold = hold_seats(user, route_bus, travel_date, seats, price_per_seat)
+    return hold, seats, price_per_seat
+
+
+def confirm_quote(quote):
+    """Confirm the hold a fare quote was issued for, in a single conditional update
+
+    The update also matches the trip, traveller and total from the quote, so
+    the booking confirmed is exactly the one priced at checkout.
+    """
+    confirmed = Booking.objects.filter(
+        id=quote.booking_id,
+        user_id=quote.user_id,
+        route_bus_id=quote.route_bus_id,
+        travel_date=quote.travel_date,
+        total_price=quote.total_price,
+        status='Pending',
+        hold_expires_at__gt=timezone.now(),
+    ).update(status='Confirmed', hold_expires_at=None, updated_at=timezone.now())
+    if not confirmed:
+        raise HoldExpired(f'The hold on booking #{quote.booking_id} has expired.')
+    return quote.booking_id
+
+
+def expire_holds(now=None, batch_size=500, route_bus=None, travel_date=None):
+    """Expire lapsed seat holds in batches and release their seats; return the number expired"""
+    now = now or timezone.now()
+    lapsed = Booking.objects.filter(status='Pending', hold_expires_at__lte=now)
+    if route_bus is not None:
+        lapsed = lapsed.filter(route_bus=route_bus, travel_date=travel_date)
+
+    expired = 0
+    while True:
+        booking_ids = list(lapsed.values_list('id', flat=True)[:batch_size])
+        if not booking_ids:
+            return expired
+        with transaction.atomic():
+            # Only holds still pending move, and the stamp tells this run's rows apart from a
+            # concurrent sweep's, so a hold confirmed or cancelled meanwhile keeps its seats
+            stamp = timezone.now()
+            Booking.objects.filter(id__in=booking_ids, status='Pending').update(status='Expired', updated_at=stamp)
+            booking_ids = list(
+                Booking.objects.filter(id__in=booking_ids, status='Expired', updated_at=stamp)
+                .values_list('id', flat=True)
+            )
+            booking_seats = list(
+                BookingSeat.objects.filter(booking_id__in=booking_ids, is_active=True).select_related('route_bus', 'seat')
+            )
+            BookingSeat.objects.filter(id__in=[booking_seat.id for booking_seat in booking_seats]).update(is_active=False)
+
+        trips = defaultdict(list)
+        for booking_seat in booking_seats:
+            trips[booking_seat.route_bus, booking_seat.travel_date].append(booking_seat.seat)
+        for (trip, trip_date), seats in trips.items():
+            release_seats(trip, trip_date, seats)
+        expired += len(booking_ids)
@@ -0,0 +1,107 @@
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from collections import namedtuple
+
+from .models import Location
+
+# Seconds before the index is rebuilt even without a location change signal
+INDEX_MAX_AGE = 300
+
+Suggestion = namedtuple('Suggestion', ['id', 'name', 'code'])
+
+# Lower rank sorts first: exact code, code prefix, name prefix, later word of the name
+RANK_EXACT_CODE = 0
+RANK_CODE = 1
+RANK_NAME = 2
+RANK_WORD = 3
+
+
+def normalize(text):
+    """Fold case and strip accents so 'São' and 'sao' compare equal"""
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).strip()
+
+
+class LocationIndex:
+    """Sorted prefix indexes over location codes, names and later name words
+
+    Each kind of key sits in its own sorted list, so a lookup is a bisect to
+    the first key at or after the prefix followed by a scan while keys still
+    start with it. Lists are read in rank order, which lets suggestions stop
+    as soon as enough matches are found.
+    """
+
+    def __init__(self, locations):
+        self.locations = {}
+        by_rank = {RANK_CODE: [], RANK_NAME: [], RANK_WORD: []}
+        for location in locations:
+            self.locations[location.id] = Suggestion(location.id, location.name, location.code)
+            name = normalize(location.name)
+            by_rank[RANK_CODE].append((normalize(location.code), location.id))
+            by_rank[RANK_NAME].append((name, location.id))
+            for word in name.split()[1:]:
+                by_rank[RANK_WORD].append((word, location.id))
+        self.indexes = []
+        for rank in (RANK_CODE, RANK_NAME, RANK_WORD):
+            entries = sorted(by_rank[rank])
+            self.indexes.append((rank, [entry[0] for entry in entries], entries))
+
+    @classmethod
+    def from_database(cls):
+        return cls(Location.objects.only('id', 'name', 'code').order_by())
+
+    def _matches(self, prefix):
+        """Yield (rank, location id) for a normalized prefix, best ranks first"""
+        if not prefix:
+            return
+        for rank, keys, entries in self.indexes:
+            start = bisect_left(keys, prefix)
+            if rank == RANK_CODE:
+                # Codes are unique, so an exact code can only sit at the insertion point
+                if start < len(keys) and keys[start] == prefix:
+                    yield RANK_EXACT_CODE, entries[start][1]
+                    start += 1
+            for index in range(start, len(keys)):
+                if not keys[index].startswith(prefix):
+                    break
+                yield rank, entries[index][1]
+
+    def matching_ids(self, query):
+        """Return ids of every location whose code, name or a name word starts with query"""
+        return {location_id for _, location_id in self._matches(normalize(query))}
+
+    def suggest(self, query, limit=10):
+        """Return up to limit suggestions for query, best matches first"""
+        seen = set()
+        suggestions = []
+        for _, location_id in self._matches(normalize(query)):
+            if location_id in seen:
+                continue
+            seen.add(location_id)
+            suggestions.append(self.locations[location_id])
+            if len(suggestions) == limit:
+                break
+        return suggestions
+
+
+_index = None
+_index_built_at = 0.0
+_index_lock = threading.Lock()
+
+
+def get_location_index():
+    """Return the process-wide location index, rebuilding it when locations changed"""
+    global _index, _index_built_at
+    with _index_lock:
+        if _index is None or time.monotonic() - _index_built_at > INDEX_MAX_AGE:
+            _index = LocationIndex.from_database()
+            _index_built_at = time.monotonic()
+        return _index
+
+
+def invalidate_location_index():
+    global _index
+    with _index_lock:
+        _index = None
@@ -0,0 +1,60 @@
+import hashlib
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .layout import SeatLayout
+from .models import Seat
+from .refcache import bump_generation, current_generation, reference_cache
+
+# Just what the seat grid needs, so cached maps stay small and cheap to unpickle
+SeatCell = namedtuple('SeatCell', ['id', 'seat_number', 'row', 'column', 'position'])
+
+
+def seat_map_cache_key(bus_id):
+    # The reference generation is shared, so a change saved in one process retires every process's copy
+    return f'seatmap:v3:{current_generation(reference_cache())}:bus:{bus_id}'
+
+
+def get_seat_map(bus):
+    """Return the prebuilt seat grid for a bus, with every seat shown as available"""
+    key = seat_map_cache_key(bus.id)
+    seat_map = cache.get(key)
+    if seat_map is None:
+        layout = SeatLayout.for_bus(bus)
+        seats = Seat.objects.filter(bus=bus, is_active=True).only('id', 'seat_number', 'row', 'column')
+        cells = [
+            SeatCell(seat.id, seat.seat_number, seat.row, seat.column, seat.position)
+            for seat in seats
+        ]
+        seat_rows = layout.build_rows(cells)
+        seat_map = {
+            'rows': layout.rows,
+            'cols_per_side': layout.cols_per_side,
+            'seat_rows': seat_rows,
+            'cells': cells,
+            # Changes whenever the layout or any seat does; used to build HTTP validators
+            'digest': hashlib.sha1(repr((layout.rows, layout.cols_per_side, cells)).encode()).hexdigest()[:16],
+        }
+        cache.set(key, seat_map, settings.SEAT_MAP_CACHE_TIMEOUT)
+    return seat_map
+
+
+def overlay_availability(seat_rows, inventory):
+    """Copy a cached seat grid, marking the seats booked in a trip inventory"""
+    return [
+        {
+            **row,
+            'seats': [
+                {**cell, 'is_booked': inventory.is_booked(cell['seat'].position)} if cell else None
+                for cell in row['seats']
+            ],
+        }
+        for row in seat_rows
+    ]
+
+
+def invalidate_seat_map(bus_id):
+    cache.delete(seat_map_cache_key(bus_id))
+    bump_generation()
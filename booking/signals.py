@@ -0,0 +1,50 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Bus, FareRule, Location, Route, RouteBus, Seat
+from .planner import invalidate_journey_index
+from .pricing import invalidate_pricing_engine
+from .refcache import bump_generation
+from .search import invalidate_location_index
+from .seatmap import invalidate_seat_map
+
+
+@receiver([post_save, post_delete], sender=Bus)
+def bus_changed(sender, instance, **kwargs):
+    """Drop the cached seat map when a bus layout may have changed"""
+    invalidate_seat_map(instance.id)
+    invalidate_journey_index()
+
+
+@receiver([post_save, post_delete], sender=Location)
+def location_changed(sender, instance, **kwargs):
+    """Rebuild the location search index after a location is added, renamed or removed"""
+    invalidate_location_index()
+
+
+@receiver([post_save, post_delete], sender=Route)
+@receiver([post_save, post_delete], sender=RouteBus)
+def schedule_changed(sender, instance, **kwargs):
+    """Rebuild the journey planner index after a route or timetable change"""
+    invalidate_journey_index()
+
+
+@receiver([post_save, post_delete], sender=Seat)
+def seat_changed(sender, instance, **kwargs):
+    """Drop the cached seat map of the bus a seat belongs to"""
+    invalidate_seat_map(instance.bus_id)
+
+
+@receiver([post_save, post_delete], sender=FareRule)
+def fare_rule_changed(sender, instance, **kwargs):
+    """Recompile the pricing engine after a fare rule change"""
+    invalidate_pricing_engine()
+
+
+@receiver([post_save, post_delete], sender=Location)
+@receiver([post_save, post_delete], sender=Route)
+@receiver([post_save, post_delete], sender=Bus)
+@receiver([post_save, post_delete], sender=RouteBus)
+def reference_data_changed(sender, instance, **kwargs):
+    """Retire cached reference data after an admin edit, in every process sharing the cache"""
+    bump_generation()
@@ -0,0 +1,74 @@
+import datetime
+
+from django import template
+from django.contrib.admin.templatetags.admin_list import date_hierarchy
+from django.contrib.admin.utils import get_fields_from_path
+from django.db import models
+from django.utils import formats
+from django.utils.text import capfirst
+
+register = template.Library()
+
+
+@register.inclusion_tag('admin/date_hierarchy.html')
+def calendar_date_hierarchy(cl):
+    """Date hierarchy offering every calendar period between the first and last date listed
+
+    The stock tag asks the database for each distinct year, month or day,
+    which reads every row in range. This looks up only the first and last
+    date, each one index lookup, and offers the periods between them even if
+    some turn out empty. Datetime fields and single days use the stock tag.
+    """
+    field_name = cl.date_hierarchy
+    year_field, month_field, day_field = (f'{field_name}__{part}' for part in ('year', 'month', 'day'))
+    year_lookup, month_lookup, day_lookup = (cl.params.get(name) for name in (year_field, month_field, day_field))
+    field = get_fields_from_path(cl.model, field_name)[-1]
+    if isinstance(field, models.DateTimeField) or (year_lookup and month_lookup and day_lookup):
+        return date_hierarchy(cl)
+
+    def link(filters):
+        return cl.get_query_string(filters, [f'{field_name}__'])
+
+    # The change list has already narrowed the queryset to the chosen year or month.
+    # MIN() and MAX() go in separate queries: SQLite only seeks an index for a lone one
+    first = cl.queryset.aggregate(date=models.Min(field_name))['date']
+    last = cl.queryset.aggregate(date=models.Max(field_name))['date']
+    if first and not year_lookup and first.year == last.year:
+        year_lookup = first.year
+        if first.month == last.month:
+            month_lookup = first.month
+
+    if year_lookup and month_lookup:
+        year, month = int(year_lookup), int(month_lookup)
+        days = range(first.day, last.day + 1) if first else ()
+        return {
+            'show': True,
+            'back': {'link': link({year_field: year_lookup}), 'title': str(year_lookup)},
+            'choices': [
+                {
+                    'link': link({year_field: year_lookup, month_field: month_lookup, day_field: day}),
+                    'title': capfirst(formats.date_format(datetime.date(year, month, day), 'MONTH_DAY_FORMAT')),
+                }
+                for day in days
+            ],
+        }
+    if year_lookup:
+        year = int(year_lookup)
+        months = range(first.month, last.month + 1) if first else ()
+        return {
+            'show': True,
+            'back': {'link': link({}), 'title': 'All dates'},
+            'choices': [
+                {
+                    'link': link({year_field: year_lookup, month_field: month}),
+                    'title': capfirst(formats.date_format(datetime.date(year, month, 1), 'YEAR_MONTH_FORMAT')),
+                }
+                for month in months
+            ],
+        }
+    years = range(first.year, last.year + 1) if first else ()
+    return {
+        'show': True,
+        'back': None,
+        'choices': [{'link': link({year_field: str(year)}), 'title': str(year)} for year in years],
+    }
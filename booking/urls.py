@@ -5,8 +5,11 @@ app_name = 'booking'
 
 urlpatterns = [
     path('', views.home_view, name='home'),
+    path('locations/suggest/', views.location_suggestions_view, name='location_suggestions'),
     path('routes/<int:route_id>/buses/', views.buses_view, name='buses'),
+    path('journeys/', views.journeys_view, name='journeys'),
     path('route-bus/<int:route_bus_id>/seats/', views.seat_selection_view, name='seat_selection'),
+    path('route-bus/<int:route_bus_id>/seats/events/', views.seat_events_view, name='seat_events'),
     path('checkout/', views.checkout_view, name='checkout'),
     path('confirm-booking/', views.confirm_booking_view, name='confirm_booking'),
     path('booking/<int:booking_id>/confirmation/', views.booking_confirmation_view, name='booking_confirmation'),
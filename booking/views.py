@@ -1,38 +1,56 @@
 from django.shortcuts import render, get_object_or_404, redirect
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Q
+from django.conf import settings
 from django.utils import timezone
+from asgiref.sync import sync_to_async
+from collections import defaultdict
 from datetime import date, timedelta
-from .models import Location, Route, Bus, RouteBus, Seat, Booking, BookingSeat
-from decimal import Decimal
+from .models import Route, RouteBus, Seat, Booking, ArchivedBooking
+from .archive import get_booking_or_404, prefetch_booking_seats
+from .inventory import booked_seat_counts, get_trip_inventory
+from .live import aevent_stream, format_event, seat_channel
+from .pagination import paginate_merged_by_cursor
+from .planner import MINUTES_PER_DAY, get_journey_index, minutes_to_datetime
+from .pricing import base_fare, get_pricing_engine
+from .search import get_location_index
+from .seatmap import get_seat_map, overlay_availability
+from .quotes import InvalidQuote, issue_quote, read_quote
+from .queries import list_trips, search_routes
+from .refcache import get_locations, get_route, get_route_bus
+from .reservations import (
+    HoldExpired, InvalidSeatSelection, SeatContention, SeatUnavailable, cancel_booking, checkout_seats,
+    confirm_quote,
+)
 
 
-def home_view(request):
+async def acached_or_404(getter, pk):
+    """Fetch a reference object through the cache, or raise Http404"""
+    try:
+        return await sync_to_async(getter)(pk)
+    except (Route.DoesNotExist, RouteBus.DoesNotExist) as e:
+        raise Http404(str(e))
+
+
+async def arender(request, template_name, context):
+    """Render off the event loop, since templates read the session and user lazily"""
+    # Reuse the user login_required already loaded instead of fetching it again
+    request.user = await request.auser()
+    return await sync_to_async(render)(request, template_name, context)
+
+
+async def home_view(request):
     """Home page with route selection"""
-    routes = Route.objects.all().select_related('origin', 'destination')
-    
-    # Search functionality
+    # Search by location name or code, and filter by origin and destination
     search_query = request.GET.get('search', '')
-    if search_query:
-        routes = routes.filter(
-            Q(origin__name__icontains=search_query) |
-            Q(destination__name__icontains=search_query) |
-            Q(origin__code__icontains=search_query) |
-            Q(destination__code__icontains=search_query)
-        )
-    
-    # Filter by origin
     origin_filter = request.GET.get('origin', '')
-    if origin_filter:
-        routes = routes.filter(origin_id=origin_filter)
-    
-    # Filter by destination
     dest_filter = request.GET.get('destination', '')
-    if dest_filter:
-        routes = routes.filter(destination_id=dest_filter)
-    
-    locations = Location.objects.all().order_by('name')
+    # Both come from the reference cache; thread-sensitive calls run one after another anyway
+    routes = await sync_to_async(search_routes)(search_query, origin_filter, dest_filter)
+    locations = await sync_to_async(get_locations)()
     
     context = {
         'routes': routes,
@@ -42,66 +60,140 @@ def home_view(request):
         'dest_filter': dest_filter,
     }
     
-    return render(request, 'home.html', context)
+    return await arender(request, 'home.html', context)
+
+
+def location_suggestions_view(request):
+    """JSON typeahead suggestions for locations matching a name or code prefix"""
+    query = request.GET.get('q', '')
+    try:
+        limit = int(request.GET.get('limit', 10))
+    except ValueError:
+        return JsonResponse({'error': 'limit must be a whole number.'}, status=400)
+    # suggest() stops once it has limit results, so zero or less would return every match
+    limit = min(max(limit, 1), 50)
+    suggestions = get_location_index().suggest(query, limit=limit)
+    return JsonResponse({
+        'query': query,
+        'results': [suggestion._asdict() for suggestion in suggestions],
+    })
 
 
-def buses_view(request, route_id):
+async def buses_view(request, route_id):
     """Display buses for a selected route"""
-    route = get_object_or_404(Route, id=route_id)
-    route_buses = RouteBus.objects.filter(route=route).select_related('bus', 'route')
+    route = await acached_or_404(get_route, route_id)
     
     # Filter by travel date if provided
     travel_date = request.GET.get('travel_date', '')
+    travel_date_obj = None
     if travel_date:
         try:
             travel_date_obj = date.fromisoformat(travel_date)
-            # Filter buses available on that day of week (0=Monday, 6=Sunday)
-            day_of_week = travel_date_obj.weekday()
-            route_buses = [
-                rb for rb in route_buses 
-                if day_of_week in (rb.available_days if isinstance(rb.available_days, list) else [])
-            ]
         except ValueError:
             pass
     
-    # Calculate prices for each bus
-    buses_with_prices = []
-    for route_bus in route_buses:
-        price = calculate_bus_price(route, route_bus.bus)
-        buses_with_prices.append({
-            'route_bus': route_bus,
-            'price': price,
-        })
-    
     context = {
         'route': route,
-        'buses_with_prices': buses_with_prices,
+        'buses_with_prices': await sync_to_async(list_trips)(route, travel_date_obj),
         'travel_date': travel_date,
     }
     
-    return render(request, 'buses.html', context)
+    return await arender(request, 'buses.html', context)
 
 
-def calculate_bus_price(route, bus):
-    """Calculate price based on route base price and bus type"""
-    base_price = route.base_price
+def journeys_view(request):
+    """Plan journeys between two locations, including ones with connections"""
+    locations = get_locations()
+    origin_filter = request.GET.get('origin', '')
+    dest_filter = request.GET.get('destination', '')
+    sort = 'price' if request.GET.get('sort') == 'price' else 'arrival'
+    
+    travel_date = request.GET.get('travel_date', '')
+    try:
+        travel_date_obj = date.fromisoformat(travel_date)
+    except ValueError:
+        travel_date_obj = date.today() + timedelta(days=1)
+        travel_date = travel_date_obj.isoformat()
     
-    # Bus type multipliers
-    bus_multipliers = {
-        'Non-AC': Decimal('1.0'),
-        'AC': Decimal('1.3'),
-        'Semi-sleeper': Decimal('1.5'),
-        'Sleeper': Decimal('1.8'),
+    itineraries = []
+    if origin_filter.isdigit() and dest_filter.isdigit():
+        # Journeys today cannot leave before now
+        earliest_departure = 0
+        now = timezone.localtime()
+        if travel_date_obj == now.date():
+            earliest_departure = now.hour * 60 + now.minute
+        
+        plans = get_journey_index(base_fare).plan(
+            travel_date_obj,
+            int(origin_filter),
+            int(dest_filter),
+            earliest_departure=earliest_departure,
+            transfer_minutes=settings.JOURNEY_MIN_TRANSFER_MINUTES,
+            sort=sort,
+            limit=10,
+        )
+        route_buses = RouteBus.objects.select_related(
+            'route__origin', 'route__destination', 'bus'
+        ).in_bulk({leg.route_bus_id for plan in plans for leg in plan.legs})
+        
+        # The planner ranks on base fares; quote each leg for the day it actually runs
+        leg_dates = defaultdict(set)
+        for plan in plans:
+            for leg in plan.legs:
+                leg_dates[travel_date_obj + timedelta(days=leg.departure // MINUTES_PER_DAY)].add(leg.route_bus_id)
+        leg_prices = {}
+        engine = get_pricing_engine()
+        for leg_date, route_bus_ids in leg_dates.items():
+            prices = engine.quote_many(
+                [route_buses[route_bus_id] for route_bus_id in route_bus_ids],
+                leg_date,
+                booked_seat_counts(list(route_bus_ids), leg_date),
+            )
+            leg_prices.update(((route_bus_id, leg_date), price) for route_bus_id, price in prices.items())
+        
+        for plan in plans:
+            legs = []
+            for leg in plan.legs:
+                leg_date = travel_date_obj + timedelta(days=leg.departure // MINUTES_PER_DAY)
+                legs.append({
+                    'route_bus': route_buses[leg.route_bus_id],
+                    'departure': minutes_to_datetime(travel_date_obj, leg.departure),
+                    'arrival': minutes_to_datetime(travel_date_obj, leg.arrival),
+                    'price': leg_prices[leg.route_bus_id, leg_date],
+                    'travel_date': leg_date,
+                })
+            itineraries.append({
+                'legs': legs,
+                'departure': legs[0]['departure'],
+                'arrival': legs[-1]['arrival'],
+                'duration': f'{plan.duration // 60}h {plan.duration % 60:02d}m',
+                'transfers': plan.transfers,
+                'price': sum(leg['price'] for leg in legs),
+            })
+        if sort == 'price':
+            itineraries.sort(key=lambda itinerary: (itinerary['price'], itinerary['arrival']))
+    
+    context = {
+        'locations': locations,
+        'itineraries': itineraries,
+        'origin_filter': origin_filter,
+        'dest_filter': dest_filter,
+        'travel_date': travel_date,
+        'sort': sort,
     }
     
-    multiplier = bus_multipliers.get(bus.bus_type, Decimal('1.0'))
-    return base_price * multiplier
+    return render(request, 'journeys.html', context)
+
+
+def seat_selection_url(route_bus_id, travel_date):
+    """Build the seat selection URL for a trip"""
+    return f"{reverse('booking:seat_selection', args=[route_bus_id])}?travel_date={travel_date}"
 
 
 @login_required
-def seat_selection_view(request, route_bus_id):
+async def seat_selection_view(request, route_bus_id):
     """Display seat layout and handle seat selection"""
-    route_bus = get_object_or_404(RouteBus, id=route_bus_id)
+    route_bus = await acached_or_404(get_route_bus, route_bus_id)
     bus = route_bus.bus
     route = route_bus.route
     
@@ -116,75 +208,63 @@ def seat_selection_view(request, route_bus_id):
         travel_date_obj = date.today() + timedelta(days=1)
         travel_date = travel_date_obj.isoformat()
     
-    # Get all seats for this bus
-    seats = Seat.objects.filter(bus=bus, is_active=True).order_by('row', 'column')
+    # Get the bus seat map (cached per bus) and this trip's bookings
+    seat_map = await sync_to_async(get_seat_map)(bus)
+    inventory = await sync_to_async(get_trip_inventory)(route_bus, travel_date_obj)
+    seat_rows = overlay_availability(seat_map['seat_rows'], inventory)
     
-    # Get booked seats for this route_bus on the travel date
-    booked_seats = set()
-    bookings = Booking.objects.filter(
-        route_bus=route_bus,
-        travel_date=travel_date_obj,
-        status__in=['Pending', 'Confirmed']
-    )
-    for booking in bookings:
-        booked_seats.update(booking.booking_seats.values_list('seat_id', flat=True))
-    
-    # Organize seats by row
-    seat_layout_config = bus.get_seat_layout_config()
-    rows = seat_layout_config.get('rows', 0)
-    cols_per_side = seat_layout_config.get('cols_per_side', [0, 0])
-    
-    # Build seat rows for template
-    seat_rows = []
-    for row_num in range(1, rows + 1):
-        row_seats = []
-        # Left side seats
-        for col_num in range(1, cols_per_side[0] + 1):
-            seat = next((s for s in seats if s.row == row_num and s.column == col_num), None)
-            if seat:
-                row_seats.append({
-                    'seat': seat,
-                    'is_booked': seat.id in booked_seats,
-                    'side': 'left'
-                })
-            else:
-                row_seats.append(None)
-        
-        # Right side seats
-        for col_num in range(cols_per_side[0] + 1, cols_per_side[0] + cols_per_side[1] + 1):
-            seat = next((s for s in seats if s.row == row_num and s.column == col_num), None)
-            if seat:
-                row_seats.append({
-                    'seat': seat,
-                    'is_booked': seat.id in booked_seats,
-                    'side': 'right'
-                })
-            else:
-                row_seats.append(None)
-        
-        seat_rows.append({
-            'row_num': row_num,
-            'seats': row_seats,
-            'left_count': cols_per_side[0],
-            'right_count': cols_per_side[1]
-        })
-    
-    # Calculate price per seat
-    price_per_seat = calculate_bus_price(route, bus)
+    # Price per seat for this trip's date and current occupancy
+    engine = await sync_to_async(get_pricing_engine)()
+    price_per_seat = engine.quote(route_bus, travel_date_obj, inventory.booked_count)
     
     context = {
         'route_bus': route_bus,
         'route': route,
         'bus': bus,
-        'seats': seats,
         'seat_rows': seat_rows,
-        'rows': rows,
-        'cols_per_side': cols_per_side,
+        'rows': seat_map['rows'],
+        'cols_per_side': seat_map['cols_per_side'],
         'travel_date': travel_date,
         'price_per_seat': price_per_seat,
     }
     
-    return render(request, 'seat_selection.html', context)
+    return await arender(request, 'seat_selection.html', context)
+
+
+def seat_events_view(request, route_bus_id):
+    """Stream live seat availability for a trip as server-sent events
+
+    Under WSGI a stream would pin a worker thread for as long as the page is
+    open, so the response is a single snapshot and EventSource polls for the
+    next one every SEAT_EVENTS_POLL_SECONDS.
+    """
+    try:
+        route_bus = get_route_bus(route_bus_id)
+    except RouteBus.DoesNotExist as e:
+        raise Http404(str(e))
+    try:
+        travel_date_obj = date.fromisoformat(request.GET.get('travel_date', ''))
+    except ValueError:
+        raise Http404('A valid travel date is required.')
+
+    def load_snapshot():
+        inventory = get_trip_inventory(route_bus, travel_date_obj)
+        return {'version': inventory.version, 'booked': inventory.booked_positions()}
+
+    if not isinstance(request, ASGIRequest):
+        response = HttpResponse(
+            f'retry: {settings.SEAT_EVENTS_POLL_SECONDS * 1000}\n' + format_event('snapshot', load_snapshot()),
+            content_type='text/event-stream',
+        )
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+    response = StreamingHttpResponse(
+        aevent_stream(seat_channel(route_bus.id, travel_date_obj), load_snapshot), content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 
 @login_required
@@ -200,34 +280,25 @@ def checkout_view(request):
             return redirect('booking:home')
         
         try:
-            route_bus = RouteBus.objects.get(id=route_bus_id)
+            route_bus = get_route_bus(route_bus_id)
             travel_date_obj = date.fromisoformat(travel_date)
-            seats = Seat.objects.filter(id__in=seat_ids, bus=route_bus.bus)
             
-            if seats.count() != len(seat_ids):
+            # Hold the seats while the user reviews the booking
+            try:
+                hold, seats, price_per_seat = checkout_seats(request.user, route_bus, travel_date_obj, seat_ids)
+            except InvalidSeatSelection:
                 messages.error(request, 'Invalid seat selection.')
                 return redirect('booking:home')
-            
-            # Check if seats are available
-            booked_seats = set()
-            bookings = Booking.objects.filter(
-                route_bus=route_bus,
-                travel_date=travel_date_obj,
-                status__in=['Pending', 'Confirmed']
-            )
-            for booking in bookings:
-                booked_seats.update(booking.booking_seats.values_list('seat_id', flat=True))
-            
-            selected_seat_ids = [int(sid) for sid in seat_ids]
-            if any(sid in booked_seats for sid in selected_seat_ids):
-                messages.error(request, 'Some selected seats are already booked.')
-                return redirect('seat_selection', route_bus_id=route_bus_id)
-            
-            # Calculate total price
-            price_per_seat = calculate_bus_price(route_bus.route, route_bus.bus)
-            total_price = price_per_seat * len(seat_ids)
+            except SeatUnavailable as e:
+                messages.error(request, f'{e}. Please select different seats.')
+                return redirect(seat_selection_url(route_bus.id, travel_date))
+            except SeatContention as e:
+                messages.error(request, str(e))
+                return redirect(seat_selection_url(route_bus.id, travel_date))
             
             context = {
+                'hold': hold,
+                'quote_token': issue_quote(hold, seats, price_per_seat),
                 'route_bus': route_bus,
                 'route': route_bus.route,
                 'bus': route_bus.bus,
@@ -235,7 +306,7 @@ def checkout_view(request):
                 'travel_date': travel_date,
                 'travel_date_obj': travel_date_obj,
                 'price_per_seat': price_per_seat,
-                'total_price': total_price,
+                'total_price': hold.total_price,
             }
             
             return render(request, 'checkout.html', context)
@@ -252,62 +323,24 @@ def checkout_view(request):
 def confirm_booking_view(request):
     """Process and confirm the booking"""
     if request.method == 'POST':
-        route_bus_id = request.POST.get('route_bus_id')
-        seat_ids = request.POST.getlist('selected_seats')
-        travel_date = request.POST.get('travel_date')
-        
-        if not route_bus_id or not seat_ids or not travel_date:
-            messages.error(request, 'Missing booking information.')
+        try:
+            quote = read_quote(request.POST.get('quote_token', ''), request.user)
+        except InvalidQuote as e:
+            messages.error(request, f'{e} Please select your seats again.')
             return redirect('booking:home')
         
+        # The signed quote already carries the trip, seats and price; only the claim is left
         try:
-            route_bus = RouteBus.objects.get(id=route_bus_id)
-            travel_date_obj = date.fromisoformat(travel_date)
-            seats = Seat.objects.filter(id__in=seat_ids, bus=route_bus.bus)
-            
-            # Double-check seat availability
-            booked_seats = set()
-            bookings = Booking.objects.filter(
-                route_bus=route_bus,
-                travel_date=travel_date_obj,
-                status__in=['Pending', 'Confirmed']
-            )
-            for booking in bookings:
-                booked_seats.update(booking.booking_seats.values_list('seat_id', flat=True))
-            
-            selected_seat_ids = [int(sid) for sid in seat_ids]
-            if any(sid in booked_seats for sid in selected_seat_ids):
-                messages.error(request, 'Some selected seats are already booked. Please select different seats.')
-                return redirect('seat_selection', route_bus_id=route_bus_id)
-            
-            # Calculate total price
-            price_per_seat = calculate_bus_price(route_bus.route, route_bus.bus)
-            total_price = price_per_seat * len(seat_ids)
-            
-            # Create booking
-            booking = Booking.objects.create(
-                user=request.user,
-                route_bus=route_bus,
-                booking_date=date.today(),
-                travel_date=travel_date_obj,
-                total_price=total_price,
-                status='Confirmed'
-            )
-            
-            # Create booking seats
-            for seat in seats:
-                BookingSeat.objects.create(
-                    booking=booking,
-                    seat=seat,
-                    price=price_per_seat
-                )
-            
-            messages.success(request, f'Booking confirmed! Booking ID: #{booking.id}')
-            return redirect('booking:booking_confirmation', booking_id=booking.id)
-            
-        except Exception as e:
-            messages.error(request, f'Error processing booking: {str(e)}')
-            return redirect('booking:home')
+            booking_id = confirm_quote(quote)
+        except HoldExpired:
+            # A double submit finds the booking already confirmed
+            if Booking.objects.filter(id=quote.booking_id, user=request.user, status='Confirmed').exists():
+                return redirect('booking:booking_confirmation', booking_id=quote.booking_id)
+            messages.error(request, 'Your seat hold has expired. Please select your seats again.')
+            return redirect(seat_selection_url(quote.route_bus_id, quote.travel_date.isoformat()))
+        
+        messages.success(request, f'Booking confirmed! Booking ID: #{booking_id}')
+        return redirect('booking:booking_confirmation', booking_id=booking_id)
     
     messages.error(request, 'Invalid request.')
     return redirect('booking:home')
@@ -316,7 +349,10 @@ def confirm_booking_view(request):
 @login_required
 def booking_confirmation_view(request, booking_id):
     """Display booking confirmation"""
-    booking = get_object_or_404(Booking, id=booking_id, user=request.user)
+    booking = get_booking_or_404(
+        ['route_bus__route__origin', 'route_bus__route__destination', 'route_bus__bus'],
+        id=booking_id, user=request.user,
+    )
     booking_seats = booking.booking_seats.all().select_related('seat')
     
     context = {
@@ -327,17 +363,48 @@ def booking_confirmation_view(request, booking_id):
     return render(request, 'booking_confirmation.html', context)
 
 
+DASHBOARD_FILTERS = {
+    'all': 'All',
+    'upcoming': 'Upcoming',
+    'past': 'Past',
+    'cancelled': 'Cancelled',
+}
+
+
 @login_required
 def dashboard_view(request):
     """User dashboard to view booking history"""
-    bookings = Booking.objects.filter(user=request.user).select_related(
-        'route_bus__route__origin',
-        'route_bus__route__destination',
-        'route_bus__bus'
-    ).order_by('-created_at')
+    show = request.GET.get('show', 'all')
+    if show not in DASHBOARD_FILTERS:
+        show = 'all'
+    
+    today = date.today()
+    # Archived bookings are all past trips, so upcoming ones only need the live table
+    tables = [Booking] if show == 'upcoming' else [Booking, ArchivedBooking]
+    sources = []
+    for model in tables:
+        bookings = model.objects.filter(user=request.user).exclude(status='Expired')
+        if show == 'upcoming':
+            bookings = bookings.filter(travel_date__gte=today, status__in=['Pending', 'Confirmed'])
+        elif show == 'past':
+            bookings = bookings.filter(travel_date__lt=today, status='Confirmed')
+        elif show == 'cancelled':
+            bookings = bookings.filter(status='Cancelled')
+        sources.append(bookings.select_related(
+            'route_bus__route__origin',
+            'route_bus__route__destination',
+            'route_bus__bus'
+        ))
+    page = paginate_merged_by_cursor(sources, request.GET.get('cursor'), settings.DASHBOARD_PAGE_SIZE)
+    # Seats for the whole page arrive in one extra query per table it draws on
+    prefetch_booking_seats(page.items)
     
     context = {
-        'bookings': bookings,
+        'bookings': page.items,
+        'next_cursor': page.next_cursor,
+        'is_first_page': not request.GET.get('cursor'),
+        'show': show,
+        'filters': DASHBOARD_FILTERS,
     }
     
     return render(request, 'dashboard.html', context)
@@ -346,16 +413,24 @@ def dashboard_view(request):
 @login_required
 def cancel_booking_view(request, booking_id):
     """Cancel a booking"""
-    booking = get_object_or_404(Booking, id=booking_id, user=request.user)
+    booking = get_object_or_404(
+        Booking.objects.select_related('route_bus__route__origin', 'route_bus__route__destination'),
+        id=booking_id, user=request.user,
+    )
     
     if booking.status == 'Cancelled':
         messages.warning(request, 'This booking is already cancelled.')
         return redirect('booking:dashboard')
     
+    if booking.status == 'Expired':
+        messages.warning(request, 'This seat hold has already expired.')
+        return redirect('booking:dashboard')
+    
     if request.method == 'POST':
-        booking.status = 'Cancelled'
-        booking.save()
-        messages.success(request, f'Booking #{booking.id} has been cancelled.')
+        if cancel_booking(booking):
+            messages.success(request, f'Booking #{booking.id} has been cancelled.')
+        else:
+            messages.warning(request, f'Booking #{booking.id} is no longer active.')
         return redirect('booking:dashboard')
     
     context = {
@@ -0,0 +1,234 @@
+"""
+Per-view query counts, database time, template render time and latency.
+
+InstrumentationMiddleware collects the numbers for each request into
+in-process histograms labelled by URL name, and metrics_view exports them
+in the Prometheus text format.
+"""
+import hmac
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from django.template.backends.django import DjangoTemplates, Template
+
+logger = logging.getLogger('busticket.instrumentation')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+
+
+class RequestStats:
+    """What one request spent, filled in while it runs"""
+
+    __slots__ = ('queries', 'db_seconds', 'template_seconds')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+
+
+class MetricsRegistry:
+    """Histograms per metric and URL name, plus counters for exceeded budgets"""
+
+    metrics = {
+        'busticket_request_duration_seconds': ('Total time spent handling a request', LATENCY_BUCKETS),
+        'busticket_db_queries': ('SQL queries run per request', QUERY_BUCKETS),
+        'busticket_db_duration_seconds': ('Time spent in SQL per request', LATENCY_BUCKETS),
+        'busticket_template_render_seconds': ('Time spent rendering templates per request', LATENCY_BUCKETS),
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.budget_exceeded = {}
+
+    def observe(self, view_name, duration, stats):
+        with self.lock:
+            for metric, value in [
+                ('busticket_request_duration_seconds', duration),
+                ('busticket_db_queries', stats.queries),
+                ('busticket_db_duration_seconds', stats.db_seconds),
+                ('busticket_template_render_seconds', stats.template_seconds),
+            ]:
+                histogram = self.histograms.get((metric, view_name))
+                if histogram is None:
+                    histogram = self.histograms[metric, view_name] = Histogram(self.metrics[metric][1])
+                histogram.observe(value)
+
+    def exceeded_budget(self, view_name):
+        with self.lock:
+            self.budget_exceeded[view_name] = self.budget_exceeded.get(view_name, 0) + 1
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            for metric, (help_text, buckets) in self.metrics.items():
+                lines.append(f'# HELP {metric} {help_text}')
+                lines.append(f'# TYPE {metric} histogram')
+                for (name, view_name), histogram in sorted(self.histograms.items()):
+                    if name != metric:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip((*buckets, '+Inf'), histogram.counts):
+                        cumulative += count
+                        lines.append(f'{metric}_bucket{{view="{view_name}",le="{bound}"}} {cumulative}')
+                    lines.append(f'{metric}_sum{{view="{view_name}"}} {histogram.total}')
+                    lines.append(f'{metric}_count{{view="{view_name}"}} {cumulative}')
+            lines.append('# HELP busticket_query_budget_exceeded_total Requests that ran more queries than their budget')
+            lines.append('# TYPE busticket_query_budget_exceeded_total counter')
+            for view_name, count in sorted(self.budget_exceeded.items()):
+                lines.append(f'busticket_query_budget_exceeded_total{{view="{view_name}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+# The stats of the request being handled; contextvars follow the request into
+# sync_to_async threads, so queries from async views are counted too
+current_stats = ContextVar('current_stats', default=None)
+
+
+def count_query(execute, sql, params, many, context):
+    """Database execute wrapper timing every query of an instrumented request"""
+    stats = current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db_seconds += time.perf_counter() - started
+
+
+def install_query_counter(connection, **kwargs):
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+connection_created.connect(install_query_counter)
+
+
+class InstrumentedTemplate(Template):
+    def render(self, context=None, request=None):
+        stats = current_stats.get()
+        if stats is None:
+            return super().render(context, request)
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.template_seconds += time.perf_counter() - started
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """Django template backend that adds render time to the current request's stats"""
+
+    def from_string(self, template_code):
+        return InstrumentedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return InstrumentedTemplate(template.template, self)
+
+
+class InstrumentationMiddleware:
+    """Record per-view query counts, DB time, template time and latency"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.budgets = getattr(settings, 'QUERY_BUDGETS', {})
+        # Connections opened before this module was imported missed the signal
+        for connection in connections.all(initialized_only=True):
+            install_query_counter(connection)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        self.finish(request, stats, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        self.finish(request, stats, time.perf_counter() - started)
+        return response
+
+    def finish(self, request, stats, duration):
+        match = request.resolver_match
+        view_name = match.view_name if match else 'unmatched'
+        registry.observe(view_name, duration, stats)
+        budget = self.budgets.get(view_name)
+        if budget is not None and stats.queries > budget:
+            registry.exceeded_budget(view_name)
+            logger.warning(
+                '%s ran %d queries, over its budget of %d (%s)',
+                view_name, stats.queries, budget, request.path,
+            )
+
+
+def has_metrics_token(request):
+    """True if the request carries METRICS_BEARER_TOKEN as a bearer token"""
+    token = settings.METRICS_BEARER_TOKEN
+    scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+    return bool(token) and scheme.lower() == 'bearer' and hmac.compare_digest(credentials.encode(), token.encode())
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint, open to METRICS_BEARER_TOKEN holders, METRICS_ALLOWED_IPS and staff users"""
+    allowed = has_metrics_token(request) or request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
+    if not allowed and not request.user.is_staff:
+        return HttpResponseForbidden('Metrics are not public.')
+    body = registry.render()
+
+    # Reference cache effectiveness, from booking.refcache
+    from booking.refcache import reference_cache_stats
+    lines = [
+        '# HELP busticket_reference_cache_requests_total Reference cache lookups by outcome',
+        '# TYPE busticket_reference_cache_requests_total counter',
+    ]
+    for name, outcomes in sorted(reference_cache_stats().items()):
+        for outcome, count in sorted(outcomes.items()):
+            lines.append(f'busticket_reference_cache_requests_total{{entry="{name}",outcome="{outcome}"}} {count}')
+    body += '\n'.join(lines) + '\n'
+    return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -2,6 +2,7 @@
 Django settings for busticket project.
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -34,6 +35,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'busticket.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -47,7 +49,8 @@ ROOT_URLCONF = 'busticket.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates that also times rendering for the instrumentation middleware
+        'BACKEND': 'busticket.instrumentation.InstrumentedDjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -74,6 +77,17 @@ DATABASES = {
     }
 }
 
+# Set POSTGRES_DB to run against a local PostgreSQL server instead
+if os.environ.get('POSTGRES_DB'):
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ['POSTGRES_DB'],
+        'USER': os.environ.get('POSTGRES_USER', ''),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+        'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -117,6 +131,82 @@ STATICFILES_DIRS = [BASE_DIR / 'static']
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Caches: 'reference' holds near-static locations, routes and departures. Point it at
+# a shared backend (file or Redis) so invalidations reach every worker process.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'reference': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'reference',
+    },
+}
+if os.environ.get('REFERENCE_CACHE_REDIS_URL'):
+    CACHES['reference'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REFERENCE_CACHE_REDIS_URL'],
+    }
+elif os.environ.get('REFERENCE_CACHE_DIR'):
+    CACHES['reference'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ['REFERENCE_CACHE_DIR'],
+    }
+
+REFERENCE_CACHE_ALIAS = 'reference'
+# Seconds a reference entry lives; admin changes retire entries sooner
+REFERENCE_CACHE_TIMEOUT = 60 * 60
+
+# Seconds a prebuilt bus seat map stays cached; seat and bus changes retire it sooner through the reference generation
+SEAT_MAP_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Minutes that seats stay held between checkout and confirmation
+SEAT_HOLD_MINUTES = 10
+
+# Days after travel before a booking moves to the archive tables (python manage.py archive_bookings)
+BOOKING_ARCHIVE_AFTER_DAYS = 7
+
+# Live seat updates: set a Redis URL to share them across processes; otherwise they stay in-process
+SEAT_EVENTS_REDIS_URL = os.environ.get('SEAT_EVENTS_REDIS_URL', '')
+# Seconds a seat event stream stays open before the browser reconnects, and between keepalives (ASGI only)
+SEAT_EVENTS_STREAM_SECONDS = 300
+SEAT_EVENTS_KEEPALIVE_SECONDS = 15
+# Under WSGI, where a stream would pin a worker thread, seconds between the page's snapshot polls
+SEAT_EVENTS_POLL_SECONDS = 3
+
+# Bookings per dashboard page
+DASHBOARD_PAGE_SIZE = 20
+
+# Minimum minutes between legs when the journey planner combines buses
+JOURNEY_MIN_TRANSFER_MINUTES = 30
+
+# Most queries a view should run per request, by URL name; more logs a warning.
+# check_query_budgets fails if any booking view lacks a budget or goes over it.
+QUERY_BUDGETS = {
+    'booking:home': 6,
+    'booking:location_suggestions': 2,
+    'booking:buses': 8,
+    'booking:journeys': 10,
+    'booking:seat_selection': 12,
+    'booking:seat_events': 4,
+    'booking:checkout': 18,
+    'booking:confirm_booking': 4,
+    'booking:booking_confirmation': 5,
+    'booking:dashboard': 6,
+    'booking:cancel_booking': 10,
+    'api:routes': 4,
+    'api:trips': 6,
+    'api:seat_map': 6,
+}
+# Scrapers send this in an "Authorization: Bearer <token>" header to read /metrics/; empty disables it
+METRICS_BEARER_TOKEN = os.environ.get('METRICS_BEARER_TOKEN', '')
+# Client addresses allowed to scrape /metrics/ without a token or staff login. Behind a reverse
+# proxy every request comes from the proxy's address, so only list addresses no proxy uses
+METRICS_ALLOWED_IPS = []
+
+# Where admin CSV exports are written by their background threads
+ADMIN_EXPORT_DIR = BASE_DIR / 'exports'
+
 # Login URLs
 LOGIN_URL = 'accounts:login'
 LOGIN_REDIRECT_URL = 'home'
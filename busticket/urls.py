@@ -4,8 +4,12 @@ URL configuration for busticket project.
 from django.contrib import admin
 from django.urls import path, include
 
+from .instrumentation import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics/', metrics_view, name='metrics'),
+    path('api/', include('booking.api_urls')),
     path('', include('booking.urls')),
     path('accounts/', include('accounts.urls')),
 ]